@@ -0,0 +1,298 @@
+"""Bulk insight precomputation: every filter combination, paced and checkpointed, into the insight cache
+
+Usage:
+    python batch_insights.py --levels collection,state,year --rpm 30
+    python batch_insights.py --collections crimes,aqi --job-id nightly-2024-06-01 --concurrency 2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Iterable, Set
+
+from pydantic import BaseModel
+from pymongo import UpdateOne
+
+from ratelimit import TokenBucket
+
+LEVELS = ("collection", "state", "year", "state_year")
+KINDS = ("insights", "enhanced")
+# Outcomes that count as finished; a resumed job skips these
+DONE_STATUSES = ("generated", "cached", "empty")
+
+
+class BatchStats(BaseModel):
+    job_id: str
+    combinations: int = 0
+    skipped: int = 0
+    generated: int = 0
+    cached: int = 0
+    empty: int = 0
+    failed: int = 0
+    retries: int = 0
+    rate_limited: int = 0
+    duration_seconds: float = 0.0
+    errors: List[str] = []
+
+
+def enumerate_combinations(metadata: Iterable[Any], kinds: Iterable[str] = ("insights",),
+                           levels: Iterable[str] = LEVELS) -> List[Dict[str, Any]]:
+    """
+    Filter combinations to precompute, from collection metadata (available states and years).
+
+    Coarse levels come first, so a job cut short has still covered the combinations most
+    dashboards start from.
+    """
+    levels = [level for level in LEVELS if level in set(levels)]
+    combinations = []
+    for level in levels:
+        for meta in metadata:
+            states = [[state] for state in meta.available_states]
+            years = [[year] for year in meta.available_years]
+            if level == "collection":
+                filters = [(None, None)]
+            elif level == "state":
+                filters = [(s, None) for s in states]
+            elif level == "year":
+                filters = [(None, y) for y in years]
+            else:
+                filters = [(s, y) for s in states for y in years]
+            for kind in kinds:
+                combinations.extend(
+                    {"kind": kind, "collection": meta.collection, "states": s, "years": y, "level": level}
+                    for s, y in filters
+                )
+    return combinations
+
+
+class Pacer:
+    """
+    Spaces out LLM calls below the provider's rate limit.
+
+    A token bucket sets the steady rate. A 429 pauses every worker until the provider's
+    Retry-After has passed and halves the rate; successes then win it back gradually.
+    """
+
+    def __init__(self, requests_per_minute: float, burst: float = 1.0, min_per_minute: float = 1.0):
+        self.max_rate = requests_per_minute / 60.0
+        self.min_rate = min(min_per_minute, requests_per_minute) / 60.0
+        self.bucket = TokenBucket(self.max_rate, burst, time.monotonic())
+        self.paused_until = 0.0
+
+    async def wait(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            delay = self.bucket.take(now)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    def rate_limited(self, retry_after: Optional[float]) -> None:
+        self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+        pause = retry_after if retry_after is not None else 1 / self.bucket.rate
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def succeeded(self) -> None:
+        # Additive increase: the full rate is regained after a few dozen successful calls
+        self.bucket.rate = min(self.max_rate, self.bucket.rate + self.max_rate / 20)
+
+    @property
+    def requests_per_minute(self) -> float:
+        return round(self.bucket.rate * 60, 2)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Retry-After sent with a provider error, if any"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_rate_limit(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+class BatchCheckpoint:
+    """Per-combination outcomes of a job, written in bulk so an interrupted job resumes where it stopped"""
+
+    def __init__(self, items, jobs, job_id: str, flush_every: int = 50):
+        self.items = items
+        self.jobs = jobs
+        self.job_id = job_id
+        self.flush_every = flush_every
+        self._pending: List[UpdateOne] = []
+
+    async def ensure_indexes(self) -> None:
+        try:
+            await self.items.create_index([("job_id", 1), ("status", 1)])
+        except Exception as e:
+            logging.error(f"Error creating batch checkpoint index: {e}")
+
+    async def finished_keys(self) -> Set[str]:
+        cursor = self.items.find({"job_id": self.job_id, "status": {"$in": list(DONE_STATUSES)}}, {"key": 1})
+        return {doc["key"] async for doc in cursor}
+
+    async def record(self, key: str, combination: Dict[str, Any], status: str, attempts: int,
+                     error: Optional[str] = None) -> None:
+        self._pending.append(UpdateOne(
+            {"_id": f"{self.job_id}:{key}"},
+            {"$set": {"job_id": self.job_id, "key": key, "combination": combination, "status": status,
+                      "attempts": attempts, "error": error, "updated_at": datetime.utcnow()}},
+            upsert=True,
+        ))
+        if len(self._pending) >= self.flush_every:
+            await self.flush()
+
+    async def flush(self, stats: Optional[BatchStats] = None) -> None:
+        pending, self._pending = self._pending, []
+        try:
+            if pending:
+                await self.items.bulk_write(pending, ordered=False)
+            if stats is not None:
+                await self.jobs.replace_one(
+                    {"_id": self.job_id}, {"stats": stats.dict(), "updated_at": datetime.utcnow()}, upsert=True
+                )
+        except Exception as e:
+            logging.error(f"Batch checkpoint write error: {e}")
+
+
+async def run_batch(combinations: List[Dict[str, Any]],
+                    key_for: Callable[[Dict[str, Any]], str],
+                    generate: Callable[[Dict[str, Any], Callable[[], Awaitable[None]]], Awaitable[str]],
+                    checkpoint: BatchCheckpoint, pacer: Pacer, concurrency: int = 4, retries: int = 3,
+                    base_delay: float = 2.0, resume: bool = True) -> BatchStats:
+    """
+    Run `generate` over every combination not finished by an earlier run of the same job.
+
+    `generate(combination, pace)` returns the outcome ("generated", "cached" or "empty") and
+    raises on failure. It awaits `pace()` right before calling the LLM, so combinations that are
+    already cached or have no data go by at full speed. Failures are retried with exponential
+    backoff and jitter; 429s also slow down the shared pacer.
+    """
+    started = time.perf_counter()
+    stats = BatchStats(job_id=checkpoint.job_id, combinations=len(combinations))
+    finished = await checkpoint.finished_keys() if resume else set()
+    queue: asyncio.Queue = asyncio.Queue()
+    for combination in combinations:
+        key = key_for(combination)
+        if key in finished:
+            stats.skipped += 1
+        else:
+            queue.put_nowait((key, combination))
+    logging.info(f"Batch {stats.job_id}: {queue.qsize()} of {len(combinations)} combinations to run")
+
+    async def process(key: str, combination: Dict[str, Any]) -> None:
+        for attempt in range(1, retries + 2):
+            try:
+                status = await generate(combination, pacer.wait)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if is_rate_limit(e):
+                    stats.rate_limited += 1
+                    pacer.rate_limited(retry_after_seconds(e))
+                if attempt > retries:
+                    stats.failed += 1
+                    if len(stats.errors) < 20:
+                        stats.errors.append(f"{combination['collection']} {key[:12]}: {e!r}")
+                    await checkpoint.record(key, combination, "failed", attempt, repr(e))
+                    return
+                stats.retries += 1
+                await asyncio.sleep(base_delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+                continue
+            if status == "generated":
+                pacer.succeeded()
+            setattr(stats, status, getattr(stats, status) + 1)
+            await checkpoint.record(key, combination, status, attempt)
+            return
+
+    async def worker() -> None:
+        while not queue.empty():
+            key, combination = queue.get_nowait()
+            await process(key, combination)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    finally:
+        stats.duration_seconds = round(time.perf_counter() - started, 2)
+        # Also on Ctrl-C/cancellation, so the next run resumes from here
+        await checkpoint.flush(stats)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Precompute insights for every filter combination into the insight cache")
+    parser.add_argument("--collections", help="Comma-separated collections (default: all)")
+    parser.add_argument("--kinds", default="insights", help=f"Comma-separated insight kinds: {', '.join(KINDS)}")
+    parser.add_argument("--levels", default=",".join(LEVELS), help=f"Comma-separated levels: {', '.join(LEVELS)}")
+    parser.add_argument("--concurrency", type=int, default=4, help="Combinations in flight")
+    parser.add_argument("--rpm", type=float, default=float(os.environ.get('BATCH_INSIGHTS_RPM', 30)),
+                        help="LLM requests per minute")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per combination")
+    parser.add_argument("--job-id", help="Checkpoint name; rerunning a job skips what it finished "
+                                         "(default: batch-<UTC date>)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the job's checkpoint")
+    parser.add_argument("--refresh", action="store_true", help="Regenerate insights that are already cached")
+    parser.add_argument("--ttl-hours", type=float, default=float(os.environ.get('BATCH_INSIGHTS_TTL_HOURS', 36)),
+                        help="Lifetime of the precomputed insights")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the combinations")
+    args = parser.parse_args(argv)
+
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+    levels = [level.strip() for level in args.levels.split(",") if level.strip()]
+    unknown = [k for k in kinds if k not in KINDS] + [level for level in levels if level not in LEVELS]
+    if unknown:
+        parser.error(f"Unknown kinds/levels: {', '.join(unknown)}")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # Generates through the server's own prompts, cache keys and LLM client
+    import server
+
+    async def run():
+        try:
+            await server.data_versions.load_manifests(server.manifests)
+            names = ([c.strip() for c in args.collections.split(",") if c.strip()] if args.collections
+                     else await server.registry.collection_names())
+            metadata = await asyncio.gather(*(server.get_collection_metadata(name) for name in names))
+            combinations = enumerate_combinations(metadata, kinds, levels)
+            if args.dry_run:
+                counts = Counter(f"{c['kind']}:{c['collection']}:{c['level']}" for c in combinations)
+                return {"combinations": len(combinations), "by_kind_collection_level": dict(counts)}
+
+            await server.insight_cache.ensure_indexes()
+            job_id = args.job_id or f"batch-{datetime.utcnow().date().isoformat()}"
+            checkpoint = BatchCheckpoint(server.cache_db["insight_batch_items"], server.cache_db["insight_batch_jobs"],
+                                         job_id)
+            await checkpoint.ensure_indexes()
+            stats = await run_batch(
+                combinations,
+                server.batch_insight_key,
+                lambda c, pace: server.precompute_insight(c, pace, refresh=args.refresh,
+                                                          ttl_seconds=args.ttl_hours * 3600),
+                checkpoint,
+                Pacer(args.rpm),
+                concurrency=args.concurrency,
+                retries=args.retries,
+                resume=not args.restart,
+            )
+            return stats.dict()
+        finally:
+            server.mongo.close()
+
+    result = asyncio.run(run())
+    print(json.dumps(result, indent=2))
+    return 1 if result.get("failed") else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,299 @@
+"""Caches for collection metadata, query results and generated insights"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Callable
+
+from states import canonical_state_names
+
+
+def normalize_filters(states: Optional[List[str]] = None, years: Optional[List[int]] = None,
+                      crime_types: Optional[List[str]] = None, **extra) -> Dict[str, Any]:
+    """Order-independent representation of a filter combination"""
+    normalized = {
+        "states": sorted(set(canonical_state_names(states))) if states else None,
+        "years": sorted(set(int(y) for y in years)) if years else None,
+        "crime_types": sorted(set(crime_types)) if crime_types else None,
+    }
+    normalized.update(extra)
+    return normalized
+
+
+def canonical_key(*parts: Any) -> str:
+    """Stable hash of JSON-serializable key parts"""
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CollectionRegistry:
+    """Cached list of data collections and their filter metadata"""
+
+    def __init__(self, database, ttl_seconds: float = 900):
+        self.database = database
+        self.ttl_seconds = ttl_seconds
+        self._names: Optional[List[str]] = None
+        self._names_loaded_at = 0.0
+        self._metadata: Dict[str, Any] = {}
+
+    def _fresh(self, loaded_at: float) -> bool:
+        return time.monotonic() - loaded_at < self.ttl_seconds
+
+    async def collection_names(self) -> List[str]:
+        """Non-system collection names, refreshed at most once per TTL"""
+        if self._names is None or not self._fresh(self._names_loaded_at):
+            names = await self.database.list_collection_names()
+            self._names = sorted(name for name in names if not name.startswith('system.'))
+            self._names_loaded_at = time.monotonic()
+        return self._names
+
+    def get_metadata(self, collection_name: str) -> Optional[Any]:
+        entry = self._metadata.get(collection_name)
+        if entry and self._fresh(entry[0]):
+            return entry[1]
+        return None
+
+    def set_metadata(self, collection_name: str, metadata: Any) -> None:
+        self._metadata[collection_name] = (time.monotonic(), metadata)
+
+    def invalidate(self, collection_name: Optional[str] = None) -> None:
+        if collection_name is None:
+            self._names = None
+            self._metadata.clear()
+        else:
+            self._metadata.pop(collection_name, None)
+
+
+class InsightCache:
+    """Generated insights kept in process memory in front of a Mongo collection"""
+
+    def __init__(self, collection, ttl_seconds: float = 21600, max_entries: int = 1024):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def ensure_indexes(self) -> None:
+        """Let Mongo expire stale insights on its own"""
+        try:
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        except Exception as e:
+            logging.error(f"Error creating insight cache index: {e}")
+
+    def _remember(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._memory.get(key)
+        if entry and entry[0] > time.time():
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        try:
+            doc = await self.collection.find_one({"_id": key}, {"_id": 0, "value": 1, "expires_at": 1})
+        except Exception as e:
+            logging.error(f"Insight cache read error: {e}")
+            doc = None
+        remaining = (doc["expires_at"] - datetime.utcnow()).total_seconds() if doc else 0
+        if remaining > 0:
+            self._remember(key, doc["value"], time.time() + remaining)
+            self.hits += 1
+            return doc["value"]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any], ttl_seconds: Optional[float] = None, **context) -> None:
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl_seconds)
+        self._remember(key, value, time.time() + ttl_seconds)
+        try:
+            await self.collection.replace_one(
+                {"_id": key},
+                {"value": value, "context": context, "created_at": datetime.utcnow(), "expires_at": expires_at},
+                upsert=True,
+            )
+        except Exception as e:
+            logging.error(f"Insight cache write error: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory)}
+
+
+class DataVersions:
+    """Per-collection data versions, bumped by a change stream or by the ingest path"""
+
+    def __init__(self, trust_ingest: bool = False):
+        self._versions: Dict[str, int] = {}
+        # Versions persisted in dataset manifests by the ingest path, shared by all processes
+        self._manifest_versions: Dict[str, int] = {}
+        self._listeners: List[Callable[[str, int], None]] = []
+        # Without a running change stream only writes made through bump() are seen
+        self.trust_ingest = trust_ingest
+        self.watching = False
+
+    @property
+    def reliable(self) -> bool:
+        """Whether every data change is guaranteed to bump a version"""
+        return self.watching or self.trust_ingest
+
+    def get(self, collection_name: str) -> int:
+        return self._versions.get(collection_name, 0)
+
+    def bump(self, collection_name: str) -> int:
+        version = self._versions.get(collection_name, 0) + 1
+        self._versions[collection_name] = version
+        for listener in self._listeners:
+            try:
+                listener(collection_name, version)
+            except Exception as e:
+                logging.error(f"Data version listener error: {e}")
+        return version
+
+    def manifest_version(self, collection_name: str) -> int:
+        return self._manifest_versions.get(collection_name, 0)
+
+    def record_ingest(self, collection_name: str, manifest_version: int) -> None:
+        """Ingest hook: adopt the new manifest version and invalidate the collection"""
+        self._manifest_versions[collection_name] = manifest_version
+        self.bump(collection_name)
+
+    def observe_manifest(self, collection_name: str, manifest_version: int) -> None:
+        """Adopt a manifest version read from Mongo; a change since the last read bumps the collection"""
+        previous = self._manifest_versions.get(collection_name)
+        self._manifest_versions[collection_name] = manifest_version
+        if previous is not None and previous != manifest_version:
+            self.bump(collection_name)
+
+    async def load_manifests(self, manifests) -> None:
+        docs = await manifests.find({}, {"version": 1}).to_list(None)
+        for doc in docs:
+            self.observe_manifest(doc["_id"], doc.get("version", 0))
+
+    async def follow_manifests(self, manifests, interval: float = 30) -> None:
+        """Poll dataset manifests so ingests run by other processes invalidate this one's caches"""
+        while True:
+            try:
+                await self.load_manifests(manifests)
+            except Exception as e:
+                logging.error(f"Error reading dataset manifests: {e}")
+            await asyncio.sleep(interval)
+
+    def bump_all(self) -> None:
+        for collection_name in list(self._versions):
+            self.bump(collection_name)
+
+    def subscribe(self, listener: Callable[[str, int], None]) -> None:
+        self._listeners.append(listener)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "versions": dict(self._versions),
+            "manifest_versions": dict(self._manifest_versions),
+            "watching": self.watching,
+            "reliable": self.reliable,
+        }
+
+    async def watch(self, database, retry_seconds: float = 5) -> None:
+        """Follow a database-wide change stream and bump the touched collection until cancelled"""
+        while True:
+            try:
+                async with database.watch([{"$project": {"ns": 1, "operationType": 1}}]) as stream:
+                    self.watching = True
+                    # Changes may have been missed while the stream was down
+                    self.bump_all()
+                    logging.info("Watching change stream for data versions")
+                    async for change in stream:
+                        collection_name = change.get("ns", {}).get("coll")
+                        if collection_name:
+                            self.bump(collection_name)
+                        elif change.get("operationType") in ("dropDatabase", "invalidate"):
+                            self.bump_all()
+            except asyncio.CancelledError:
+                self.watching = False
+                raise
+            except Exception as e:
+                if self.watching:
+                    logging.error(f"Change stream error, retrying in {retry_seconds}s: {e}")
+                elif self.trust_ingest:
+                    logging.warning(f"Change streams unavailable ({e}); result cache relies on ingest hooks")
+                else:
+                    logging.warning(f"Change streams unavailable ({e}); result cache disabled "
+                                    f"(set RESULT_CACHE_TRUST_INGEST=true if all writes go through ingest)")
+                self.watching = False
+            await asyncio.sleep(retry_seconds)
+
+
+class ResultCache:
+    """LRU cache of query results bounded by serialized size and keyed to data versions"""
+
+    def __init__(self, versions: DataVersions, max_bytes: int = 64 * 1024 * 1024):
+        self.versions = versions
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _drop(self, key: str) -> None:
+        _, _, size, _ = self._entries.pop(key)
+        self.bytes_used -= size
+
+    def get(self, key: str, collection_name: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] == self.versions.get(collection_name) and self.versions.reliable:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[3]
+            self._drop(key)
+        self.misses += 1
+        return None
+
+    def set(self, key: str, collection_name: str, value: Any, version: int) -> None:
+        """
+        Store a result computed against data `version`, read before the query ran. If the data
+        changed while it ran the result may be stale, so it isn't stored under the new version.
+        """
+        if not self.versions.reliable or version != self.versions.get(collection_name):
+            return
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (collection_name, version, size, value)
+        self.bytes_used += size
+        while self.bytes_used > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def invalidate(self, collection_name: str, version: Optional[int] = None) -> None:
+        """Eagerly free entries for a collection whose data version changed"""
+        for key in [k for k, entry in self._entries.items() if entry[0] == collection_name]:
+            self._drop(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            # Off without a change stream or trusted ingest hooks: every lookup misses and nothing is stored
+            "enabled": self.versions.reliable,
+            "version_source": ("change_stream" if self.versions.watching
+                               else "ingest" if self.versions.trust_ingest else None),
+            "entries": len(self._entries),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
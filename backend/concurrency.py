@@ -0,0 +1,56 @@
+"""Dependency-aware concurrent execution of the async stages inside a request"""
+import asyncio
+from typing import Dict, Any, Callable, Awaitable, Sequence, Tuple, List
+
+# A stage is a coroutine function plus the names of the stages whose results it takes as arguments
+Stage = Tuple[Callable[..., Awaitable[Any]], Sequence[str]]
+
+
+def _execution_order(stages: Dict[str, Stage]) -> List[str]:
+    """Topological order of the stages; rejects unknown dependencies and cycles"""
+    order: List[str] = []
+    visiting = set()
+
+    def visit(name: str, path: Tuple[str, ...]):
+        if name in order:
+            return
+        if name not in stages:
+            raise ValueError(f"Stage '{path[-1]}' depends on unknown stage '{name}'")
+        if name in visiting:
+            raise ValueError(f"Stage dependency cycle: {' -> '.join(path + (name,))}")
+        visiting.add(name)
+        for dependency in stages[name][1]:
+            visit(dependency, path + (name,))
+        visiting.discard(name)
+        order.append(name)
+
+    for name in stages:
+        visit(name, ())
+    return order
+
+
+async def run_stages(stages: Dict[str, Stage]) -> Dict[str, Any]:
+    """
+    Start every stage as soon as its dependencies have finished and return all results by name.
+
+    If any stage fails, every stage still running is cancelled and the first error is raised,
+    so a request costs its critical path rather than the sum of its round-trips.
+    """
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(name: str):
+        function, dependencies = stages[name]
+        arguments = [await tasks[dependency] for dependency in dependencies]
+        return await function(*arguments)
+
+    for name in _execution_order(stages):
+        tasks[name] = asyncio.ensure_future(run(name))
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return {name: task.result() for name, task in tasks.items()}
@@ -0,0 +1,272 @@
+"""Joined state×year feature matrix across datasets and vectorized (lagged) Pearson/Spearman correlations"""
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from typing import List, Dict, Any, Optional, Sequence, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+from deadlines import create_background_task
+from states import document_state_id
+
+METHODS = ("pearson", "spearman")
+
+# Collections joined into the matrix; every measure column of each becomes a feature
+CORRELATED_COLLECTIONS = ("crimes", "aqi", "literacy", "covid_stats")
+# Ratios of two features computed after the join: name -> (numerator, denominator)
+DERIVED_FEATURES = {
+    "covid_stats.mortality_rate": ("covid_stats.deaths", "covid_stats.confirmed"),
+}
+# Correlations over fewer overlapping state-years than this are too noisy to report
+MIN_OBSERVATIONS = 5
+
+
+def rank_columns(values: np.ndarray) -> np.ndarray:
+    """Average ranks of each column's non-missing values (ties share their mean rank); NaN stays NaN"""
+    import numpy as np
+    ranks = np.full(values.shape, np.nan)
+    for j in range(values.shape[1]):
+        present = np.flatnonzero(~np.isnan(values[:, j]))
+        if not len(present):
+            continue
+        column = values[present, j]
+        order = np.argsort(column, kind="stable")
+        sorted_values = column[order]
+        # First position of each distinct value and its run length give the average rank of ties
+        starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+        lengths = np.diff(np.r_[starts, len(column)])
+        average = starts + (lengths - 1) / 2.0 + 1
+        ranks[present[order], j] = np.repeat(average, lengths)
+    return ranks
+
+
+def pairwise_pearson(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pearson r between every column of x and every column of y over the rows where both are present.
+
+    Pairwise-complete sums come from matrix products of the zero-filled values with the presence
+    masks, so all feature pairs are computed at once instead of one masked pair at a time.
+    Returns (r, n): r is NaN where fewer than MIN_OBSERVATIONS rows overlap or a column is constant.
+    """
+    import numpy as np
+    mx, my = ~np.isnan(x), ~np.isnan(y)
+    x0, y0 = np.where(mx, x, 0.0), np.where(my, y, 0.0)
+    fx, fy = mx.astype(np.float64), my.astype(np.float64)
+    n = fx.T @ fy
+    sum_x = x0.T @ fy              # sum of x_i over rows where y_j is present
+    sum_y = fx.T @ y0              # sum of y_j over rows where x_i is present
+    sum_xx = (x0 * x0).T @ fy
+    sum_yy = fx.T @ (y0 * y0)
+    sum_xy = x0.T @ y0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariance = sum_xy - sum_x * sum_y / n
+        variance_x = sum_xx - sum_x ** 2 / n
+        variance_y = sum_yy - sum_y ** 2 / n
+        r = covariance / np.sqrt(variance_x * variance_y)
+    r[(n < MIN_OBSERVATIONS) | ~np.isfinite(r)] = np.nan
+    return np.clip(r, -1.0, 1.0), n.astype(np.int64)
+
+
+class FeatureMatrix:
+    """One row per (state_id, year), one column per dataset measure; NaN where a dataset has no data"""
+
+    def __init__(self, keys: np.ndarray, names: List[str], values: np.ndarray, versions: Dict[str, int]):
+        self.keys = keys                # (rows, 2) int64: state_id, year
+        self.names = names
+        self.values = values            # (rows, features) float64
+        self.versions = versions
+        self.built_at = time.time()
+        self._row_index = {(int(s), int(y)): i for i, (s, y) in enumerate(keys)}
+
+    def columns(self, features: Sequence[str]) -> List[int]:
+        unknown = [f for f in features if f not in self.names]
+        if unknown:
+            raise ValueError(f"Unknown features: {', '.join(unknown)}")
+        return [self.names.index(f) for f in features]
+
+    def mask(self, state_ids: Optional[List[int]] = None, years: Optional[List[int]] = None) -> np.ndarray:
+        import numpy as np
+        selected = np.ones(len(self.keys), dtype=bool)
+        if state_ids:
+            selected &= np.isin(self.keys[:, 0], state_ids)
+        if years:
+            selected &= np.isin(self.keys[:, 1], years)
+        return selected
+
+    def shifted(self, lag: int) -> np.ndarray:
+        """Values `lag` years later for the same state, aligned to each row (NaN if missing)"""
+        import numpy as np
+        if lag == 0:
+            return self.values
+        later = np.array([self._row_index.get((int(s), int(y) + lag), -1) for s, y in self.keys])
+        shifted = np.full(self.values.shape, np.nan)
+        found = later >= 0
+        shifted[found] = self.values[later[found]]
+        return shifted
+
+    def correlate(self, features: Sequence[str], method: str = "pearson", max_lag: int = 0,
+                  selected: Optional[np.ndarray] = None, top: int = 10) -> Dict[str, Any]:
+        """Correlation matrix at lag 0 and the strongest (possibly lagged) pairs, x leading y by `lag` years"""
+        import numpy as np
+        columns = self.columns(features)
+        selected = np.ones(len(self.keys), dtype=bool) if selected is None else selected
+        x = self.values[selected][:, columns]
+        matrix, observations = self._correlate(x, x, method)
+
+        pairs = []
+        for lag in range(0, max_lag + 1):
+            if lag:
+                y = self.shifted(lag)[selected][:, columns]
+                r, n = self._correlate(x, y, method)
+            else:
+                r, n = matrix, observations
+            for i, j in zip(*np.nonzero(~np.isnan(r))):
+                # At lag 0 the matrix is symmetric and the diagonal is trivially 1
+                if lag == 0 and i >= j:
+                    continue
+                pairs.append({"x": features[i], "y": features[j], "lag": lag,
+                              "r": round(float(r[i, j]), 4), "n": int(n[i, j])})
+        pairs.sort(key=lambda p: -abs(p["r"]))
+
+        return {
+            "method": method,
+            "features": list(features),
+            "rows": int(selected.sum()),
+            "matrix": {
+                features[i]: {features[j]: None if np.isnan(matrix[i, j]) else round(float(matrix[i, j]), 4)
+                              for j in range(len(features))}
+                for i in range(len(features))
+            },
+            "pairs": pairs[:top],
+        }
+
+    @staticmethod
+    def _correlate(x: np.ndarray, y: np.ndarray, method: str) -> Tuple[np.ndarray, np.ndarray]:
+        if method == "spearman":
+            # Ranks are taken over each column's present values, then correlated pairwise-complete
+            return pairwise_pearson(rank_columns(x), rank_columns(y))
+        return pairwise_pearson(x, y)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"rows": len(self.keys), "features": self.names, "versions": self.versions}
+
+
+class CorrelationStore:
+    """The joined feature matrix, rebuilt from per-dataset state-year aggregates when any input version moves"""
+
+    def __init__(self, database, profiles, versions, collections: Sequence[str] = CORRELATED_COLLECTIONS,
+                 ttl_seconds: float = 900):
+        self.database = database
+        self.profiles = profiles
+        self.versions = versions
+        self.collections = list(collections)
+        self.ttl_seconds = ttl_seconds
+        self.matrix: Optional[FeatureMatrix] = None
+        self.last_build: Dict[str, Any] = {}
+        self._build: Optional[asyncio.Task] = None
+
+    def _current_versions(self) -> Dict[str, int]:
+        return {name: self.versions.get(name) for name in self.collections}
+
+    def _fresh(self) -> bool:
+        if self.matrix is None or self.matrix.versions != self._current_versions():
+            return False
+        return self.versions.reliable or time.time() - self.matrix.built_at < self.ttl_seconds
+
+    async def load(self) -> FeatureMatrix:
+        if self._fresh():
+            return self.matrix
+        if self._build is None or self._build.done():
+            # Detached so it runs under the background limit, not the deadline of the first caller
+            self._build = create_background_task(self.build())
+        # Shielded so a request hitting its deadline doesn't throw away a build others wait on
+        return await asyncio.shield(self._build)
+
+    async def state_year_features(self, collection_name: str) -> Dict[str, Dict[Tuple[int, int], float]]:
+        """feature -> {(state_id, year): value} using each measure's default aggregation from its profile"""
+        profile = await self.profiles.load(collection_name)
+        columns = {c["name"]: c for c in profile["columns"]}
+        measures = [c for c in profile["columns"] if c["role"] == "measure"]
+        if not measures or ("state_id" not in columns and "state" not in columns):
+            return {}
+        if "year" in columns and columns["year"]["role"] == "temporal":
+            year = "$year"
+        elif columns.get("date", {}).get("type") == "temporal":
+            year = {"$substr": ["$date", 0, 4]}
+        else:
+            return {}
+        # Counts add up over a state-year; rates and indices are averaged
+        averaged = {m["name"]: not (m.get("integer") and (m.get("min") or 0) >= 0) for m in measures}
+        accumulators = {name: {"$avg" if avg else "$sum": f"${name}"} for name, avg in averaged.items()}
+        pipeline = [
+            # Documents without a state_id are grouped by their stored name and placed below
+            {"$group": {"_id": {"state": {"$ifNull": ["$state_id", "$state"]}, "year": year},
+                        "_rows": {"$sum": 1}, **accumulators}},
+        ]
+        features: Dict[str, Dict[Tuple[int, int], float]] = {f"{collection_name}.{m}": {} for m in accumulators}
+        # Rows behind each averaged cell, to weight groups that land on the same state-year
+        weights: Dict[Tuple[str, Tuple[int, int]], int] = {}
+        async for row in self.database.background()[collection_name].aggregate(pipeline):
+            key = row["_id"]
+            state_id = document_state_id({"state_id": key.get("state"), "state": key.get("state")})
+            if state_id is None or key.get("year") in (None, ""):
+                continue
+            cell = (state_id, int(key["year"]))
+            for measure in accumulators:
+                value = row.get(measure)
+                if not isinstance(value, (int, float)):
+                    continue
+                cells = features[f"{collection_name}.{measure}"]
+                if cell not in cells:
+                    cells[cell] = float(value)
+                elif averaged[measure]:
+                    seen = weights.get((measure, cell), 0)
+                    cells[cell] = (cells[cell] * seen + value * row["_rows"]) / (seen + row["_rows"])
+                else:
+                    cells[cell] += value
+                weights[(measure, cell)] = weights.get((measure, cell), 0) + row["_rows"]
+        return features
+
+    async def build(self) -> FeatureMatrix:
+        import numpy as np
+        versions = self._current_versions()
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.state_year_features(name) for name in self.collections),
+                                       return_exceptions=True)
+        features: Dict[str, Dict[Tuple[int, int], float]] = {}
+        for name, result in zip(self.collections, results):
+            if isinstance(result, Exception):
+                logging.error(f"Error aggregating {name} for correlations: {result}")
+                continue
+            features.update(result)
+
+        keys = sorted({cell for cells in features.values() for cell in cells})
+        names = sorted(features)
+        values = np.full((len(keys), len(names)), np.nan)
+        row_of = {cell: i for i, cell in enumerate(keys)}
+        for j, name in enumerate(names):
+            for cell, value in features[name].items():
+                values[row_of[cell], j] = value
+        for derived, (numerator, denominator) in DERIVED_FEATURES.items():
+            if numerator in names and denominator in names:
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    ratio = values[:, names.index(numerator)] / values[:, names.index(denominator)]
+                values = np.column_stack([values, np.where(np.isfinite(ratio), ratio, np.nan)])
+                names.append(derived)
+
+        matrix = self.matrix = FeatureMatrix(np.array(keys, dtype=np.int64).reshape(-1, 2), names, values, versions)
+        self.last_build = {
+            "rows": len(keys),
+            "features": len(names),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        logging.info(f"Built correlation feature matrix: {self.last_build}")
+        return matrix
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "matrix": self.matrix.snapshot() if self.matrix is not None else None,
+            "last_build": self.last_build,
+        }
@@ -0,0 +1,362 @@
+"""MongoDB access layer with pool tuning, read preferences and per-query limits"""
+import asyncio
+import os
+import logging
+import threading
+import time
+from collections import deque
+from importlib.util import find_spec
+from typing import List, Dict, Any, Optional, Callable
+
+from pydantic import BaseModel
+from pymongo import monitoring
+from pymongo.read_preferences import read_pref_mode_from_name, make_read_preference
+
+from deadlines import remaining_ms
+
+# Wire compressors in order of preference and the packages pymongo needs for them
+COMPRESSOR_PACKAGES = {"zstd": "zstandard", "snappy": "snappy", "zlib": None}
+
+# Endpoint classes: interactive analytics may read from secondaries, everything else stays on primary
+WORKLOAD_PRIMARY = "primary"
+WORKLOAD_ANALYTICS = "analytics"
+
+
+class DatabaseSettings(BaseModel):
+    max_pool_size: int = 100
+    min_pool_size: int = 10
+    max_idle_time_ms: int = 60000
+    wait_queue_timeout_ms: int = 5000
+    server_selection_timeout_ms: int = 10000
+    compressors: List[str] = ["zstd", "snappy", "zlib"]
+    default_max_time_ms: int = 5000
+    # Builders scanning whole collections outside any request; None leaves them unbounded
+    background_max_time_ms: Optional[int] = 300000
+    # Tighten maxTimeMS to whatever is left of the current request's deadline
+    propagate_deadlines: bool = True
+    read_preferences: Dict[str, str] = {
+        WORKLOAD_PRIMARY: "primary",
+        WORKLOAD_ANALYTICS: "secondaryPreferred",
+    }
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        """Load settings from MONGO_* environment variables, falling back to defaults"""
+        defaults = cls()
+        env = os.environ
+        compressors = env.get("MONGO_COMPRESSORS")
+        return cls(
+            max_pool_size=int(env.get("MONGO_MAX_POOL_SIZE", defaults.max_pool_size)),
+            min_pool_size=int(env.get("MONGO_MIN_POOL_SIZE", defaults.min_pool_size)),
+            max_idle_time_ms=int(env.get("MONGO_MAX_IDLE_TIME_MS", defaults.max_idle_time_ms)),
+            wait_queue_timeout_ms=int(env.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", defaults.wait_queue_timeout_ms)),
+            server_selection_timeout_ms=int(
+                env.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", defaults.server_selection_timeout_ms)
+            ),
+            compressors=[c.strip() for c in compressors.split(",") if c.strip()] if compressors is not None
+            else defaults.compressors,
+            default_max_time_ms=int(env.get("MONGO_MAX_TIME_MS", defaults.default_max_time_ms)),
+            background_max_time_ms=int(env.get("MONGO_BACKGROUND_MAX_TIME_MS", defaults.background_max_time_ms)) or None,
+            propagate_deadlines=env.get("MONGO_PROPAGATE_DEADLINES", "true").lower() == "true",
+            read_preferences={
+                WORKLOAD_PRIMARY: env.get("MONGO_PRIMARY_READ_PREFERENCE", "primary"),
+                WORKLOAD_ANALYTICS: env.get("MONGO_ANALYTICS_READ_PREFERENCE", "secondaryPreferred"),
+            },
+        )
+
+    def available_compressors(self) -> List[str]:
+        """Configured compressors whose optional packages are installed"""
+        available = []
+        for name in self.compressors:
+            if name not in COMPRESSOR_PACKAGES:
+                logging.warning(f"Unknown Mongo compressor '{name}' ignored")
+                continue
+            package = COMPRESSOR_PACKAGES[name]
+            if package is None or find_spec(package) is not None:
+                available.append(name)
+        return available
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool listener recording checkout wait times and pool size"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._waits_ms = deque(maxlen=window)
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.connections_open = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    # Checkout happens synchronously on the worker thread, so the start time is thread-local
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def _finish_checkout(self) -> float:
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+    def connection_checked_out(self, event):
+        wait_ms = self._finish_checkout()
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            self._waits_ms.append(wait_ms)
+
+    def connection_check_out_failed(self, event):
+        self._finish_checkout()
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._waits_ms)
+            checkouts = self.checkouts
+
+            def percentile(p: float) -> float:
+                if not waits:
+                    return 0.0
+                return round(waits[min(len(waits) - 1, int(p * len(waits)))], 3)
+
+            return {
+                "checkouts": checkouts,
+                "checkout_failures": self.checkout_failures,
+                "connections_open": self.connections_open,
+                "avg_wait_ms": round(self.total_wait_ms / checkouts, 3) if checkouts else 0.0,
+                "p50_wait_ms": percentile(0.50),
+                "p95_wait_ms": percentile(0.95),
+                "p99_wait_ms": percentile(0.99),
+                "max_wait_ms": round(self.max_wait_ms, 3),
+            }
+
+
+class ManagedCollection:
+    """
+    Collection wrapper applying default maxTimeMS and projection to every read. An explicit
+    time limit overrides the default and the request deadline; None runs without one.
+    """
+
+    def __init__(self, collection, max_time_ms: Optional[int], propagate_deadlines: bool = False):
+        self._collection = collection
+        self._max_time_ms = max_time_ms
+        self._propagate_deadlines = propagate_deadlines
+
+    @property
+    def name(self) -> str:
+        return self._collection.name
+
+    def _time_limit(self, kwargs: Dict[str, Any], key: str) -> Dict[str, Any]:
+        if key in kwargs:
+            if kwargs[key] is None:
+                del kwargs[key]
+            return kwargs
+        limit = self._max_time_ms
+        left = remaining_ms() if self._propagate_deadlines else None
+        if left is not None:
+            limit = min(limit, left) if limit else left
+        if limit:
+            kwargs[key] = limit
+        return kwargs
+
+    def find(self, filter: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None, **kwargs):
+        # Documents are never returned with their ObjectId, so don't ship it over the wire
+        return self._collection.find(
+            filter or {}, projection or {"_id": 0}, **self._time_limit(kwargs, "max_time_ms")
+        )
+
+    async def find_one(self, filter: Optional[Dict[str, Any]] = None,
+                       projection: Optional[Dict[str, Any]] = None, **kwargs):
+        return await self._collection.find_one(
+            filter or {}, projection or {"_id": 0}, **self._time_limit(kwargs, "max_time_ms")
+        )
+
+    async def count_documents(self, filter: Dict[str, Any], **kwargs) -> int:
+        return await self._collection.count_documents(filter, **self._time_limit(kwargs, "maxTimeMS"))
+
+    async def distinct(self, key: str, filter: Optional[Dict[str, Any]] = None, **kwargs) -> List[Any]:
+        return await self._collection.distinct(key, filter, **self._time_limit(kwargs, "maxTimeMS"))
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs):
+        return self._collection.aggregate(pipeline, **self._time_limit(kwargs, "maxTimeMS"))
+
+    def __getattr__(self, name: str):
+        return getattr(self._collection, name)
+
+
+class LazyHandle:
+    """
+    A Motor database or collection resolved on first use, so handles (and everything holding
+    one) can be built at import time without creating the client
+    """
+
+    def __init__(self, resolve: Callable[[], Any]):
+        self._resolve = resolve
+        self._target = None
+
+    def resolve(self):
+        if self._target is None:
+            self._target = self._resolve()
+        return self._target
+
+    def __getitem__(self, name: str) -> "LazyHandle":
+        return LazyHandle(lambda: self.resolve()[name])
+
+    def with_options(self, **kwargs) -> "LazyHandle":
+        return LazyHandle(lambda: self.resolve().with_options(**kwargs))
+
+    def __getattr__(self, name: str):
+        return getattr(self.resolve(), name)
+
+
+class Database:
+    """Database handle handing out ManagedCollections for one workload class"""
+
+    def __init__(self, database, settings: DatabaseSettings, workload: str = WORKLOAD_PRIMARY,
+                 pool_metrics: Optional[PoolMetrics] = None, background: bool = False):
+        self._database = database
+        self.settings = settings
+        self.workload = workload
+        self.pool_metrics = pool_metrics
+        self.is_background = background
+
+    @property
+    def name(self) -> str:
+        return self._database.name
+
+    @property
+    def raw(self):
+        """The underlying Motor database, for operations the wrapper doesn't cover"""
+        return self._database
+
+    def for_workload(self, workload: str) -> "Database":
+        """Same database with the read preference configured for `workload`"""
+        mode = self.settings.read_preferences.get(workload, "primary")
+        database = self._database
+        if mode != "primary":
+            database = database.with_options(
+                read_preference=make_read_preference(read_pref_mode_from_name(mode), None)
+            )
+        return Database(database, self.settings, workload, self.pool_metrics, self.is_background)
+
+    def background(self) -> "Database":
+        """
+        Same database for work that outlives any request (index builds, profiles, samples):
+        reads get the background time limit and ignore the deadline of whoever started them
+        """
+        return Database(self._database, self.settings, self.workload, self.pool_metrics, background=True)
+
+    def sibling(self, db_name: str) -> "Database":
+        """Another database on the same client, sharing settings and pool metrics"""
+        database = self._database
+        return Database(LazyHandle(lambda: database.client[db_name]), self.settings, self.workload,
+                        self.pool_metrics, self.is_background)
+
+    def __getitem__(self, collection_name: str) -> ManagedCollection:
+        if self.is_background:
+            return ManagedCollection(self._database[collection_name], self.settings.background_max_time_ms)
+        return ManagedCollection(self._database[collection_name], self.settings.default_max_time_ms,
+                                 self.settings.propagate_deadlines)
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        return await self._database.list_collection_names(**kwargs)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "workload": self.workload,
+            "pool": self.pool_metrics.snapshot() if self.pool_metrics else {},
+            "settings": self.settings.dict(),
+        }
+
+
+def create_client(mongo_url: str, settings: DatabaseSettings, pool_metrics: PoolMetrics):
+    """Build the Motor client with pool sizing, compression and pool monitoring"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    options: Dict[str, Any] = {
+        "maxPoolSize": settings.max_pool_size,
+        "minPoolSize": settings.min_pool_size,
+        "maxIdleTimeMS": settings.max_idle_time_ms,
+        "waitQueueTimeoutMS": settings.wait_queue_timeout_ms,
+        "serverSelectionTimeoutMS": settings.server_selection_timeout_ms,
+        "event_listeners": [pool_metrics],
+    }
+    compressors = settings.available_compressors()
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return AsyncIOMotorClient(mongo_url, **options)
+
+
+class MongoConnection:
+    """
+    The Motor client, created on first use rather than at import: constructing it resolves
+    mongodb+srv hosts over DNS, which would otherwise block importing the app
+    """
+
+    def __init__(self, mongo_url: str, settings: DatabaseSettings, pool_metrics: PoolMetrics):
+        self.mongo_url = mongo_url
+        self.settings = settings
+        self.pool_metrics = pool_metrics
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Also called from a worker thread at startup, so only one client is ever built
+        with self._lock:
+            if self._client is None:
+                self._client = create_client(self.mongo_url, self.settings, self.pool_metrics)
+            return self._client
+
+    async def ping(self) -> Dict[str, Any]:
+        """Create the client off the event loop if needed, then round-trip to the cluster"""
+        client = await asyncio.to_thread(lambda: self.client)
+        started = time.perf_counter()
+        await client.admin.command("ping")
+        return {"round_trip_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+def connect(mongo_url: str, db_name: str, settings: Optional[DatabaseSettings] = None):
+    """
+    Return (MongoConnection, Database) for `db_name` using settings from the environment by
+    default. Nothing connects until the database is first used or the connection is pinged.
+    """
+    settings = settings or DatabaseSettings.from_env()
+    pool_metrics = PoolMetrics()
+    connection = MongoConnection(mongo_url, settings, pool_metrics)
+    return connection, Database(LazyHandle(lambda: connection.client[db_name]), settings, pool_metrics=pool_metrics)
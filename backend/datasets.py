@@ -0,0 +1,268 @@
+"""Declarative dataset descriptors: the per-collection knowledge that query building, indexing, rollups and prompts run on"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterable
+
+from pydantic import BaseModel
+from pymongo import ASCENDING
+
+from deadlines import create_background_task
+from states import state_query, merge_conditions
+from timeseries import date_range_query
+
+TIME_TYPES = ("year", "date")
+
+
+class DatasetDescriptor(BaseModel):
+    """
+    How one collection is shaped and queried.
+
+    `time_type` "year" means an integer year field; "date" an ISO YYYY-MM-DD string, filtered by
+    date ranges. `special_filters` maps a request filter (e.g. crime_types) to the field it
+    matches. `rollup_fields` are daily measures kept in monthly time-series buckets.
+    """
+    collection: str
+    description: str = "Dataset containing various data points"
+    subject: Optional[str] = None
+    dimensions: List[str] = ["state"]
+    measures: List[str] = []
+    time_field: str = "year"
+    time_type: str = "year"
+    special_filters: Dict[str, str] = {}
+    natural_key: List[str] = ["state_id", "year"]
+    # Years shown when a chart is requested without filters; None shows the latest year
+    default_years: Optional[List[int]] = None
+    prompt_focus: List[str] = []
+    # Extra compound indexes beyond those derived from the dimensions, time field and natural key
+    indexes: List[List[str]] = []
+    rollup_fields: List[str] = []
+
+    def time_query(self, years: Optional[Iterable[int]]) -> Dict[str, Any]:
+        years = list(years or [])
+        if not years:
+            return {}
+        if self.time_type == "date":
+            return date_range_query(years, self.time_field)
+        return {self.time_field: {"$in": years}}
+
+    def year_expression(self) -> Any:
+        """$group key extracting the year"""
+        if self.time_type == "date":
+            return {"$substr": [f"${self.time_field}", 0, 4]}
+        return f"${self.time_field}"
+
+    def special_fields(self, special: Optional[Dict[str, Optional[List[Any]]]]) -> Dict[str, List[Any]]:
+        """Requested special filter values keyed by the field they match; unknown filters are ignored"""
+        return {self.special_filters[name]: values for name, values in (special or {}).items()
+                if values and name in self.special_filters}
+
+    def filter_query(self, states: Optional[List[str]] = None, years: Optional[List[int]] = None,
+                     special: Optional[Dict[str, Optional[List[Any]]]] = None) -> Dict[str, Any]:
+        query: Dict[str, Any] = {}
+        if states:
+            query.update(state_query(states))
+        merge_conditions(query, self.time_query(years))
+        for field, values in self.special_fields(special).items():
+            query[field] = {"$in": values}
+        return query
+
+    async def years(self, collection) -> List[int]:
+        """Distinct years present in the collection"""
+        values = await collection.distinct(self.time_field)
+        if self.time_type == "date":
+            return sorted({int(value[:4]) for value in values if isinstance(value, str) and value[:4].isdigit()})
+        return sorted({int(value) for value in values if isinstance(value, (int, float))})
+
+    async def default_query(self, collection) -> Dict[str, Any]:
+        """Filter for an unfiltered chart: the configured default years, else the latest year"""
+        if self.default_years:
+            return self.time_query(self.default_years)
+        years = await self.years(collection)
+        if not years:
+            return {}
+        if self.time_type == "date":
+            return self.time_query(years[-1:])
+        return {self.time_field: years[-1]}
+
+    def index_specs(self) -> List[List[str]]:
+        """Compound indexes serving the filter shapes above: state and time, special filters, upsert keys"""
+        # State filters match state_id or, for documents without one, the name
+        specs = [["state_id", self.time_field], ["state", self.time_field], [self.time_field]]
+        specs += [[field, self.time_field] for field in self.special_filters.values()]
+        specs += [list(self.natural_key)] + [list(spec) for spec in self.indexes]
+        unique: List[List[str]] = []
+        for spec in specs:
+            if spec not in unique:
+                unique.append(spec)
+        # An index that is a prefix of another adds nothing for the queries we run
+        return [spec for spec in unique if not any(other != spec and other[:len(spec)] == spec for other in unique)]
+
+    def insight_context(self, sample_size: int, fields: List[str]) -> str:
+        """Opening of the LLM prompt: what the data is and what to look for"""
+        if not self.subject:
+            return f"Analyzing data from {self.collection} with {sample_size} records."
+        focus = "\n".join(f"        {i}. {item}" for i, item in enumerate(self.prompt_focus, 1))
+        return f"""
+        Analyzing {self.subject} from Indian states. The dataset contains {sample_size} records.
+        Key fields: {', '.join(fields)}
+
+        Provide insights about:
+{focus}
+        """
+
+
+BUILTIN_DATASETS = [
+    DatasetDescriptor(
+        collection="crimes",
+        description="Crime statistics and safety data",
+        subject="crime data",
+        dimensions=["state", "crime_type"],
+        measures=["cases_reported"],
+        special_filters={"crime_types": "crime_type"},
+        natural_key=["state_id", "year", "crime_type"],
+        # Extends the natural key so the explorer's default sort by cases comes from the index
+        indexes=[["state_id", "year", "crime_type", "cases_reported"]],
+        prompt_focus=["Crime patterns across states", "Trends over time", "Most affected regions",
+                      "Crime type distribution", "Policy implications"],
+    ),
+    DatasetDescriptor(
+        collection="covid_stats",
+        description="COVID-19 statistics and trends data",
+        subject="COVID-19 statistics",
+        measures=["confirmed", "cured", "deaths"],
+        time_field="date",
+        time_type="date",
+        natural_key=["state_id", "date"],
+        default_years=[2020, 2021, 2022, 2023],
+        prompt_focus=["Mortality patterns across states", "Timeline of impacts", "Regional variations",
+                      "Public health implications", "Recovery patterns"],
+        rollup_fields=["confirmed", "cured", "deaths"],
+    ),
+    DatasetDescriptor(
+        collection="aqi",
+        description="Air Quality Index measurements",
+        subject="Air Quality Index data",
+        measures=["avg_aqi"],
+        prompt_focus=["Air pollution levels across states", "Trends over time", "Most polluted regions",
+                      "Environmental concerns", "Health implications"],
+    ),
+    DatasetDescriptor(
+        collection="literacy",
+        description="Education and literacy statistics",
+        subject="literacy rate data",
+        measures=["literacy_rate"],
+        prompt_focus=["Education levels across states", "Progress over time", "Regional disparities",
+                      "Socioeconomic factors", "Policy effectiveness"],
+    ),
+]
+
+
+def builtin_descriptor(collection_name: str) -> DatasetDescriptor:
+    """Descriptor shipped with the code, or the generic one (integer year, state dimension)"""
+    for descriptor in BUILTIN_DATASETS:
+        if descriptor.collection == collection_name:
+            return descriptor
+    return DatasetDescriptor(collection=collection_name)
+
+
+class DatasetRegistry:
+    """
+    Descriptors by collection: the built-in ones, overridden or extended by descriptors stored in
+    Mongo, so a dataset can be added by registering its descriptor rather than editing handlers.
+    Collections without a descriptor get the generic one.
+    """
+
+    def __init__(self, collection=None, builtins: Iterable[DatasetDescriptor] = BUILTIN_DATASETS,
+                 index_retry_seconds: float = 60):
+        self.collection = collection
+        self._descriptors: Dict[str, DatasetDescriptor] = {d.collection: d for d in builtins}
+        self._indexed: Dict[str, List[List[str]]] = {}
+        self._index_builds: Dict[str, asyncio.Task] = {}
+        self._index_failed_at: Dict[str, float] = {}
+        # A failed index build isn't restarted sooner than this
+        self.index_retry_seconds = index_retry_seconds
+
+    def get(self, collection_name: str) -> DatasetDescriptor:
+        descriptor = self._descriptors.get(collection_name)
+        return descriptor if descriptor is not None else DatasetDescriptor(collection=collection_name)
+
+    def described(self) -> List[DatasetDescriptor]:
+        return list(self._descriptors.values())
+
+    def rollups(self) -> Dict[str, List[str]]:
+        """Collections kept in time-series buckets, with their bucketed measures"""
+        return {d.collection: d.rollup_fields for d in self._descriptors.values()
+                if d.rollup_fields and d.time_type == "date"}
+
+    def register(self, descriptor: DatasetDescriptor) -> None:
+        if descriptor.time_type not in TIME_TYPES:
+            raise ValueError(f"time_type must be one of {', '.join(TIME_TYPES)}")
+        if descriptor.rollup_fields and (descriptor.time_type, descriptor.time_field) != ("date", "date"):
+            # Time-series buckets are built from the daily `date` field
+            raise ValueError("rollup_fields need a date time_type on the date field")
+        self._descriptors[descriptor.collection] = descriptor
+        self._indexed.pop(descriptor.collection, None)
+
+    async def load(self) -> int:
+        """Add the descriptors stored in Mongo; returns how many there were"""
+        if self.collection is None:
+            return 0
+        loaded = 0
+        try:
+            async for doc in self.collection.find({}, {"_id": 0, "updated_at": 0}):
+                try:
+                    self.register(DatasetDescriptor(**doc))
+                    loaded += 1
+                except ValueError as e:
+                    logging.error(f"Invalid dataset descriptor for {doc.get('collection')}: {e}")
+        except Exception as e:
+            logging.error(f"Error loading dataset descriptors: {e}")
+        return loaded
+
+    async def save(self, descriptor: DatasetDescriptor) -> None:
+        self.register(descriptor)
+        if self.collection is not None:
+            await self.collection.replace_one(
+                {"_id": descriptor.collection}, {**descriptor.dict(), "updated_at": datetime.utcnow()}, upsert=True
+            )
+
+    def built_indexes(self, collection_name: str) -> Optional[List[List[str]]]:
+        """The descriptor's index specs once they have been created, else None"""
+        return self._indexed.get(collection_name)
+
+    def build_indexes(self, database, collection_name: str) -> None:
+        """
+        Create the descriptor's indexes on a detached task unless they exist or are being built.
+        Index builds on a large collection outlast any request, so requests never wait on them.
+        """
+        if collection_name in self._indexed:
+            return
+        failed_at = self._index_failed_at.get(collection_name)
+        if failed_at is not None and time.monotonic() - failed_at < self.index_retry_seconds:
+            return
+        build = self._index_builds.get(collection_name)
+        if build is None or build.done():
+            self._index_builds[collection_name] = create_background_task(self._build_indexes(database, collection_name))
+
+    async def _build_indexes(self, database, collection_name: str) -> None:
+        try:
+            await self.ensure_indexes(database, collection_name)
+            self._index_failed_at.pop(collection_name, None)
+        except Exception as e:
+            self._index_failed_at[collection_name] = time.monotonic()
+            logging.error(f"Error creating indexes for {collection_name}: {e}")
+
+    async def ensure_indexes(self, database, collection_name: str) -> List[List[str]]:
+        """Create the descriptor's indexes on a collection (once per descriptor) and return them"""
+        if collection_name in self._indexed:
+            return self._indexed[collection_name]
+        specs = self.get(collection_name).index_specs()
+        collection = database[collection_name]
+        for spec in specs:
+            await collection.create_index([(field, ASCENDING) for field in spec])
+        # Unless the descriptor was replaced while these were being created
+        if self.get(collection_name).index_specs() == specs:
+            self._indexed[collection_name] = specs
+        return specs
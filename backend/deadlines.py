@@ -0,0 +1,170 @@
+"""Per-request deadlines propagated to Mongo and LLM calls, with cancellation on timeout or disconnect"""
+import asyncio
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, Sequence, Tuple, Coroutine
+
+# Absolute time.monotonic() by which the current request must finish; None when unbounded
+current_deadline: ContextVar[Optional[float]] = ContextVar("current_deadline", default=None)
+
+DEADLINE_HEADER = b"x-request-timeout-ms"
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None without one"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def remaining_ms() -> Optional[int]:
+    seconds = remaining()
+    return None if seconds is None else max(1, int(seconds * 1000))
+
+
+def time_limit(default: Optional[float] = None) -> Optional[float]:
+    """The tighter of `default` and the time left on the current deadline"""
+    seconds = remaining()
+    if seconds is None:
+        return default
+    return seconds if default is None else min(default, seconds)
+
+
+@contextmanager
+def detached():
+    """Run the block without the current request's deadline; tasks created inside don't inherit it"""
+    token = current_deadline.set(None)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def create_background_task(coro: Coroutine) -> asyncio.Task:
+    """
+    A task for work that outlives the request starting it, such as a store build other requests
+    will share: asyncio.create_task copies the caller's context, deadline included, so without
+    this the work would be cut off when that one request's deadline passed
+    """
+    with detached():
+        return asyncio.create_task(coro)
+
+
+class DeadlinePolicy:
+    """Route timeouts (longest matching path prefix wins; None means unbounded) and outcome counters"""
+
+    def __init__(self, route_timeouts: Sequence[Tuple[str, Optional[float]]], default_timeout: Optional[float] = 30):
+        self.route_timeouts = sorted(route_timeouts, key=lambda item: len(item[0]), reverse=True)
+        self.default_timeout = default_timeout
+        self.expired = 0
+        self.disconnected = 0
+
+    def timeout_for(self, path: str, headers: Dict[bytes, bytes]) -> Optional[float]:
+        """Route timeout, tightened by an X-Request-Timeout-Ms header but never extended by it"""
+        timeout = next((t for prefix, t in self.route_timeouts if path.startswith(prefix)), self.default_timeout)
+        requested = headers.get(DEADLINE_HEADER)
+        if requested:
+            try:
+                requested_seconds = max(0.001, int(requested) / 1000)
+                timeout = requested_seconds if timeout is None else min(timeout, requested_seconds)
+            except ValueError:
+                pass
+        return timeout
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "route_timeouts": dict(self.route_timeouts),
+            "default_timeout": self.default_timeout,
+            "expired": self.expired,
+            "disconnected": self.disconnected,
+        }
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware giving every HTTP request a deadline from its DeadlinePolicy.
+
+    The handler runs as a task that is cancelled when the deadline passes, answering 504 if no
+    response has started, or when the client disconnects, so abandoned requests stop their
+    Mongo scans and LLM waits instead of running to completion. The request body is read
+    ahead into a buffer for the app, so a disconnect is noticed even before the app reads it.
+    """
+
+    def __init__(self, app, policy: DeadlinePolicy):
+        self.app = app
+        self.policy = policy
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        timeout = self.policy.timeout_for(scope["path"], headers)
+        if timeout is None:
+            await self.app(scope, receive, send)
+            return
+
+        disconnected = asyncio.Event()
+        response_started = False
+        response_complete = asyncio.Event()
+        # The watcher is the only reader of `receive` from the start, buffering request messages
+        # here for the app, so a disconnect is seen while the app still waits on Mongo or the LLM
+        messages: asyncio.Queue = asyncio.Queue()
+
+        async def guarded_receive():
+            if disconnected.is_set() and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete.set()
+            await send(message)
+
+        async def watch_disconnect():
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        token = current_deadline.set(time.monotonic() + timeout)
+        try:
+            handler = asyncio.ensure_future(self.app(scope, guarded_receive, tracked_send))
+        finally:
+            current_deadline.reset(token)
+        watcher = asyncio.ensure_future(watch_disconnect())
+        disconnect_wait = asyncio.ensure_future(disconnected.wait())
+        try:
+            done, _ = await asyncio.wait({handler, disconnect_wait}, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if handler in done or response_complete.is_set():
+                # A disconnect after the full response is just the connection closing
+                await handler
+                return
+            handler.cancel()
+            await asyncio.gather(handler, return_exceptions=True)
+            if disconnect_wait in done:
+                self.policy.disconnected += 1
+                logging.info(f"Client disconnected, cancelled {scope['method']} {scope['path']}")
+                return
+            self.policy.expired += 1
+            logging.warning(f"Deadline of {timeout:.1f}s exceeded for {scope['method']} {scope['path']}")
+            if not response_started:
+                body = json.dumps({"detail": "Request deadline exceeded"}).encode()
+                await send({"type": "http.response.start", "status": 504,
+                            "headers": [(b"content-type", b"application/json"),
+                                        (b"content-length", str(len(body)).encode())]})
+                await send({"type": "http.response.body", "body": body})
+        finally:
+            for task in (watcher, disconnect_wait):
+                task.cancel()
+            await asyncio.gather(watcher, disconnect_wait, return_exceptions=True)
@@ -0,0 +1,280 @@
+"""Opt-in request profiling (stack sampling or cProfile), collapsed-stack flame graphs and event-loop stall reports"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable
+from urllib.parse import parse_qs
+
+# Frames kept per sampled stack, innermost first; deeper frames are the event loop's own plumbing
+MAX_STACK_DEPTH = 64
+# Top of the loop thread's stack while it waits for sockets: time spent awaiting Mongo, OpenAI or clients
+IDLE_FRAMES = ("selectors:select", "selectors:poll", "selectors:_select")
+PROFILE_MODES = ("sample", "cprofile")
+PSTATS_LINES = 60
+
+
+def frame_label(frame) -> str:
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{module}:{frame.f_code.co_name}"
+
+
+def collapse(frame) -> str:
+    """One stack in collapsed flame-graph form: outermost;...;innermost"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def is_idle(stack: str) -> bool:
+    return stack.rsplit(";", 1)[-1] in IDLE_FRAMES
+
+
+def summarize(stacks: Counter, top: int = 15) -> Dict[str, Any]:
+    """Idle vs busy share, and the functions the busy samples were in"""
+    total = sum(stacks.values())
+    idle = sum(count for stack, count in stacks.items() if is_idle(stack))
+    leaves: Counter = Counter()
+    for stack, count in stacks.items():
+        if not is_idle(stack):
+            leaves[stack.rsplit(";", 1)[-1]] += count
+    return {
+        "samples": total,
+        "idle_share": round(idle / total, 3) if total else 0.0,
+        "busy_functions": [{"function": name, "share": round(count / total, 3)} for name, count in leaves.most_common(top)],
+    }
+
+
+def collapsed_text(stacks: Counter) -> str:
+    """Brendan Gregg's collapsed format, readable by flamegraph.pl, speedscope and inferno"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class StackSampler:
+    """
+    Samples stacks from a background thread at a fixed interval: one thread's, or with
+    thread_id=None every other thread's, each stack rooted at its thread name
+    """
+
+    def __init__(self, thread_id: Optional[int], interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if self.thread_id is not None:
+                frame = frames.get(self.thread_id)
+                if frame is not None:
+                    self.stacks[collapse(frame)] += 1
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident != own:
+                    self.stacks[f"{names.get(ident, ident)};{collapse(frame)}"] += 1
+
+    def start(self) -> "StackSampler":
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.stacks
+
+
+class ProfileRecorder:
+    """The most recent request profiles, for the admin endpoints"""
+
+    def __init__(self, max_profiles: int = 20):
+        self.max_profiles = max_profiles
+        self._profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # One profiled request at a time: samples are per thread, not per request, and cProfile is exclusive
+        self.lock = threading.Lock()
+        self.busy = 0
+
+    def add(self, profile: Dict[str, Any]) -> None:
+        self._profiles[profile["id"]] = profile
+        while len(self._profiles) > self.max_profiles:
+            self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        return self._profiles.get(profile_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [
+            {k: v for k, v in profile.items() if k not in ("stacks", "pstats")}
+            for profile in reversed(self._profiles.values())
+        ]
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests that ask for it with `X-Profile: sample|cprofile` or
+    `?profile=sample|cprofile` (1 means sample), when `authorize(headers)` allows it.
+
+    The response carries `X-Profile-Id`; the stacks or cProfile statistics are then fetched from
+    the admin endpoints. Samples cover the whole event-loop thread, so other requests running at
+    the same time show up too; `inflight` records how many there were.
+    """
+
+    def __init__(self, app, recorder: ProfileRecorder, authorize: Callable[[Dict[bytes, bytes]], bool],
+                 inflight: Callable[[], int] = lambda: 0, interval: float = 0.005):
+        self.app = app
+        self.recorder = recorder
+        self.authorize = authorize
+        self.inflight = inflight
+        self.interval = interval
+
+    @staticmethod
+    def requested_mode(scope) -> Optional[str]:
+        headers = dict(scope.get("headers") or [])
+        value = headers.get(b"x-profile", b"").decode("latin-1")
+        if not value:
+            value = (parse_qs(scope.get("query_string", b"").decode("latin-1")).get("profile") or [""])[0]
+        value = value.strip().lower()
+        if value in ("1", "true"):
+            return "sample"
+        return value if value in PROFILE_MODES else None
+
+    async def __call__(self, scope, receive, send):
+        mode = self.requested_mode(scope) if scope["type"] == "http" else None
+        if mode is None or not self.authorize(dict(scope.get("headers") or [])):
+            await self.app(scope, receive, send)
+            return
+        if not self.recorder.lock.acquire(blocking=False):
+            self.recorder.busy += 1
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:12]
+        status = None
+
+        async def profiled_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        inflight_at_start = self.inflight()
+        started = time.perf_counter()
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            sampler = StackSampler(threading.get_ident(), self.interval).start()
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            duration_ms = round((time.perf_counter() - started) * 1000, 1)
+            profile: Dict[str, Any] = {
+                "id": profile_id,
+                "mode": mode,
+                "method": scope.get("method"),
+                "path": scope["path"],
+                "status": status,
+                "duration_ms": duration_ms,
+                "inflight": max(inflight_at_start, self.inflight()),
+                "created_at": datetime.utcnow().isoformat(),
+            }
+            if mode == "cprofile":
+                profiler.disable()
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PSTATS_LINES)
+                profile["pstats"] = out.getvalue()
+            else:
+                stacks = sampler.stop()
+                profile["stacks"] = stacks
+                profile["summary"] = summarize(stacks)
+            self.recorder.add(profile)
+            self.recorder.lock.release()
+            logging.info(f"Profiled {profile['method']} {profile['path']} ({mode}) in {duration_ms}ms: {profile_id}")
+
+
+class LoopWatchdog:
+    """
+    Reports event-loop stalls with the stack that caused them.
+
+    The loop's lag monitor calls `beat` on every tick. A watchdog thread notices when the beats
+    stop for longer than the threshold and captures the loop thread's stack while it is still
+    stuck, so the log names the blocking call rather than just the delay.
+    """
+
+    def __init__(self, threshold_ms: float = 100, beat_interval: float = 0.5, max_stalls: int = 50):
+        self.threshold = threshold_ms / 1000
+        self.beat_interval = beat_interval
+        self.max_stalls = max_stalls
+        self.stalls: List[Dict[str, Any]] = []
+        self.lagged_beats = 0
+        self._last_beat = time.perf_counter()
+        self._captured_beat: Optional[float] = None
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def beat(self, lag_ms: float) -> None:
+        """OverloadDetector lag listener; runs on the loop thread"""
+        self._last_beat = time.perf_counter()
+        if lag_ms >= self.threshold * 1000:
+            self.lagged_beats += 1
+            if self.stalls and self.stalls[-1].get("lag_ms") is None:
+                self.stalls[-1]["lag_ms"] = round(lag_ms, 1)
+            else:
+                logging.warning(f"Event loop lagged {lag_ms:.0f}ms")
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._last_beat
+            stalled = time.perf_counter() - beat - self.beat_interval
+            if stalled < self.threshold or self._captured_beat == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            self._captured_beat = beat
+            stack = collapse(frame)
+            if is_idle(stack):
+                # The loop is waiting for I/O, so the missing beat was only the monitor being slow
+                continue
+            self.stalls.append({
+                "detected_at": datetime.utcnow().isoformat(),
+                "stalled_ms": round(stalled * 1000, 1),
+                "lag_ms": None,
+                "stack": stack,
+            })
+            del self.stalls[:-self.max_stalls]
+            logging.warning(f"Event loop blocked for over {stalled * 1000:.0f}ms in "
+                            f"{' <- '.join(reversed(stack.split(';')[-8:]))}")
+
+    def start(self, loop_thread_id: int) -> None:
+        self._loop_thread = loop_thread_id
+        self._last_beat = time.perf_counter()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "lagged_beats": self.lagged_beats,
+            "stalls": list(reversed(self.stalls)),
+        }
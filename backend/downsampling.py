@@ -0,0 +1,125 @@
+"""Visually faithful point reduction for dense line-chart series (LTTB and min/max per bucket)"""
+from __future__ import annotations
+from collections import defaultdict
+from datetime import date
+from typing import List, Dict, Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+METHODS = ("lttb", "minmax")
+
+# About one point per pixel is all a line chart can show; more just costs bandwidth
+POINTS_PER_PIXEL = 1.0
+MIN_TARGET_POINTS = 10
+MAX_TARGET_POINTS = 5000
+
+
+def target_points(width: int) -> int:
+    """Points per series for a chart `width` pixels wide"""
+    import numpy as np
+    total = int(width * POINTS_PER_PIXEL)
+    return int(np.clip(total, MIN_TARGET_POINTS, MAX_TARGET_POINTS))
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: keep the first and last points and, from each of the
+    n_out - 2 buckets in between, the point forming the largest triangle with the point kept
+    from the previous bucket and the average of the next bucket.
+    """
+    import numpy as np
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # Bucket boundaries over the interior points 1..n-2
+    edges = np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.int64)
+    # Averages of every bucket, computed at once; the last "next bucket" is the final point
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    avg_x = np.append(sums_x / sizes, x[-1])
+    avg_y = np.append(sums_y / sizes, y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    # Each choice depends on the previous one, so only the per-bucket area search is vectorized
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        ax, ay = x[previous], y[previous]
+        areas = np.abs((ax - avg_x[bucket + 1]) * (y[start:end] - ay)
+                       - (ax - x[start:end]) * (avg_y[bucket + 1] - ay))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Minimum and maximum of each of n_out / 2 equal-count buckets, in original order"""
+    import numpy as np
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    buckets = np.arange(n) * (n_out // 2) // n
+    # Sorting by (bucket, y) puts each bucket's minimum first and maximum last
+    order = np.lexsort((y, buckets))
+    sorted_buckets = buckets[order]
+    firsts = np.searchsorted(sorted_buckets, np.arange(n_out // 2), side="left")
+    lasts = np.searchsorted(sorted_buckets, np.arange(n_out // 2), side="right") - 1
+    return np.unique(np.concatenate([order[firsts], order[lasts], [0, n - 1]]))
+
+
+def downsample_indices(x: np.ndarray, y: np.ndarray, n_out: int, method: str = "lttb") -> np.ndarray:
+    if method == "minmax":
+        return minmax_indices(y, n_out)
+    return lttb_indices(x, y, n_out)
+
+
+def _axis_values(values: List[Any]) -> np.ndarray:
+    """Numeric x axis from years, numbers or ISO date strings (as ordinal days)"""
+    import numpy as np
+    if values and isinstance(values[0], str):
+        return np.array([date.fromisoformat(v[:10]).toordinal() for v in values], dtype=np.float64)
+    return np.asarray(values, dtype=np.float64)
+
+
+def downsample_records(records: List[Dict[str, Any]], x_field: str, y_field: str, n_out: int,
+                       method: str = "lttb", group_field: str = "state") -> List[Dict[str, Any]]:
+    """Downsample each group's series (records ordered by x within a group) to about n_out points"""
+    import numpy as np
+    groups: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
+    for record in records:
+        if isinstance(record.get(y_field), (int, float)) and record.get(x_field) is not None:
+            groups[record.get(group_field)].append(record)
+
+    reduced: List[Dict[str, Any]] = []
+    for series in groups.values():
+        if len(series) <= n_out:
+            reduced.extend(series)
+            continue
+        x = _axis_values([r[x_field] for r in series])
+        y = np.asarray([r[y_field] for r in series], dtype=np.float64)
+        reduced.extend(series[i] for i in downsample_indices(x, y, n_out, method))
+    return reduced
+
+
+def downsample_points(points: List[Dict[str, Any]], fields: List[str], n_out: int,
+                      method: str = "lttb", x_field: str = "period") -> List[Dict[str, Any]]:
+    """Downsample one series of points with several measures, keeping the union of each measure's picks"""
+    import numpy as np
+    if len(points) <= n_out:
+        return points
+    x = _axis_values([p[x_field] if len(p[x_field]) == 10 else f"{p[x_field]}-01" for p in points])
+    # Split the budget so the union of every measure's picks stays within n_out
+    n_out = max(3, n_out // max(1, len(fields)))
+    keep: set = set()
+    for field in fields:
+        y = np.asarray([p.get(field, np.nan) for p in points], dtype=np.float64)
+        valid = ~np.isnan(y)
+        if valid.sum() <= n_out:
+            keep.update(np.flatnonzero(valid).tolist())
+            continue
+        positions = np.flatnonzero(valid)
+        keep.update(positions[downsample_indices(x[valid], y[valid], n_out, method)].tolist())
+    return [points[i] for i in sorted(keep)]
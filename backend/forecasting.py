@@ -0,0 +1,304 @@
+"""Per-state forecasts (linear trend, exponential smoothing, seasonal naive) fitted for all states at once"""
+from __future__ import annotations
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from statistics import NormalDist
+from typing import List, Dict, Any, Optional, Sequence, Callable, Awaitable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+MODELS = ("auto", "linear", "ets", "seasonal_naive")
+# Season length per series interval; yearly series have no seasonality to repeat
+SEASON_LENGTHS = {"year": 1, "month": 12, "week": 52}
+# Smoothing factors searched for exponential smoothing, evaluated for every state together
+ALPHA_GRID = tuple(round(0.05 * step, 2) for step in range(1, 20))
+# A trend is reported only if its slope is this many standard errors away from zero
+TREND_T_STAT = 2.0
+MIN_POINTS = 3
+
+
+def align_series(series: Sequence[Dict[str, Any]], field: str) -> Dict[str, Any]:
+    """
+    States × periods matrix from per-state point lists over the union of their periods.
+
+    Gaps inside a state's range are linearly interpolated so the batched models see a regular
+    grid; periods before a state's first or after its last observation stay NaN.
+    """
+    import numpy as np
+    periods = sorted({p["period"] for s in series for p in s["points"] if isinstance(p.get(field), (int, float))})
+    column = {period: i for i, period in enumerate(periods)}
+    values = np.full((len(series), len(periods)), np.nan)
+    for row, state_series in enumerate(series):
+        for point in state_series["points"]:
+            if isinstance(point.get(field), (int, float)):
+                values[row, column[point["period"]]] = point[field]
+    for row in values:
+        present = np.flatnonzero(~np.isnan(row))
+        if len(present) >= 2:
+            inside = np.arange(present[0], present[-1] + 1)
+            row[inside] = np.interp(inside, present, row[present])
+    return {
+        "periods": periods,
+        "state_ids": [s["state_id"] for s in series],
+        "states": [s["state"] for s in series],
+        "values": values,
+    }
+
+
+def next_periods(last: Any, interval: str, horizon: int) -> List[Any]:
+    """Labels of the `horizon` periods after `last` (a year, YYYY-MM or a week's YYYY-MM-DD Monday)"""
+    if interval == "year":
+        return [int(last) + h for h in range(1, horizon + 1)]
+    if interval == "month":
+        year, month = int(last[:4]), int(last[5:7])
+        labels = []
+        for _ in range(horizon):
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+            labels.append(f"{year:04d}-{month:02d}")
+        return labels
+    start = date.fromisoformat(last[:10])
+    return [(start + timedelta(weeks=h)).isoformat() for h in range(1, horizon + 1)]
+
+
+def last_columns(values: np.ndarray) -> np.ndarray:
+    """Column of each state's last observation, -1 for a state with none"""
+    import numpy as np
+    present = ~np.isnan(values)
+    return np.where(present.any(axis=1), values.shape[1] - 1 - np.argmax(present[:, ::-1], axis=1), -1)
+
+
+def trailing_window(values: np.ndarray) -> np.ndarray:
+    """Each state's values shifted right so that every row ends at the last column (NaN on the left)"""
+    import numpy as np
+    shifted = np.full(values.shape, np.nan)
+    for row, series in enumerate(values):
+        present = np.flatnonzero(~np.isnan(series))
+        if len(present):
+            window = series[present[0]:present[-1] + 1]
+            shifted[row, values.shape[1] - len(window):] = window
+    return shifted
+
+
+def fit_linear(values: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Least-squares line per state over its observed periods, solved for all states at once.
+
+    Forecasts step on from each state's own last observation (`last_t`), not from the last
+    column, matching the labels ForecastFit gives them.
+    """
+    import numpy as np
+    t = np.arange(values.shape[1], dtype=np.float64)
+    present = ~np.isnan(values)
+    n = present.sum(axis=1).astype(np.float64)
+    y = np.where(present, values, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t_mean = (present * t).sum(axis=1) / n
+        y_mean = y.sum(axis=1) / n
+        dt = np.where(present, t - t_mean[:, None], 0.0)
+        stt = (dt * dt).sum(axis=1)
+        slope = (dt * (y - y_mean[:, None] * present)).sum(axis=1) / stt
+        intercept = y_mean - slope * t_mean
+        residuals = np.where(present, values - (intercept[:, None] + slope[:, None] * t), 0.0)
+        sigma = np.sqrt((residuals * residuals).sum(axis=1) / np.maximum(n - 2, 1))
+        slope_se = sigma / np.sqrt(stt)
+    return {"intercept": intercept, "slope": slope, "sigma": sigma, "t_mean": t_mean, "stt": stt, "n": n,
+            "slope_se": slope_se, "last_t": last_columns(values).astype(np.float64)}
+
+
+def fit_ets(values: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Simple exponential smoothing with the smoothing factor chosen per state from ALPHA_GRID.
+
+    The level recursion runs once over time for a (alphas × states) matrix, so every state and
+    every candidate alpha is fitted in the same pass; the alpha with the lowest one-step squared
+    error wins per state.
+    """
+    import numpy as np
+    series = trailing_window(values)
+    grid = np.array(ALPHA_GRID)
+    alphas = grid[:, None]
+    level = np.full((len(grid), len(series)), np.nan)
+    sse = np.zeros_like(level)
+    steps = np.zeros(len(series))
+    for column in series.T:
+        observed = ~np.isnan(column)
+        started = observed & ~np.isnan(level[0])
+        error = np.where(started, column - level, 0.0)
+        sse += error * error
+        steps += started
+        level = np.where(started, level + alphas * error, np.where(observed, column, level))
+    best = np.argmin(sse, axis=0)
+    states = np.arange(len(series))
+    return {
+        "alpha": grid[best],
+        "level": level[best, states],
+        "sigma": np.sqrt(sse[best, states] / np.maximum(steps - 1, 1)),
+    }
+
+
+def fit_seasonal_naive(values: np.ndarray, season: int) -> Dict[str, np.ndarray]:
+    """Repeat each state's last season; the error scale comes from its season-over-season changes"""
+    import numpy as np
+    series = trailing_window(values)
+    differences = series[:, season:] - series[:, :-season]
+    count = (~np.isnan(differences)).sum(axis=1)
+    with np.errstate(invalid="ignore"):
+        sigma = np.sqrt(np.nansum(differences * differences, axis=1) / np.maximum(count, 1))
+    return {"last_season": series[:, -season:], "sigma": sigma}
+
+
+class ForecastFit:
+    """Fitted parameters for every state of one series set; forecasts for any horizon come from these"""
+
+    def __init__(self, aligned: Dict[str, Any], interval: str, model: str):
+        import numpy as np
+        self.periods = aligned["periods"]
+        if not self.periods:
+            raise ValueError("No data to forecast")
+        self.state_ids = aligned["state_ids"]
+        self.states = aligned["states"]
+        self.interval = interval
+        values = aligned["values"]
+        self.observations = (~np.isnan(values)).sum(axis=1)
+        self.last_columns = last_columns(values)
+        self.last_values = trailing_window(values)[:, -1]
+        season = SEASON_LENGTHS[interval]
+        if model == "auto":
+            # Seasonal series with two full seasons repeat last season; otherwise a straight line
+            model = "seasonal_naive" if season > 1 and len(self.periods) >= 2 * season else "linear"
+        if model == "seasonal_naive" and (season == 1 or len(self.periods) < season + 1):
+            raise ValueError(f"seasonal_naive needs more than one {interval}ly season of data")
+        self.model = model
+        self.season = season
+        # The linear fit is also what the trend summary reports, whichever model forecasts
+        self.linear = fit_linear(values)
+        if model == "ets":
+            self.params = fit_ets(values)
+        elif model == "seasonal_naive":
+            self.params = fit_seasonal_naive(values, season)
+        else:
+            self.params = self.linear
+
+    def _point_forecasts(self, horizon: int, z: float):
+        import numpy as np
+        h = np.arange(1, horizon + 1, dtype=np.float64)
+        p = self.params
+        if self.model == "ets":
+            mean = np.repeat(p["level"][:, None], horizon, axis=1)
+            spread = p["sigma"][:, None] * np.sqrt(1 + (h - 1) * p["alpha"][:, None] ** 2)
+        elif self.model == "seasonal_naive":
+            position = (h.astype(np.int64) - 1) % self.season
+            mean = p["last_season"][:, position]
+            spread = p["sigma"][:, None] * np.sqrt(np.floor((h - 1) / self.season) + 1)
+        else:
+            future = p["last_t"][:, None] + h
+            mean = p["intercept"][:, None] + p["slope"][:, None] * future
+            # Prediction interval of a new observation around the fitted line
+            spread = p["sigma"][:, None] * np.sqrt(1 + 1 / p["n"][:, None]
+                                                   + (future - p["t_mean"][:, None]) ** 2 / p["stt"][:, None])
+        return mean, mean - z * spread, mean + z * spread
+
+    def trend(self, row: int) -> Dict[str, Any]:
+        import numpy as np
+        slope, slope_se = self.linear["slope"][row], self.linear["slope_se"][row]
+        if not np.isfinite(slope):
+            return {"direction": "unknown", "slope_per_period": None}
+        significant = np.isfinite(slope_se) and slope_se > 0 and abs(slope) / slope_se >= TREND_T_STAT
+        return {
+            "direction": ("increasing" if slope > 0 else "decreasing") if significant else "stable",
+            "slope_per_period": round(float(slope), 4),
+        }
+
+    def forecast(self, horizon: int, confidence: float = 0.9,
+                 state_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """
+        Per-state forecasts for the `horizon` periods after each state's own last observation;
+        a state whose data stops early is forecast (and labelled) from where it stops.
+        """
+        import numpy as np
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        mean, lower, upper = self._point_forecasts(horizon, z)
+        labels: Dict[int, List[Any]] = {}
+        results = []
+        for row, state_id in enumerate(self.state_ids):
+            if state_ids and state_id not in state_ids:
+                continue
+            column = int(self.last_columns[row])
+            last_period = self.periods[column] if column >= 0 else None
+            entry: Dict[str, Any] = {
+                "state_id": state_id,
+                "state": self.states[row],
+                "observations": int(self.observations[row]),
+                "last_period": last_period,
+                "last_value": None if np.isnan(self.last_values[row]) else float(self.last_values[row]),
+                "trend": self.trend(row),
+                "forecast": [],
+            }
+            if self.observations[row] >= MIN_POINTS and np.all(np.isfinite(mean[row])):
+                if column not in labels:
+                    labels[column] = next_periods(last_period, self.interval, horizon)
+                entry["forecast"] = [
+                    {"period": label, "value": round(float(m), 3),
+                     "lower": round(float(lo), 3), "upper": round(float(hi), 3)}
+                    for label, m, lo, hi in zip(labels[column], mean[row], lower[row], upper[row])
+                ]
+            if self.model == "ets":
+                entry["alpha"] = round(float(self.params["alpha"][row]), 2)
+            results.append(entry)
+        return results
+
+
+class ForecastStore:
+    """
+    Fitted models per (collection, field, interval, model), kept while the collection's data version holds.
+
+    The aligned series are cached separately, so fitting another model to the same data doesn't
+    reload it from Mongo.
+    """
+
+    def __init__(self, versions, max_fits: int = 64, ttl_seconds: float = 900):
+        self.versions = versions
+        self.max_fits = max_fits
+        # Without reliable versions a fit may miss writes, so it is only trusted this long
+        self.ttl_seconds = ttl_seconds
+        self._fits: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._series: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.fitted = 0
+        self.hits = 0
+
+    def _lookup(self, entries: "OrderedDict[tuple, tuple]", key: tuple, collection_name: str) -> Optional[Any]:
+        entry = entries.get(key)
+        if entry and entry[0] == self.versions.get(collection_name) and (
+                self.versions.reliable or time.time() - entry[1] < self.ttl_seconds):
+            entries.move_to_end(key)
+            return entry[2]
+        return None
+
+    def _store(self, entries: "OrderedDict[tuple, tuple]", key: tuple, version: int, value: Any) -> None:
+        entries[key] = (version, time.time(), value)
+        entries.move_to_end(key)
+        while len(entries) > self.max_fits:
+            entries.popitem(last=False)
+
+    async def fit(self, collection_name: str, field: str, interval: str, model: str,
+                  load_series: Callable[[], Awaitable[List[Dict[str, Any]]]]) -> ForecastFit:
+        key = (collection_name, field, interval, model)
+        fit = self._lookup(self._fits, key, collection_name)
+        if fit is not None:
+            self.hits += 1
+            return fit
+        version = self.versions.get(collection_name)
+        aligned = self._lookup(self._series, key[:3], collection_name)
+        if aligned is None:
+            aligned = align_series(await load_series(), field)
+            self._store(self._series, key[:3], version, aligned)
+        fit = await asyncio.to_thread(ForecastFit, aligned, interval, model)
+        self._store(self._fits, key, version, fit)
+        self.fitted += 1
+        return fit
+
+    def stats(self) -> Dict[str, Any]:
+        return {"fits": len(self._fits), "series": len(self._series), "fitted": self.fitted, "hits": self.hits}
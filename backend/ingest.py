@@ -0,0 +1,238 @@
+"""Chunked ingestion of CSV/JSON sources with bulk upserts and per-collection manifests
+
+Usage:
+    python ingest.py crimes crimes_2023.csv
+    python ingest.py covid_stats covid.jsonl --batch-size 20000 --concurrency 8
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterator, Iterable, TextIO
+
+from pydantic import BaseModel
+from pymongo import UpdateOne, ASCENDING, ReturnDocument
+
+from datasets import builtin_descriptor
+from states import state_dimension
+
+DATE_FORMATS = ["%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%Y/%m/%d", "%d.%m.%Y", "%Y-%m-%dT%H:%M:%S"]
+NUMBER_PATTERN = re.compile(r"^-?\d+(\.\d+)?$")
+MAX_REPORTED_ERRORS = 20
+
+
+class IngestStats(BaseModel):
+    collection: str
+    rows_read: int = 0
+    rows_upserted: int = 0
+    rows_modified: int = 0
+    rows_rejected: int = 0
+    batches: int = 0
+    duration_seconds: float = 0.0
+    version: Optional[int] = None
+    errors: List[str] = []
+
+
+def normalize_date(value: Any) -> str:
+    """ISO YYYY-MM-DD from the date formats seen in the source files"""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date '{text}'")
+
+
+def parse_scalar(value: Any) -> Any:
+    """Numbers arrive as strings from CSV; convert them, leave other text as-is"""
+    if not isinstance(value, str):
+        return value
+    text = value.strip()
+    number = text.replace(",", "")
+    if NUMBER_PATTERN.match(number):
+        return float(number) if "." in number else int(number)
+    return text
+
+
+def normalize_record(raw: Dict[str, Any], natural_key: List[str]) -> Dict[str, Any]:
+    """Typed, canonical document for one source row; raises ValueError if it can't be keyed"""
+    doc: Dict[str, Any] = {}
+    for key, value in raw.items():
+        if key is None:
+            continue
+        field = re.sub(r"\s+", "_", key.strip().lower())
+        if value is None or (isinstance(value, str) and not value.strip()):
+            continue
+        if field == "state":
+            # Documents carry the compact code for filtering and grouping plus the canonical name
+            code = state_dimension.resolve(value)
+            if code is None:
+                raise ValueError(f"Unknown state '{value}'")
+            doc["state_id"] = code
+            doc[field] = state_dimension.name(code)
+        elif field == "year":
+            doc[field] = int(float(value))
+        elif field == "date":
+            doc[field] = normalize_date(value)
+        else:
+            doc[field] = parse_scalar(value)
+    missing = [k for k in natural_key if k not in doc]
+    if missing:
+        raise ValueError(f"Missing key fields {missing}")
+    return doc
+
+
+def read_records(stream: TextIO, fmt: str) -> Iterator[Dict[str, Any]]:
+    """Yield raw rows from a CSV, JSON Lines or JSON array source"""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "jsonl":
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    elif fmt == "json":
+        # JSON arrays can't be streamed with the standard library; prefer JSON Lines for large files
+        data = json.load(stream)
+        yield from (data if isinstance(data, list) else [data])
+    else:
+        raise ValueError(f"Unsupported format '{fmt}'")
+
+
+def detect_format(filename: str) -> str:
+    suffix = Path(filename).suffix.lower()
+    return {".csv": "csv", ".json": "json", ".jsonl": "jsonl", ".ndjson": "jsonl"}.get(suffix, "csv")
+
+
+def _take_batch(rows: Iterator[Dict[str, Any]], natural_key: List[str], size: int, stats: IngestStats):
+    """Read and normalize up to `size` rows; runs in a worker thread"""
+    batch = []
+    for raw in rows:
+        stats.rows_read += 1
+        try:
+            batch.append(normalize_record(raw, natural_key))
+        except (ValueError, TypeError) as e:
+            stats.rows_rejected += 1
+            if len(stats.errors) < MAX_REPORTED_ERRORS:
+                stats.errors.append(f"row {stats.rows_read}: {e}")
+        if len(batch) >= size:
+            break
+    return batch
+
+
+async def bump_manifest(manifests, collection_name: str, stats: IngestStats) -> int:
+    """Increment the collection's version in its manifest document and return the new version"""
+    manifest = await manifests.find_one_and_update(
+        {"_id": collection_name},
+        {
+            "$inc": {"version": 1},
+            "$set": {"updated_at": datetime.utcnow(), "last_ingest": stats.dict(exclude={"version"})},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return manifest["version"]
+
+
+async def ingest_records(database, manifests, collection_name: str, rows: Iterable[Dict[str, Any]],
+                         batch_size: int = 10000, concurrency: int = 4,
+                         natural_key: Optional[List[str]] = None) -> IngestStats:
+    """Normalize rows and write them with unordered bulk upserts, keeping `concurrency` batches in flight"""
+    # Fields identifying a row; re-ingesting the same row updates it instead of duplicating it
+    natural_key = natural_key or builtin_descriptor(collection_name).natural_key
+    collection = database[collection_name]
+    stats = IngestStats(collection=collection_name)
+    started = time.perf_counter()
+
+    # Upserts look rows up by their natural key, so it must be indexed
+    await collection.create_index([(field, ASCENDING) for field in natural_key])
+
+    semaphore = asyncio.Semaphore(concurrency)
+    writes: List[asyncio.Task] = []
+
+    async def write(batch: List[Dict[str, Any]]):
+        operations = [
+            UpdateOne({field: doc[field] for field in natural_key}, {"$set": doc}, upsert=True)
+            for doc in batch
+        ]
+        try:
+            result = await collection.bulk_write(operations, ordered=False)
+            stats.rows_upserted += result.upserted_count
+            stats.rows_modified += result.modified_count
+        finally:
+            semaphore.release()
+
+    iterator = iter(rows)
+    while True:
+        batch = await asyncio.to_thread(_take_batch, iterator, natural_key, batch_size, stats)
+        if not batch:
+            break
+        await semaphore.acquire()
+        stats.batches += 1
+        writes.append(asyncio.create_task(write(batch)))
+    await asyncio.gather(*writes)
+
+    stats.duration_seconds = round(time.perf_counter() - started, 3)
+    stats.version = await bump_manifest(manifests, collection_name, stats)
+    logging.info(f"Ingested {collection_name}: {stats.rows_read} rows read, {stats.rows_rejected} rejected, "
+                 f"version {stats.version} in {stats.duration_seconds}s")
+    return stats
+
+
+async def ingest_file(database, manifests, collection_name: str, path: str, fmt: Optional[str] = None,
+                      batch_size: int = 10000, concurrency: int = 4) -> IngestStats:
+    with open(path, newline="", encoding="utf-8-sig") as stream:
+        return await ingest_records(
+            database, manifests, collection_name, read_records(stream, fmt or detect_format(path)),
+            batch_size=batch_size, concurrency=concurrency
+        )
+
+
+def open_upload(binary_stream) -> TextIO:
+    """Text view of an uploaded file for read_records"""
+    return io.TextIOWrapper(binary_stream, encoding="utf-8-sig", newline="")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from dotenv import load_dotenv
+    from database import connect
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Load a CSV/JSON file into a world_data collection")
+    parser.add_argument("collection", help="Target collection, e.g. crimes")
+    parser.add_argument("path", help="CSV, JSON array or JSON Lines file")
+    parser.add_argument("--format", choices=["csv", "json", "jsonl"], help="Override format detection")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Documents per bulk_write")
+    parser.add_argument("--concurrency", type=int, default=4, help="Bulk writes in flight")
+    parser.add_argument("--mongo-url", default=os.environ.get('MONGO_URL'))
+    parser.add_argument("--db-name", default="world_data")
+    parser.add_argument("--cache-db-name", default=os.environ.get('CACHE_DB_NAME', 'tracity_cache'))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    async def run():
+        connection, database = connect(args.mongo_url, args.db_name)
+        try:
+            manifests = database.sibling(args.cache_db_name)["dataset_manifests"]
+            return await ingest_file(database, manifests, args.collection, args.path, args.format,
+                                     args.batch_size, args.concurrency)
+        finally:
+            connection.close()
+
+    stats = asyncio.run(run())
+    print(json.dumps(stats.dict(), indent=2))
+    return 0 if stats.rows_read > stats.rows_rejected or stats.rows_read == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,210 @@
+"""Live dashboard updates: topic subscriptions over WebSockets, refreshed once per data change and fanned out"""
+import asyncio
+import json
+import logging
+import math
+import time
+from typing import Dict, Any, Optional, Callable, Awaitable, Set, Tuple
+
+from fastapi import WebSocketDisconnect
+
+# Messages queued for one connection before it counts as lagging and is resynchronized
+SEND_QUEUE_SIZE = 100
+
+
+class Topic:
+    """One (collection, filters, grouping) subscription shared by every connection asking for it"""
+
+    def __init__(self, topic_id: str, spec: Dict[str, Any]):
+        self.topic_id = topic_id
+        self.spec = spec
+        self.collection = spec["collection"]
+        self.subscribers: Set["Subscriber"] = set()
+        # Last groups sent, by key; deltas are computed against these
+        self.groups: Optional[Dict[Any, Any]] = None
+        self.version: Optional[int] = None
+
+    def snapshot_message(self) -> Dict[str, Any]:
+        return {
+            "type": "snapshot",
+            "topic": self.topic_id,
+            "version": self.version,
+            "groups": [{"key": key, "value": value} for key, value in (self.groups or {}).items()],
+        }
+
+
+class Subscriber:
+    """One WebSocket connection: its topics and a bounded outbox drained by the connection's writer"""
+
+    def __init__(self):
+        self.topics: Set[str] = set()
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.resyncs = 0
+
+    def offer(self, message: Dict[str, Any], hub: "LiveHub") -> None:
+        try:
+            self.outbox.put_nowait(message)
+        except asyncio.QueueFull:
+            # A slow client can't hold up the fan-out: drop its backlog and send fresh snapshots instead
+            self.resyncs += 1
+            while not self.outbox.empty():
+                self.outbox.get_nowait()
+            for topic_id in self.topics:
+                topic = hub.topics.get(topic_id)
+                if topic is not None and topic.groups is not None:
+                    self.outbox.put_nowait(topic.snapshot_message())
+
+
+class LiveHub:
+    """
+    Fans data changes out to WebSocket subscribers.
+
+    Data-version bumps (from the change stream or the ingest path) mark a collection dirty; after
+    a short debounce every topic on it is recomputed once, diffed against what was last sent, and
+    only the changed groups go to its subscribers, however many there are.
+    """
+
+    def __init__(self, versions, compute: Callable[[Dict[str, Any]], Awaitable[Dict[Any, Any]]],
+                 debounce_seconds: float = 1.0, max_topics_per_connection: int = 20):
+        self.versions = versions
+        self.compute = compute
+        self.debounce_seconds = debounce_seconds
+        self.max_topics_per_connection = max_topics_per_connection
+        self.topics: Dict[str, Topic] = {}
+        self.connections = 0
+        self.deltas_sent = 0
+        self.refreshes = 0
+        self._dirty: Set[str] = set()
+        self._flush: Optional[asyncio.Task] = None
+
+    def on_version(self, collection_name: str, version: int) -> None:
+        """DataVersions listener; bursts of changes (e.g. a bulk ingest) collapse into one refresh"""
+        if not any(topic.collection == collection_name for topic in self.topics.values()):
+            return
+        self._dirty.add(collection_name)
+        if self._flush is None or self._flush.done():
+            self._flush = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.debounce_seconds)
+        dirty, self._dirty = self._dirty, set()
+        topics = [topic for topic in list(self.topics.values()) if topic.collection in dirty]
+        await asyncio.gather(*(self.refresh(topic) for topic in topics))
+
+    async def refresh(self, topic: Topic) -> None:
+        version = self.versions.get(topic.collection)
+        try:
+            groups = await self.compute(topic.spec)
+        except Exception as e:
+            logging.error(f"Error refreshing live topic {topic.topic_id}: {e}")
+            return
+        self.refreshes += 1
+        previous = topic.groups or {}
+        changed = [{"key": key, "value": value} for key, value in groups.items() if previous.get(key) != value]
+        removed = [key for key in previous if key not in groups]
+        topic.groups, topic.version = groups, version
+        if not changed and not removed:
+            return
+        message = {"type": "delta", "topic": topic.topic_id, "version": version, "changed": changed, "removed": removed}
+        for subscriber in list(topic.subscribers):
+            subscriber.offer(message, self)
+            self.deltas_sent += 1
+
+    async def subscribe(self, subscriber: Subscriber, topic_id: str, spec: Dict[str, Any]) -> Dict[str, Any]:
+        """Join (or create) a topic and return its current snapshot"""
+        if topic_id not in subscriber.topics and len(subscriber.topics) >= self.max_topics_per_connection:
+            raise ValueError(f"At most {self.max_topics_per_connection} subscriptions per connection")
+        topic = self.topics.get(topic_id)
+        if topic is None:
+            topic = self.topics[topic_id] = Topic(topic_id, spec)
+        if topic.groups is None or topic.version != self.versions.get(topic.collection):
+            await self.refresh(topic)
+        # Joined after the refresh, so the newcomer gets the snapshot rather than a delta from nothing
+        topic.subscribers.add(subscriber)
+        subscriber.topics.add(topic_id)
+        return topic.snapshot_message()
+
+    def unsubscribe(self, subscriber: Subscriber, topic_id: str) -> None:
+        subscriber.topics.discard(topic_id)
+        topic = self.topics.get(topic_id)
+        if topic is not None:
+            topic.subscribers.discard(subscriber)
+            if not topic.subscribers:
+                del self.topics[topic_id]
+
+    def disconnect(self, subscriber: Subscriber) -> None:
+        for topic_id in list(subscriber.topics):
+            self.unsubscribe(subscriber, topic_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connections": self.connections,
+            "topics": len(self.topics),
+            "subscriptions": sum(len(topic.subscribers) for topic in self.topics.values()),
+            "refreshes": self.refreshes,
+            "deltas_sent": self.deltas_sent,
+        }
+
+
+async def serve_connection(websocket, hub: LiveHub,
+                           make_topic: Callable[[Dict[str, Any]], Awaitable[Tuple[str, Dict[str, Any]]]],
+                           ping_seconds: float = 30, throttle: Optional[Callable[[], float]] = None) -> None:
+    """
+    Run one accepted WebSocket: read subscribe/unsubscribe/ping actions and write queued messages.
+
+    `make_topic` validates a subscribe message and returns (topic_id, spec), raising ValueError
+    for bad requests; errors are reported to the client without closing the connection.
+    `throttle` is charged for every subscribe and returns 0 or the seconds until one is allowed.
+    """
+    subscriber = Subscriber()
+    hub.connections += 1
+
+    async def writer():
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.outbox.get(), timeout=ping_seconds)
+            except asyncio.TimeoutError:
+                # Keeps idle connections open through proxies that drop silent ones
+                message = {"type": "ping", "time": time.time()}
+            await websocket.send_json(message)
+
+    async def reader():
+        while True:
+            text = await websocket.receive_text()
+            request = None
+            try:
+                request = json.loads(text)
+                action = request.get("action") if isinstance(request, dict) else None
+                if action == "subscribe":
+                    retry_after = throttle() if throttle else 0
+                    if retry_after:
+                        raise ValueError(f"Rate limit exceeded for subscriptions; retry in {math.ceil(retry_after)}s")
+                    topic_id, spec = await make_topic(request)
+                    snapshot = await hub.subscribe(subscriber, topic_id, spec)
+                    subscriber.offer({"type": "subscribed", "topic": topic_id, "spec": spec}, hub)
+                    subscriber.offer(snapshot, hub)
+                elif action == "unsubscribe":
+                    hub.unsubscribe(subscriber, request.get("topic"))
+                    subscriber.offer({"type": "unsubscribed", "topic": request.get("topic")}, hub)
+                elif action == "ping":
+                    subscriber.offer({"type": "pong", "time": time.time()}, hub)
+                else:
+                    raise ValueError("action must be subscribe, unsubscribe or ping")
+            except ValueError as e:
+                subscriber.offer({"type": "error", "request": request, "detail": str(e)}, hub)
+
+    tasks = [asyncio.ensure_future(writer()), asyncio.ensure_future(reader())]
+    try:
+        # Whichever side stops first (usually the reader, on disconnect) ends the connection
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                logging.warning(f"Live connection closed: {error!r}")
+    finally:
+        # Bookkeeping first: under cancellation the await below may not get to run to completion
+        hub.disconnect(subscriber)
+        hub.connections -= 1
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,312 @@
+"""Column profiles (type, role, cardinality, null rate, distribution) and the chart choices derived from them"""
+import asyncio
+import logging
+import random
+import re
+import time
+from collections import Counter
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterable
+
+
+from deadlines import create_background_task
+
+# YYYY, YYYY-MM or YYYY-MM-DD, optionally followed by a time; covid dates are stored like this.
+# Bare years are limited to 1800-2299 so four-digit codes aren't taken for dates
+ISO_DATE = re.compile(r"^(\d{4}-\d{2}(-\d{2})?([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?"
+                      r"|(18|19|20|21|22)\d{2})$")
+
+# Distinct values tracked exactly per column; beyond this the cardinality is a lower bound
+MAX_DISTINCT = 10000
+# Numeric values kept per column (reservoir) for quantiles
+QUANTILE_SAMPLE = 5000
+TOP_VALUES = 10
+
+# Dimensions with at most this many values read well as pie slices
+PIE_MAX_CARDINALITY = 8
+# Above this a dimension is too fine-grained to group by
+GROUP_BY_MAX_CARDINALITY = 100
+
+DEFAULT_RECOMMENDATION = {"recommended": "bar", "alternatives": ["line", "pie"]}
+
+
+def value_kind(value: Any) -> Optional[str]:
+    """Storage kind of one value: boolean, numeric, temporal, categorical or nested (None for nulls)"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return None if value != value else "numeric"  # NaN counts as missing
+    if isinstance(value, datetime):
+        return "temporal"
+    if isinstance(value, str):
+        if not value.strip():
+            return None
+        return "temporal" if ISO_DATE.match(value) else "categorical"
+    if isinstance(value, (dict, list)):
+        return "nested"
+    return "categorical"
+
+
+class ColumnAccumulator:
+    """Streaming statistics for one column"""
+
+    def __init__(self, name: str, rng: random.Random):
+        self.name = name
+        self._random = rng
+        self.present = 0
+        self.kinds: Counter = Counter()
+        self.distinct: set = set()
+        self.distinct_capped = False
+        self.top: Counter = Counter()
+        self.integers = True
+        self.numeric_seen = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.minimum: Any = None
+        self.maximum: Any = None
+        self.reservoir: List[float] = []
+        self.temporal_min: Optional[str] = None
+        self.temporal_max: Optional[str] = None
+        self.temporal_lengths: Counter = Counter()
+
+    def add(self, value: Any) -> None:
+        kind = value_kind(value)
+        if kind is None:
+            return
+        self.present += 1
+        self.kinds[kind] += 1
+        if kind == "nested":
+            return
+        if not self.distinct_capped:
+            self.distinct.add(value)
+            if len(self.distinct) > MAX_DISTINCT:
+                self.distinct_capped = True
+        if kind == "numeric":
+            self._add_number(value)
+        elif kind == "temporal":
+            text = value.isoformat() if isinstance(value, datetime) else value
+            self.temporal_lengths[len(text)] += 1
+            self.temporal_min = text if self.temporal_min is None else min(self.temporal_min, text)
+            self.temporal_max = text if self.temporal_max is None else max(self.temporal_max, text)
+        elif not self.distinct_capped:
+            # Top values only while cardinality is small enough for the counter to stay bounded
+            self.top[value] += 1
+
+    def _add_number(self, value: float) -> None:
+        self.numeric_seen += 1
+        if isinstance(value, float) and not value.is_integer():
+            self.integers = False
+        self.total += value
+        self.squares += value * value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        if len(self.reservoir) < QUANTILE_SAMPLE:
+            self.reservoir.append(value)
+        else:
+            slot = self._random.randrange(self.numeric_seen)
+            if slot < QUANTILE_SAMPLE:
+                self.reservoir[slot] = value
+
+    def profile(self, rows: int) -> Dict[str, Any]:
+        import numpy as np
+        kind = self.kinds.most_common(1)[0][0] if self.kinds else "empty"
+        cardinality = len(self.distinct)
+        column: Dict[str, Any] = {
+            "name": self.name,
+            "type": kind,
+            "null_rate": round(1 - self.present / rows, 4) if rows else 0.0,
+            "cardinality": cardinality,
+            "cardinality_is_lower_bound": self.distinct_capped,
+            # Share of values that disagree with the column's type, e.g. "N/A" in a numeric column
+            "mixed_rate": round(1 - self.kinds[kind] / self.present, 4) if self.present else 0.0,
+        }
+        if kind == "numeric" and self.numeric_seen:
+            mean = self.total / self.numeric_seen
+            variance = max(0.0, self.squares / self.numeric_seen - mean * mean)
+            quantiles = np.percentile(np.asarray(self.reservoir, dtype=np.float64), [5, 25, 50, 75, 95])
+            column.update({
+                "integer": self.integers,
+                "min": self.minimum,
+                "max": self.maximum,
+                "mean": round(mean, 4),
+                "std": round(float(np.sqrt(variance)), 4),
+                "quantiles": dict(zip(("p5", "p25", "p50", "p75", "p95"), (round(float(q), 4) for q in quantiles))),
+            })
+        elif kind == "temporal":
+            length = self.temporal_lengths.most_common(1)[0][0]
+            column.update({
+                "min": self.temporal_min,
+                "max": self.temporal_max,
+                "granularity": {4: "year", 7: "month", 10: "day"}.get(length, "timestamp"),
+            })
+        elif kind in ("categorical", "boolean") and self.top:
+            column["top_values"] = [{"value": v, "count": c} for v, c in self.top.most_common(TOP_VALUES)]
+        column["role"] = column_role(self.name, column, rows)
+        return column
+
+
+def column_role(name: str, column: Dict[str, Any], rows: int) -> str:
+    """What a column is for in a chart: temporal axis, measure, dimension, identifier or ignored"""
+    kind = column["type"]
+    if name == "_id" or name.endswith("_id"):
+        return "identifier"
+    if kind == "temporal":
+        return "temporal"
+    if kind == "numeric":
+        # Year columns are stored as integers but are a time axis, not a quantity
+        if column.get("integer") and name.lower().endswith("year") and 1800 <= column["min"] <= column["max"] <= 2200:
+            return "temporal"
+        return "measure"
+    if kind in ("categorical", "boolean"):
+        # A label on (nearly) every row is an identifier, not something to group by
+        if column["cardinality_is_lower_bound"] or (rows > 50 and column["cardinality"] >= 0.95 * rows):
+            return "identifier"
+        return "dimension"
+    return "ignored"
+
+
+def recommend(columns: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Chart type, axes and default grouping and aggregation for a set of column profiles"""
+    by_role: Dict[str, List[Dict[str, Any]]] = {}
+    for column in columns:
+        by_role.setdefault(column["role"], []).append(column)
+    measures = by_role.get("measure", [])
+    temporal = by_role.get("temporal", [])
+    dimensions = sorted(
+        (c for c in by_role.get("dimension", []) if 1 < c["cardinality"] <= GROUP_BY_MAX_CARDINALITY),
+        # The state is the primary dimension of every dataset here; otherwise the coarsest wins
+        key=lambda c: (c["name"] != "state", c["cardinality"]),
+    )
+    group_by = dimensions[0]["name"] if dimensions else None
+    measure = measures[0] if measures else None
+    # Counts add up across rows; rates and indices (fractional or negative values) only average
+    agg = "count"
+    if measure:
+        agg = "sum" if measure.get("integer") and (measure.get("min") or 0) >= 0 else "avg"
+
+    recommendation: Dict[str, Any] = {
+        "recommended": DEFAULT_RECOMMENDATION["recommended"],
+        "alternatives": list(DEFAULT_RECOMMENDATION["alternatives"]),
+        "x_field": group_by,
+        "y_fields": [c["name"] for c in measures[:3]],
+        "group_by": group_by,
+        "agg": agg,
+        "field": measure["name"] if measure else None,
+    }
+    if temporal and measures:
+        recommendation.update(recommended="line", alternatives=["area", "bar"], x_field=temporal[0]["name"])
+    elif dimensions and measures:
+        small = dimensions[0]["cardinality"] <= PIE_MAX_CARDINALITY
+        recommendation.update(recommended="bar", alternatives=["pie", "doughnut"] if small else ["line", "pie"],
+                              x_field=group_by)
+    elif len(measures) >= 2:
+        recommendation.update(recommended="scatter", alternatives=["bubble", "line"], x_field=measures[0]["name"],
+                              y_fields=[c["name"] for c in measures[1:4]])
+    return recommendation
+
+
+class ProfileBuilder:
+    """Feeds rows to one accumulator per column"""
+
+    def __init__(self, seed: Optional[int] = None):
+        self._random = random.Random(seed)
+        self.rows = 0
+        self.columns: Dict[str, ColumnAccumulator] = {}
+
+    def add(self, row: Dict[str, Any]) -> None:
+        self.rows += 1
+        for name, value in row.items():
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = ColumnAccumulator(name, self._random)
+            column.add(value)
+
+    def build(self, collection_name: Optional[str] = None, version: Optional[int] = None) -> Dict[str, Any]:
+        columns = [column.profile(self.rows) for name, column in self.columns.items() if name != "_id"]
+        return {
+            "collection": collection_name,
+            "version": version,
+            "rows": self.rows,
+            "columns": columns,
+            "recommendation": recommend(columns),
+        }
+
+
+def profile_rows(rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Profile of an in-memory set of rows, e.g. a query result without a dataset profile"""
+    builder = ProfileBuilder(seed=0)
+    for row in rows:
+        builder.add(row)
+    return builder.build()
+
+
+class ProfileStore:
+    """Column profiles per collection, computed by one full scan per data version"""
+
+    def __init__(self, database, versions, batch_size: int = 1000, ttl_seconds: float = 900):
+        self.database = database
+        self.versions = versions
+        self.batch_size = batch_size
+        # Without reliable versions a profile may miss writes, so it is only trusted this long
+        self.ttl_seconds = ttl_seconds
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+        self._builds: Dict[str, asyncio.Task] = {}
+        self.build_stats: Dict[str, Dict[str, Any]] = {}
+
+    def _current(self, collection_name: str) -> Optional[Dict[str, Any]]:
+        profile = self._profiles.get(collection_name)
+        if not profile or profile["version"] != self.versions.get(collection_name):
+            return None
+        if self.versions.reliable or time.time() - profile["profiled_at"] < self.ttl_seconds:
+            return profile
+        return None
+
+    def _build_task(self, collection_name: str) -> asyncio.Task:
+        build = self._builds.get(collection_name)
+        if build is None or build.done():
+            # Detached from the request that asked first: later callers share the build
+            build = self._builds[collection_name] = create_background_task(self.build(collection_name))
+        return build
+
+    def get(self, collection_name: str) -> Optional[Dict[str, Any]]:
+        """The current profile, or None while one is (re)built in the background"""
+        profile = self._current(collection_name)
+        if profile is None:
+            self._build_task(collection_name)
+        return profile
+
+    async def load(self, collection_name: str) -> Dict[str, Any]:
+        """The current profile, waiting for a build if necessary"""
+        profile = self._current(collection_name)
+        if profile is not None:
+            return profile
+        # Shielded so a cancelled request doesn't abort a build other callers are waiting on
+        return await asyncio.shield(self._build_task(collection_name))
+
+    async def build(self, collection_name: str) -> Dict[str, Any]:
+        version = self.versions.get(collection_name)
+        started = time.perf_counter()
+        builder = ProfileBuilder()
+        try:
+            rows = self.database.background()[collection_name].find({}, batch_size=self.batch_size)
+            async for row in rows:
+                builder.add(row)
+        except Exception as e:
+            logging.error(f"Error profiling {collection_name}: {e}")
+            raise
+        profile = builder.build(collection_name, version)
+        profile["profiled_at"] = time.time()
+        self._profiles[collection_name] = profile
+        self.build_stats[collection_name] = {
+            "version": version,
+            "rows": builder.rows,
+            "columns": len(profile["columns"]),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        logging.info(f"Profiled {collection_name}: {self.build_stats[collection_name]}")
+        return profile
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"profiles": self.build_stats}
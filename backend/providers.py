@@ -0,0 +1,328 @@
+"""Insight providers (remote LLM, local OpenAI-compatible LLM, statistics templates) and the router between them"""
+import asyncio
+import logging
+import re
+import time
+from typing import List, Dict, Any, Optional, Callable, Tuple, Type
+
+from pydantic import BaseModel
+
+from deadlines import time_limit
+from profiling import profile_rows
+from structured_output import CHART_TYPES, OutputStats, parse_insight
+
+# Provider tiers, cheapest first; routing picks a tier from the query's complexity
+TIER_TEMPLATE, TIER_LOCAL, TIER_REMOTE = 0, 1, 2
+
+# Words that ask for explanation, comparison or judgement rather than a description of the data
+HARD_TERMS = ("why", "explain", "cause", "compare", "comparison", "correlat", "relationship", "impact", "predict",
+              "forecast", "recommend", "policy", "policies", "implication", "comprehensive", "versus", "vs")
+# Detailed panel insights need a long narrative whatever their query says
+SCHEMA_COMPLEXITY = {"BasicInsight": 0.0, "EnhancedInsight": 0.3}
+
+# Robust z-score beyond which a value is reported as an anomaly
+ANOMALY_Z = 3.5
+# Change over the observed years, relative to the mean, below which a trend counts as stable
+STABLE_CHANGE = 0.05
+MAX_ANOMALIES = 3
+
+
+class InsightRequest:
+    """One insight to generate: the data it is about, the question, and the chat prompt for LLM providers"""
+
+    def __init__(self, schema: Type[BaseModel], sample: List[Dict[str, Any]], query: str,
+                 messages: List[Dict[str, str]], max_tokens: int, collection: Optional[str] = None):
+        self.schema = schema
+        self.sample = sample
+        self.query = query
+        self.messages = messages
+        self.max_tokens = max_tokens
+        self.collection = collection
+
+
+def query_complexity(request: InsightRequest) -> float:
+    """0 for a short descriptive question, towards 1 for long ones asking why, what next or what to do"""
+    words = re.findall(r"[a-z]+", request.query.lower())
+    hard = sum(1 for word in words if any(word.startswith(term) for term in HARD_TERMS))
+    score = SCHEMA_COMPLEXITY.get(request.schema.__name__, 0.0) + 0.35 * hard + 0.02 * max(0, len(words) - 8)
+    return min(1.0, score)
+
+
+class InsightProvider:
+    """Generates insights for InsightRequests; latency is tracked so routing can respect deadlines"""
+
+    name = "provider"
+    tier = TIER_TEMPLATE
+    uses_llm = False
+
+    def __init__(self, expected_seconds: float):
+        # Moving average of observed latencies, seeded with the configured expectation
+        self.expected_seconds = expected_seconds
+        self.calls = 0
+        self.failures = 0
+
+    def available(self) -> bool:
+        return True
+
+    async def generate(self, request: InsightRequest, budget: float) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def observe(self, seconds: float, failed: bool = False) -> None:
+        self.calls += 1
+        self.failures += failed
+        if not failed:
+            self.expected_seconds = 0.8 * self.expected_seconds + 0.2 * seconds
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tier": self.tier,
+            "available": self.available(),
+            "calls": self.calls,
+            "failures": self.failures,
+            "expected_ms": round(self.expected_seconds * 1000, 1),
+        }
+
+
+class ChatCompletionProvider(InsightProvider):
+    """
+    Any OpenAI-style chat completions endpoint: OpenAI itself or a local llama.cpp/vLLM server.
+
+    `client` returns the client (anything with chat.completions.create) when called, so it can be
+    created lazily or swapped out; `queue` is the FairQueue admitting calls to this backend.
+    """
+
+    uses_llm = True
+
+    def __init__(self, name: str, tier: int, client: Callable[[], Any], model: str, queue,
+                 output_stats: OutputStats, json_mode: bool = True, expected_seconds: float = 3.0):
+        super().__init__(expected_seconds)
+        self.name = name
+        self.tier = tier
+        self.client = client
+        self.model = model
+        self.queue = queue
+        self.output_stats = output_stats
+        self.json_mode = json_mode
+
+    def available(self) -> bool:
+        try:
+            client = self.client()
+        except Exception:
+            return False
+        return client is not None and bool(getattr(client, "api_key", None))
+
+    async def generate(self, request: InsightRequest, budget: float) -> Dict[str, Any]:
+        extra = {"response_format": {"type": "json_object"}} if self.json_mode else {}
+        async with self.queue.slot():
+            # The worker thread can't be cancelled, so the client gets the same timeout
+            response = await asyncio.wait_for(asyncio.to_thread(
+                self.client().chat.completions.create,
+                model=self.model,
+                messages=request.messages,
+                max_tokens=request.max_tokens,
+                timeout=budget,
+                **extra
+            ), timeout=time_limit(budget))
+        result, outcome = parse_insight(response.choices[0].message.content, request.schema, self.output_stats)
+        if outcome != "valid":
+            logging.info(f"Recovered {outcome} {self.name} output for {request.collection or 'chat query'}")
+        return result
+
+
+def _label(name: str) -> str:
+    return name.replace("_", " ")
+
+
+def _number(value: float) -> str:
+    return f"{value:,.0f}" if abs(value) >= 100 else f"{value:,.2f}"
+
+
+class TemplateProvider(InsightProvider):
+    """
+    Insights computed from the sample itself: leading and trailing states, the trend over years
+    and robust outliers of the dataset's main measure, phrased through fixed templates. No model,
+    no network; a few milliseconds.
+    """
+
+    name = "template"
+    tier = TIER_TEMPLATE
+
+    def __init__(self, expected_seconds: float = 0.005):
+        super().__init__(expected_seconds)
+
+    async def generate(self, request: InsightRequest, budget: float) -> Dict[str, Any]:
+        return self.summarize(request)
+
+    def summarize(self, request: InsightRequest) -> Dict[str, Any]:
+        import numpy as np
+        rows = request.sample
+        profile = profile_rows(rows)
+        recommendation = profile["recommendation"]
+        field = recommendation.get("field")
+        if not field:
+            raise ValueError("No numeric measure to summarize")
+        values = [(row, float(row[field])) for row in rows
+                  if isinstance(row.get(field), (int, float)) and not isinstance(row.get(field), bool)]
+        if not values:
+            raise ValueError(f"No values of {field} to summarize")
+        label = _label(field)
+        subject = f"the {_label(request.collection)} sample" if request.collection else "the sample"
+        numbers = np.array([v for _, v in values])
+        # Counts add up per state; rates and indices are averaged
+        summed = recommendation.get("agg") == "sum"
+
+        by_state: Dict[str, List[float]] = {}
+        by_year: Dict[int, List[float]] = {}
+        for row, value in values:
+            if row.get("state"):
+                by_state.setdefault(str(row["state"]), []).append(value)
+            year = row.get("year") or (str(row.get("date") or "")[:4])
+            if str(year).isdigit():
+                by_year.setdefault(int(year), []).append(value)
+        state_values = {s: (sum(v) if summed else sum(v) / len(v)) for s, v in by_state.items()}
+        ranked = sorted(state_values.items(), key=lambda item: -item[1])
+
+        trend, temporal = self._trend(by_year, label)
+        anomalies = self._anomalies(values, field, label)
+        verb = "total" if summed else "average"
+
+        findings = [f"{label.capitalize()} averages {_number(float(numbers.mean()))} per record "
+                    f"(median {_number(float(np.median(numbers)))}) across {len(values)} records"]
+        comparison = "Not enough states in the sample to compare."
+        if len(ranked) >= 2:
+            (top, top_value), (bottom, bottom_value) = ranked[0], ranked[-1]
+            findings.append(f"{top} has the highest {verb} {label} ({_number(top_value)}), "
+                            f"{bottom} the lowest ({_number(bottom_value)})")
+            ratio = f", {top_value / bottom_value:.1f}x the lowest" if bottom_value > 0 else ""
+            comparison = (f"Across {len(ranked)} states, {verb} {label} ranges from {_number(bottom_value)} in "
+                          f"{bottom} to {_number(top_value)} in {top}{ratio}.")
+        if len(by_year) >= 2:
+            findings.append(temporal.rstrip("."))
+
+        insight = " ".join([f"In {subject}, " + findings[0][0].lower() + findings[0][1:] + "."]
+                           + [f + "." for f in findings[1:]])
+        chart_type = recommendation.get("recommended")
+        result = {
+            "insight": insight,
+            "chart_type": chart_type if chart_type in CHART_TYPES else "bar",
+            "key_metrics": [f"mean {label}: {_number(float(numbers.mean()))}",
+                            f"max {label}: {_number(float(numbers.max()))}",
+                            f"min {label}: {_number(float(numbers.min()))}"],
+            "key_findings": findings,
+            "anomalies": anomalies,
+            "trend": trend,
+            "recommendations": [f"Focus attention on {ranked[0][0]}, which leads on {label}"] if ranked else [],
+            "comparison_insights": comparison,
+            "temporal_analysis": temporal,
+        }
+        return request.schema(**result).dict()
+
+    @staticmethod
+    def _trend(by_year: Dict[int, List[float]], label: str) -> Tuple[str, str]:
+        import numpy as np
+        if len(by_year) < 2:
+            return "stable", "The sample covers a single period, so no trend over time can be read from it."
+        years = np.array(sorted(by_year), dtype=np.float64)
+        means = np.array([np.mean(by_year[int(y)]) for y in years])
+        slope, intercept = np.polyfit(years, means, 1)
+        scale = abs(means.mean()) or 1.0
+        change = slope * (years[-1] - years[0]) / scale
+        residuals = means - (slope * years + intercept)
+        span = f"{int(years[0])}-{int(years[-1])}"
+        if len(years) >= 3 and residuals.std() / scale > max(abs(change), STABLE_CHANGE):
+            return "volatile", f"Average {label} swings from year to year over {span} without a steady direction."
+        if abs(change) < STABLE_CHANGE:
+            return "stable", f"Average {label} stays roughly flat over {span}."
+        direction = "increasing" if change > 0 else "decreasing"
+        return direction, (f"Average {label} is {direction} over {span}, "
+                           f"by about {abs(change) * 100:.0f}% of its mean across the period.")
+
+    @staticmethod
+    def _anomalies(values: List[Tuple[Dict[str, Any], float]], field: str, label: str) -> List[str]:
+        import numpy as np
+        numbers = np.array([v for _, v in values])
+        median = np.median(numbers)
+        mad = np.median(np.abs(numbers - median)) * 1.4826
+        if len(numbers) < 5 or mad == 0:
+            return []
+        scores = (numbers - median) / mad
+        outliers = sorted(np.flatnonzero(np.abs(scores) > ANOMALY_Z), key=lambda i: -abs(scores[i]))
+        anomalies = []
+        for i in outliers[:MAX_ANOMALIES]:
+            row = values[i][0]
+            where = " ".join(str(row[k]) for k in ("state", "year", "date") if row.get(k))
+            level = "high" if scores[i] > 0 else "low"
+            anomalies.append(f"{where}: {label} of {_number(values[i][1])} is unusually {level}".strip(": "))
+        return anomalies
+
+
+class InsightRouter:
+    """
+    Picks providers per request by query complexity and the time left.
+
+    Simple questions go to the template provider, medium ones to the local model and hard ones
+    to the remote model. Providers that are unavailable, not allowed to use an LLM right now, or
+    expected to take longer than the budget are skipped; the rest follow in order as fallbacks.
+    """
+
+    def __init__(self, providers: List[InsightProvider], simple_max: float = 0.25, remote_min: float = 0.6):
+        self.providers = providers
+        self.simple_max = simple_max
+        self.remote_min = remote_min
+        self.routed: Dict[str, int] = {p.name: 0 for p in providers}
+        self.degraded = 0
+
+    def preferred_tier(self, request: InsightRequest) -> int:
+        complexity = query_complexity(request)
+        if complexity <= self.simple_max:
+            return TIER_TEMPLATE
+        return TIER_REMOTE if complexity >= self.remote_min else TIER_LOCAL
+
+    def plan(self, request: InsightRequest, budget: float, allow_llm: bool = True) -> Tuple[List[InsightProvider], int]:
+        """Providers to try in order, and the tier the request should have been answered at"""
+        preferred = self.preferred_tier(request)
+        usable = [
+            p for p in self.providers
+            if p.available() and (not p.uses_llm or (allow_llm and p.expected_seconds < budget))
+        ]
+        # The preferred tier, then more capable ones, then cheaper ones as a last resort
+        usable.sort(key=lambda p: (p.tier < preferred, abs(p.tier - preferred)))
+        return usable, preferred
+
+    async def generate(self, request: InsightRequest, budget: float, allow_llm: bool = True,
+                       fall_through: bool = True) -> Tuple[Dict[str, Any], str, bool]:
+        """
+        (result, provider name, degraded). Degraded results came from a cheaper tier than the
+        request called for and shouldn't be cached. Without `fall_through` only the first
+        provider is tried and its errors propagate, e.g. for a batch that retries on its own.
+        """
+        chain, preferred = self.plan(request, budget, allow_llm)
+        if not chain:
+            raise ValueError("No insight provider available")
+        error: Optional[Exception] = None
+        for provider in chain if fall_through else chain[:1]:
+            started = time.perf_counter()
+            try:
+                result = await provider.generate(request, time_limit(budget))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                provider.observe(time.perf_counter() - started, failed=True)
+                logging.warning(f"Insight provider {provider.name} failed: {e!r}")
+                error = e
+                continue
+            provider.observe(time.perf_counter() - started)
+            self.routed[provider.name] += 1
+            degraded = provider.tier < preferred
+            self.degraded += degraded
+            return result, provider.name, degraded
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "providers": {p.name: p.stats() for p in self.providers},
+            "routed": dict(self.routed),
+            "degraded": self.degraded,
+            "simple_max": self.simple_max,
+            "remote_min": self.remote_min,
+        }
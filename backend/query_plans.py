@@ -0,0 +1,205 @@
+"""Compiled plans for filtered row queries: validated sort and projection, a chosen index, cached per query shape"""
+import logging
+import os
+from typing import List, Dict, Any, Optional, Tuple
+
+from datasets import DatasetDescriptor
+
+# A sort no index provides is done in memory; with a limit Mongo keeps only the top rows, so it
+# stays cheap as long as the page is small
+MAX_BLOCKING_SORT_ROWS = int(os.environ.get('MAX_BLOCKING_SORT_ROWS', 1000))
+EQUALITY_OPERATORS = ("$in", "$eq")
+RANGE_OPERATORS = ("$gte", "$gt", "$lte", "$lt")
+
+
+def condition_kind(condition: Any) -> str:
+    """"eq" for equality and $in (index prefix and sort friendly), "range" for bounds, else "other" """
+    if not isinstance(condition, dict):
+        return "eq"
+    operators = set(condition)
+    if operators and operators <= set(EQUALITY_OPERATORS):
+        return "eq"
+    if operators and operators <= set(RANGE_OPERATORS):
+        return "range"
+    return "other"
+
+
+def query_shape(query: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    """
+    Fields a filter constrains and how, without the values. An $or of ranges on one field is a
+    range; an $or of equalities on several fields (state_id or state name) is "or" on each.
+    """
+    shape = {}
+    clauses = [(field, condition) for field, condition in query.items() if field != "$and"]
+    clauses += [item for clause in query.get("$and", []) for item in clause.items()]
+    for field, condition in clauses:
+        if field == "$or":
+            branches = [(f, condition_kind(c)) for branch in condition for f, c in branch.items()]
+            fields = {f for f, _ in branches}
+            single = len(branches) == len(condition)
+            if len(fields) == 1 and single and all(k == "range" for _, k in branches):
+                shape[fields.pop()] = "range"
+            elif single and all(k == "eq" for _, k in branches):
+                for f in fields:
+                    shape[f] = "or"
+            else:
+                for f in fields:
+                    shape[f] = "other"
+        else:
+            shape[field] = condition_kind(condition)
+    return tuple(sorted(shape.items()))
+
+
+def schema_fields(descriptor: DatasetDescriptor) -> List[str]:
+    """Fields a descriptor declares: dimensions, time, measures, special filters and the natural key"""
+    fields = [*descriptor.dimensions, "state_id", descriptor.time_field, *descriptor.measures,
+              *descriptor.special_filters.values(), *descriptor.natural_key]
+    return list(dict.fromkeys(fields))
+
+
+def choose_index(indexes: List[List[str]], shape: Tuple[Tuple[str, str], ...],
+                 sort_by: Optional[str]) -> Tuple[Optional[List[str]], bool]:
+    """
+    The index serving the most of a query, and whether it also provides the sort order.
+
+    Equality fields lead, then the sort field, then ranges: an index provides the sort when
+    every field ahead of the sort field is matched by equality. Ranked by providing the sort,
+    then by how many leading fields it constrains. An $or branch counts as an equality, since
+    Mongo runs each branch on its own index and merges them in sort order.
+    """
+    kinds = dict(shape)
+    best, best_score = None, (False, 0)
+    for spec in indexes:
+        used = 0
+        for field in spec:
+            if kinds.get(field) not in ("eq", "range", "or"):
+                break
+            used += 1
+        sorts = False
+        if sort_by in spec:
+            position = spec.index(sort_by)
+            sorts = all(kinds.get(field) in ("eq", "or") for field in spec[:position])
+        score = (sorts, used)
+        if (sorts or used) and score > best_score:
+            best, best_score = spec, score
+    return best, best_score[0]
+
+
+class QueryPlan:
+    """How one query shape runs: filter, sort, projection, and the index hinted for it"""
+
+    def __init__(self, collection: str, shape: Tuple[Tuple[str, str], ...], sort: List[Tuple[str, int]],
+                 fields: Optional[List[str]], index: Optional[List[str]], sort_indexed: bool, source: str,
+                 index_ready: bool = True):
+        self.collection = collection
+        self.shape = shape
+        self.sort = sort
+        self.fields = fields
+        self.index = index
+        # Whether the descriptor's indexes have been created; a hint on a missing index fails the query
+        self.index_ready = index_ready
+        self.blocking_sort = bool(sort) and not sort_indexed
+        self.source = source
+        self.projection: Dict[str, int] = {"_id": 0, **{field: 1 for field in fields or []}}
+        # Covered: answered from index keys alone, without fetching documents
+        self.covered = bool(index and fields and set(fields) <= set(index)
+                            and all(field in index for field, _ in shape))
+        self.hits = 0
+
+    @property
+    def hint(self) -> Optional[List[Tuple[str, int]]]:
+        """The chosen index, unless it isn't built yet or an $or is left to Mongo to run per branch"""
+        if not self.index or not self.index_ready or any(kind in ("or", "other") for _, kind in self.shape):
+            return None
+        return [(field, 1) for field in self.index]
+
+    def project(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Projection applied in process, for rows that didn't come from a find (buckets, samples)"""
+        if not self.fields:
+            return rows
+        return [{field: row[field] for field in self.fields if field in row} for row in rows]
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "collection": self.collection,
+            "filter": dict(self.shape),
+            "sort": self.sort,
+            "projection": self.projection,
+            "index": self.index,
+            "index_ready": self.index_ready,
+            "covered": self.covered,
+            "blocking_sort": self.blocking_sort,
+            "source": self.source,
+            "hits": self.hits,
+        }
+
+
+class QueryPlanner:
+    """
+    Compiles filtered queries into plans and caches them per query shape.
+
+    Sort and projection fields must be in the dataset's schema: its descriptor, or failing that
+    its column profile. A sort no index provides is only accepted for small pages. Plans are
+    dropped when a collection's data version moves, which a descriptor change also causes.
+    """
+
+    def __init__(self, datasets, profiles, database):
+        self.datasets = datasets
+        self.profiles = profiles
+        self.database = database
+        self._plans: Dict[str, Dict[tuple, QueryPlan]] = {}
+        self.compiled = 0
+
+    async def _validate(self, descriptor: DatasetDescriptor, fields: List[str]) -> None:
+        known = set(schema_fields(descriptor))
+        if set(fields) <= known:
+            return
+        profile = await self.profiles.load(descriptor.collection)
+        known |= {column["name"] for column in profile["columns"]}
+        unknown = [field for field in fields if field not in known]
+        if unknown:
+            raise ValueError(f"Unknown fields for {descriptor.collection}: {', '.join(unknown)}")
+
+    async def plan(self, collection_name: str, query: Dict[str, Any], sort_by: Optional[str] = None,
+                   sort_order: Optional[str] = "asc", fields: Optional[List[str]] = None,
+                   limit: int = 100, rollup: bool = False) -> QueryPlan:
+        if sort_by and sort_order not in ("asc", "desc"):
+            raise ValueError("sort_order must be asc or desc")
+        fields = list(dict.fromkeys(fields)) if fields else None
+        shape = query_shape(query)
+        key = (shape, sort_by, sort_order if sort_by else None, tuple(fields or ()), rollup)
+        plans = self._plans.setdefault(collection_name, {})
+        plan = plans.get(key)
+        if plan is None:
+            descriptor = self.datasets.get(collection_name)
+            await self._validate(descriptor, [*([sort_by] if sort_by else []), *(fields or [])])
+            indexes = self.datasets.built_indexes(collection_name)
+            if indexes is None:
+                # Built on a detached task (normally by warm-up); until then plans aren't hinted or kept
+                self.datasets.build_indexes(self.database, collection_name)
+            index, sort_indexed = choose_index(indexes or descriptor.index_specs(), shape, sort_by)
+            sort = [(sort_by, 1 if sort_order == "asc" else -1)] if sort_by else []
+            # Monthly buckets answer unsorted pages on the state and time fields they are keyed by
+            source = "buckets" if rollup and not sort and all(
+                field in ("state", "state_id", descriptor.time_field) for field, _ in shape) else "rows"
+            plan = QueryPlan(collection_name, shape, sort, fields, index, sort_indexed, source,
+                             index_ready=indexes is not None)
+            if plan.index_ready:
+                plans[key] = plan
+            self.compiled += 1
+            if plan.blocking_sort:
+                logging.info(f"No index provides sort on {sort_by} for {collection_name}; sorting in memory")
+        if plan.blocking_sort and limit > MAX_BLOCKING_SORT_ROWS:
+            raise ValueError(f"Sorting {collection_name} by {sort_by} isn't indexed; use a limit of at most "
+                             f"{MAX_BLOCKING_SORT_ROWS} or sort by an indexed field")
+        plan.hits += 1
+        return plan
+
+    def invalidate(self, collection_name: str, version: Optional[int] = None) -> None:
+        self._plans.pop(collection_name, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "compiled": self.compiled,
+            "plans": [plan.describe() for plans in self._plans.values() for plan in plans.values()],
+        }
@@ -0,0 +1,280 @@
+"""Per-client token-bucket rate limits and fair admission control for LLM-backed work"""
+import asyncio
+import hashlib
+import hmac
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterable
+
+from deadlines import time_limit
+
+# Budget classes: LLM-backed routes get a much smaller budget than plain reads
+BUDGET_READ = "read"
+BUDGET_LLM = "llm"
+
+# Routes whose handlers call the LLM (path prefixes under /api)
+LLM_ROUTE_PREFIXES = ("/api/chat", "/api/insights", "/api/visualize", "/api/dashboard")
+# Health checks must never be throttled
+EXEMPT_ROUTES = ("/api/ready",)
+
+# Identity of the client making the current request, set by the rate-limit middleware
+current_client: ContextVar[str] = ContextVar("current_client", default="anonymous")
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, burst: float, now: float):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float, cost: float = 1.0) -> float:
+        """Spend `cost` tokens; returns 0 on success or the seconds until enough tokens refill"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+
+class RateLimiter:
+    """Token buckets per (client, budget class), evicting the least recently seen clients"""
+
+    def __init__(self, budgets: Dict[str, Tuple[float, float]], max_clients: int = 10000, enabled: bool = True):
+        # budget class -> (requests per minute, burst)
+        self.budgets = budgets
+        self.max_clients = max_clients
+        self.enabled = enabled
+        self._buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+        self.allowed = 0
+        self.limited: Dict[str, int] = {budget: 0 for budget in budgets}
+
+    def check(self, client: str, budget: str, cost: float = 1.0) -> float:
+        """0 if the request may proceed, otherwise the Retry-After delay in seconds"""
+        if not self.enabled or budget not in self.budgets:
+            return 0.0
+        now = time.monotonic()
+        key = (client, budget)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            per_minute, burst = self.budgets[budget]
+            bucket = self._buckets[key] = TokenBucket(per_minute / 60.0, burst, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        retry_after = bucket.take(now, cost)
+        if retry_after:
+            self.limited[budget] += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "budgets": {name: {"per_minute": rate, "burst": burst} for name, (rate, burst) in self.budgets.items()},
+            "tracked_buckets": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": dict(self.limited),
+        }
+
+
+def route_budget(path: str) -> Optional[str]:
+    """Budget class for a request path; None for paths that are never limited"""
+    if not path.startswith("/api") or path in EXEMPT_ROUTES:
+        return None
+    if path.startswith(LLM_ROUTE_PREFIXES):
+        return BUDGET_LLM
+    return BUDGET_READ
+
+
+def client_identity(headers, peer: Optional[str], trusted_proxies: List[str],
+                    known_keys: Iterable[str] = ()) -> str:
+    """
+    A recognised API key, otherwise the client IP (from X-Forwarded-For only when set by a
+    trusted proxy). Unrecognised keys are ignored, or a client could send a fresh random key
+    on every request and get a fresh bucket each time.
+    """
+    api_key = headers.get("x-api-key")
+    if api_key and any(hmac.compare_digest(api_key, key) for key in known_keys if key):
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    if peer in trusted_proxies:
+        forwarded = headers.get("x-forwarded-for")
+        if forwarded:
+            return "ip:" + forwarded.split(",")[0].strip()
+        real_ip = headers.get("x-real-ip")
+        if real_ip:
+            return "ip:" + real_ip.strip()
+    return "ip:" + (peer or "unknown")
+
+
+class AdmissionRejected(Exception):
+    """Raised when LLM work can't be admitted: too many waiters or waited too long"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class FairQueue:
+    """
+    Admission control for LLM calls.
+
+    At most `concurrency` calls run at once. When they are all busy, waiters queue per client
+    and freed slots are handed out round-robin across clients, so a client with fifty queued
+    calls delays a client with one by at most one slot turn rather than fifty.
+    """
+
+    def __init__(self, concurrency: int = 8, max_waiting: int = 200, wait_timeout: float = 30.0):
+        self.concurrency = concurrency
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.active = 0
+        self.waiting = 0
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_wait_ms = 0.0
+
+    @asynccontextmanager
+    async def slot(self, client: Optional[str] = None):
+        await self._acquire(client or current_client.get())
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, client: str) -> None:
+        if self.active < self.concurrency and not self._queues:
+            self.active += 1
+            self.admitted += 1
+            return
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise AdmissionRejected("LLM queue is full", retry_after=self.wait_timeout)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(client, deque()).append(future)
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            # Never wait past the request's own deadline
+            await asyncio.wait_for(asyncio.shield(future), timeout=time_limit(self.wait_timeout))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self._release()
+            else:
+                future.cancel()
+                self._forget(client, future)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise AdmissionRejected("Timed out waiting for an LLM slot", retry_after=self.wait_timeout)
+            raise
+        self.admitted += 1
+        self.max_wait_ms = max(self.max_wait_ms, (time.perf_counter() - started) * 1000)
+
+    def _forget(self, client: str, future: asyncio.Future) -> None:
+        queue = self._queues.get(client)
+        if queue and future in queue:
+            queue.remove(future)
+            self.waiting -= 1
+            if not queue:
+                del self._queues[client]
+
+    def _release(self) -> None:
+        # Hand the slot straight to the next client in round-robin order, or free it
+        while self._queues:
+            client, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            self.waiting -= 1
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "waiting_clients": len(self._queues),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "max_wait_ms": round(self.max_wait_ms, 1),
+        }
+
+
+class OverloadDetector:
+    """
+    Combines in-flight requests, LLM queue depth and event-loop lag into one pressure figure.
+
+    Pressure 1.0 means one signal reached its limit; low-priority work (insights) is shed from
+    there on so that the remaining capacity goes to charts, filters and chat.
+    """
+
+    def __init__(self, llm_queue: FairQueue, max_inflight: int = 200, max_llm_waiting: int = 50,
+                 max_loop_lag_ms: float = 250, lag_interval: float = 0.5):
+        self.llm_queue = llm_queue
+        self.max_inflight = max_inflight
+        self.max_llm_waiting = max_llm_waiting
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.lag_interval = lag_interval
+        self.inflight = 0
+        self.loop_lag_ms = 0.0
+        self.shed = 0
+        # Called with each raw lag sample (ms) on the loop thread, e.g. by a stall watchdog
+        self.lag_listeners: List[Callable[[float], None]] = []
+
+    @asynccontextmanager
+    async def track(self):
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+
+    @property
+    def pressure(self) -> float:
+        return max(
+            self.inflight / self.max_inflight if self.max_inflight else 0.0,
+            self.llm_queue.waiting / self.max_llm_waiting if self.max_llm_waiting else 0.0,
+            self.loop_lag_ms / self.max_loop_lag_ms if self.max_loop_lag_ms else 0.0,
+        )
+
+    def should_shed(self) -> bool:
+        """Whether low-priority work should be refused right now; counts each refusal"""
+        if self.pressure >= 1.0:
+            self.shed += 1
+            return True
+        return False
+
+    async def monitor_loop_lag(self) -> None:
+        """Sample how late the event loop wakes up; an exponentially weighted average smooths spikes"""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            lag_ms = max(0.0, (time.perf_counter() - started - self.lag_interval) * 1000)
+            self.loop_lag_ms = 0.8 * self.loop_lag_ms + 0.2 * lag_ms
+            for listener in self.lag_listeners:
+                listener(lag_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pressure": round(self.pressure, 3),
+            "inflight": self.inflight,
+            "llm_waiting": self.llm_queue.waiting,
+            "loop_lag_ms": round(self.loop_lag_ms, 2),
+            "shed": self.shed,
+        }
@@ -0,0 +1,205 @@
+"""Stratified samples and estimators for approximate (approx=true) queries with confidence intervals"""
+from __future__ import annotations
+import asyncio
+import logging
+import random
+import time
+from statistics import NormalDist
+from typing import List, Dict, Any, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+from deadlines import create_background_task
+from states import document_state_id
+
+# Fields that identify a row rather than describe it; never treated as categories or measures
+IDENTITY_FIELDS = ("_id", "state", "state_id", "year", "date")
+
+
+def row_state_id(row: Dict[str, Any]) -> int:
+    code = document_state_id(row)
+    return -1 if code is None else code
+
+
+def row_year(row: Dict[str, Any]) -> Optional[int]:
+    if isinstance(row.get("year"), (int, float)):
+        return int(row["year"])
+    if isinstance(row.get("date"), str) and row["date"][:4].isdigit():
+        return int(row["date"][:4])
+    return None
+
+
+class StratifiedSample:
+    """
+    Columnar reservoir sample of one collection, stratified by (state, year).
+
+    Each stratum keeps at most `per_stratum` rows together with its population size, which is
+    what the stratified estimators below need to scale sample sums up to collection totals.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], strata: List[Tuple[int, int]], population: List[int]):
+        import numpy as np
+        self.rows = rows
+        self.size = len(rows)
+        stratum_index = {stratum: i for i, stratum in enumerate(strata)}
+        self.strata = np.array([stratum_index[(row_state_id(r), row_year(r) or 0)] for r in rows], dtype=np.int64)
+        self.population = np.asarray(population, dtype=np.float64)
+        self.sample_sizes = np.bincount(self.strata, minlength=len(strata)).astype(np.float64)
+        self.state_ids = np.array([row_state_id(r) for r in rows], dtype=np.int64)
+        self.years = np.array([row_year(r) or 0 for r in rows], dtype=np.int64)
+        self.numeric: Dict[str, np.ndarray] = {}
+        self.categorical: Dict[str, np.ndarray] = {}
+        fields = {key for row in rows for key in row if key not in IDENTITY_FIELDS}
+        for field in fields:
+            values = [row.get(field) for row in rows]
+            present = [v for v in values if v is not None]
+            if present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+                self.numeric[field] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            elif present and all(isinstance(v, str) for v in present):
+                self.categorical[field] = np.array(values, dtype=object)
+
+    def mask(self, state_ids: Optional[List[int]] = None, years: Optional[List[int]] = None,
+             categories: Optional[Dict[str, List[str]]] = None) -> np.ndarray:
+        import numpy as np
+        selected = np.ones(self.size, dtype=bool)
+        if state_ids:
+            selected &= np.isin(self.state_ids, state_ids)
+        if years:
+            selected &= np.isin(self.years, years)
+        for field, values in (categories or {}).items():
+            if values and field in self.categorical:
+                selected &= np.isin(self.categorical[field], values)
+        return selected
+
+    def _total(self, values: np.ndarray) -> Tuple[float, float]:
+        """Stratified estimate of a population total and its variance, with finite population correction"""
+        import numpy as np
+        n = np.maximum(self.sample_sizes, 1)
+        sums = np.bincount(self.strata, weights=values, minlength=len(n))
+        squares = np.bincount(self.strata, weights=values * values, minlength=len(n))
+        means = sums / n
+        variances = np.where(self.sample_sizes > 1, (squares - n * means ** 2) / np.maximum(n - 1, 1), 0.0)
+        fpc = 1 - self.sample_sizes / np.maximum(self.population, 1)
+        total = float(np.sum(self.population * means))
+        variance = float(np.sum(self.population ** 2 * fpc * np.maximum(variances, 0) / n))
+        return total, variance
+
+    def estimate(self, selected: np.ndarray, agg: str, field: Optional[str] = None,
+                 confidence: float = 0.95) -> Dict[str, Any]:
+        """Estimate count, sum or avg of `field` over the selected rows with a normal-approximation interval"""
+        import numpy as np
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        indicator = selected.astype(np.float64)
+        if agg != "count":
+            values = self.numeric.get(field)
+            if values is None:
+                raise ValueError(f"'{field}' is not a numeric field")
+            indicator = indicator * ~np.isnan(values)
+            values = np.nan_to_num(values)
+
+        count, count_variance = self._total(indicator)
+        if agg == "count":
+            value, variance = count, count_variance
+        elif agg == "sum":
+            value, variance = self._total(values * indicator)
+        else:
+            total, _ = self._total(values * indicator)
+            value = total / count if count else 0.0
+            # Ratio estimator variance by linearization: the total of the residuals around the mean
+            _, residual_variance = self._total((values - value) * indicator)
+            variance = residual_variance / count ** 2 if count else 0.0
+
+        margin = z * float(np.sqrt(variance))
+        return {
+            "value": value,
+            "ci_low": value - margin,
+            "ci_high": value + margin,
+            "sample_rows": int(indicator.sum()),
+        }
+
+    def group_values(self, group_by: str) -> np.ndarray:
+        if group_by == "state":
+            return self.state_ids
+        if group_by == "year":
+            return self.years
+        if group_by in self.categorical:
+            return self.categorical[group_by]
+        raise ValueError(f"Cannot group by '{group_by}'")
+
+
+class SampleStore:
+    """Stratified samples per collection, built in the background and rebuilt when the data version moves"""
+
+    def __init__(self, database, versions, per_stratum: int = 100, seed: Optional[int] = None,
+                 ttl_seconds: float = 900, retry_seconds: float = 60):
+        self.database = database
+        self.versions = versions
+        self.per_stratum = per_stratum
+        # Without reliable versions a sample may miss writes, so it is only trusted this long
+        self.ttl_seconds = ttl_seconds
+        # A failed build isn't retried sooner than this, or every approx request would start a scan
+        self.retry_seconds = retry_seconds
+        self._random = random.Random(seed)
+        self._samples: Dict[str, Tuple[int, float, StratifiedSample]] = {}
+        self._builds: Dict[str, asyncio.Task] = {}
+        self._failed_at: Dict[str, float] = {}
+        self.build_stats: Dict[str, Dict[str, Any]] = {}
+
+    def get(self, collection_name: str) -> Optional[StratifiedSample]:
+        """The current sample, or None while one is (re)built; callers answer exactly in the meantime"""
+        version = self.versions.get(collection_name)
+        entry = self._samples.get(collection_name)
+        if entry and entry[0] == version and (
+                self.versions.reliable or time.time() - entry[1] < self.ttl_seconds):
+            return entry[2]
+        failed_at = self._failed_at.get(collection_name)
+        if failed_at is not None and time.monotonic() - failed_at < self.retry_seconds:
+            return None
+        build = self._builds.get(collection_name)
+        if build is None or build.done():
+            # Detached: the build outlives the request that noticed the sample was missing
+            self._builds[collection_name] = create_background_task(self.build(collection_name))
+        return None
+
+    async def build(self, collection_name: str) -> StratifiedSample:
+        version = self.versions.get(collection_name)
+        started = time.perf_counter()
+        reservoirs: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+        population: Dict[Tuple[int, int], int] = {}
+        rows_read = 0
+        try:
+            async for row in self.database.background()[collection_name].find({}):
+                rows_read += 1
+                stratum = (row_state_id(row), row_year(row) or 0)
+                seen = population.get(stratum, 0) + 1
+                population[stratum] = seen
+                reservoir = reservoirs.setdefault(stratum, [])
+                if len(reservoir) < self.per_stratum:
+                    reservoir.append(row)
+                else:
+                    slot = self._random.randrange(seen)
+                    if slot < self.per_stratum:
+                        reservoir[slot] = row
+        except Exception as e:
+            self._failed_at[collection_name] = time.monotonic()
+            logging.error(f"Error building sample for {collection_name}, retrying in {self.retry_seconds:.0f}s: {e}")
+            raise
+
+        strata = list(population)
+        rows = [row for stratum in strata for row in reservoirs[stratum]]
+        sample = await asyncio.to_thread(StratifiedSample, rows, strata, [population[s] for s in strata])
+        self._samples[collection_name] = (version, time.time(), sample)
+        self._failed_at.pop(collection_name, None)
+        self.build_stats[collection_name] = {
+            "version": version,
+            "rows_read": rows_read,
+            "sample_rows": len(rows),
+            "strata": len(strata),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        logging.info(f"Built approximate-query sample for {collection_name}: {self.build_stats[collection_name]}")
+        return sample
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"per_stratum": self.per_stratum, "samples": self.build_stats}
@@ -0,0 +1,188 @@
+"""Faceted filter counts from one $facet aggregation, and a token index over dataset values for search"""
+import bisect
+import re
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+from datasets import DatasetDescriptor
+from states import state_dimension, document_state_id
+
+STATE_FACET = "states"
+YEAR_FACET = "years"
+TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def facet_names(descriptor: DatasetDescriptor) -> List[str]:
+    """Facets a dataset offers: state, year and each special filter, by their request names"""
+    return [STATE_FACET, YEAR_FACET, *descriptor.special_filters]
+
+
+def _query(descriptor: DatasetDescriptor, active: Dict[str, List[Any]]) -> Dict[str, Any]:
+    special = {name: values for name, values in active.items() if name not in (STATE_FACET, YEAR_FACET)}
+    return descriptor.filter_query(active.get(STATE_FACET), active.get(YEAR_FACET), special)
+
+
+def _group_key(descriptor: DatasetDescriptor, facet: str) -> Any:
+    if facet == STATE_FACET:
+        # Documents without a state_id are counted under their stored name
+        return {"$ifNull": ["$state_id", "$state"]}
+    if facet == YEAR_FACET:
+        return descriptor.year_expression()
+    return f"${descriptor.special_filters[facet]}"
+
+
+def facet_pipeline(descriptor: DatasetDescriptor, active: Dict[str, List[Any]], facets: List[str]) -> List[Dict[str, Any]]:
+    """
+    One aggregation counting every facet's values plus the matching total.
+
+    Each facet is counted under all the active filters except its own, so a picker lists the
+    alternatives to what is selected with the result size each would give. Filters on facets
+    that were not requested hold for every branch and run first, where they can use an index.
+    """
+    shared = {name: values for name, values in active.items() if name not in facets}
+    branches: Dict[str, List[Dict[str, Any]]] = {}
+    for facet in facets:
+        others = {name: values for name, values in active.items() if name in facets and name != facet}
+        branches[facet] = [
+            {"$match": _query(descriptor, others)},
+            {"$group": {"_id": _group_key(descriptor, facet), "count": {"$sum": 1}}},
+        ]
+    branches["total"] = [
+        {"$match": _query(descriptor, {name: values for name, values in active.items() if name in facets})},
+        {"$count": "count"},
+    ]
+    return [{"$match": _query(descriptor, shared)}, {"$facet": branches}]
+
+
+def _label(facet: str, value: Any) -> Any:
+    if facet == STATE_FACET:
+        return state_dimension.name(document_state_id({"state_id": value, "state": value})) or value
+    if facet == YEAR_FACET:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    return value
+
+
+def shape_facets(raw: Dict[str, List[Dict[str, Any]]], active: Dict[str, List[Any]], facets: List[str],
+                 limit: Optional[int] = None) -> Dict[str, Any]:
+    """Facet values by count (most first), flagged when selected, from a facet_pipeline result"""
+    result: Dict[str, Any] = {"total": raw["total"][0]["count"] if raw.get("total") else 0, "facets": {}}
+    for facet in facets:
+        counts: Dict[Any, int] = {}
+        for row in raw.get(facet, []):
+            value = _label(facet, row["_id"])
+            if value is not None:
+                # Legacy spellings and unbackfilled documents can land on the same label
+                counts[value] = counts.get(value, 0) + row["count"]
+        if facet == STATE_FACET:
+            selected = {state_dimension.canonical_name(v) or v for v in active.get(facet) or []}
+        else:
+            selected = set(active.get(facet) or [])
+        values = sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))
+        result["facets"][facet] = {
+            "values": [{"value": value, "count": count, "selected": value in selected}
+                       for value, count in values[:limit]],
+            "distinct": len(values),
+        }
+    return result
+
+
+def tokens(text: Any) -> List[str]:
+    return TOKEN.findall(str(text).lower())
+
+
+def _state_aliases() -> Dict[str, List[str]]:
+    return {entry["name"]: entry["aliases"] for entry in state_dimension.to_list()}
+
+
+class SearchIndex:
+    """
+    Inverted index over one dataset's searchable entries: its description, fields and facet values.
+
+    Tokens are kept sorted so a query word matches by prefix with a binary search; an entry
+    matches when every query word prefixes one of its tokens.
+    """
+
+    def __init__(self, entries: List[Dict[str, Any]], terms: List[List[str]]):
+        self.entries = entries
+        postings: Dict[str, set] = {}
+        for i, entry_terms in enumerate(terms):
+            for term in entry_terms:
+                for token in tokens(term):
+                    postings.setdefault(token, set()).add(i)
+        self._tokens = sorted(postings)
+        self._postings = [postings[token] for token in self._tokens]
+
+    @classmethod
+    def build(cls, descriptor: DatasetDescriptor, facets: Dict[str, Any]) -> "SearchIndex":
+        """From unfiltered shape_facets output for the dataset"""
+        aliases = _state_aliases()
+        entries: List[Dict[str, Any]] = [{"kind": "dataset", "collection": descriptor.collection,
+                                          "value": descriptor.description, "count": facets["total"]}]
+        terms: List[List[str]] = [[descriptor.collection.replace("_", " "), descriptor.description,
+                                   descriptor.subject or ""]]
+        for field in dict.fromkeys([*descriptor.dimensions, descriptor.time_field, *descriptor.measures]):
+            entries.append({"kind": "field", "collection": descriptor.collection, "value": field})
+            terms.append([field.replace("_", " ")])
+        for facet, found in facets["facets"].items():
+            for item in found["values"]:
+                entries.append({"kind": "value", "collection": descriptor.collection, "facet": facet,
+                                "value": item["value"], "count": item["count"]})
+                terms.append([str(item["value"]), *(aliases.get(item["value"], []) if facet == STATE_FACET else [])])
+        return cls(entries, terms)
+
+    def _prefixed(self, word: str) -> set:
+        """Entries with a token starting with `word`"""
+        start = bisect.bisect_left(self._tokens, word)
+        matched: set = set()
+        for i in range(start, len(self._tokens)):
+            if not self._tokens[i].startswith(word):
+                break
+            matched |= self._postings[i]
+        return matched
+
+    def search(self, query: str) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        (score, entry) for entries matching every query word: 2 when the value is exactly the
+        query, 1 when it contains all the query words whole, 0 for prefix or alias matches
+        """
+        words = tokens(query)
+        if not words:
+            return []
+        matched: Optional[set] = None
+        for word in words:
+            found = self._prefixed(word)
+            matched = found if matched is None else matched & found
+            if not matched:
+                return []
+        phrase = " ".join(words)
+        results = []
+        for i in matched:
+            entry = self.entries[i]
+            value_tokens = tokens(entry["value"])
+            score = 2 if " ".join(value_tokens) == phrase else 1 if set(words) <= set(value_tokens) else 0
+            results.append((score, entry))
+        return results
+
+
+class SearchIndexes:
+    """Search indexes per collection, rebuilt when the collection's data version moves"""
+
+    def __init__(self, versions, ttl_seconds: float = 900):
+        self.versions = versions
+        # Without reliable versions an index may miss writes, so it is only trusted this long
+        self.ttl_seconds = ttl_seconds
+        self._indexes: Dict[str, Tuple[int, float, SearchIndex]] = {}
+
+    def get(self, collection_name: str) -> Optional[SearchIndex]:
+        entry = self._indexes.get(collection_name)
+        if entry and entry[0] == self.versions.get(collection_name) and (
+                self.versions.reliable or time.time() - entry[1] < self.ttl_seconds):
+            return entry[2]
+        return None
+
+    def set(self, collection_name: str, version: int, index: SearchIndex) -> None:
+        if version == self.versions.get(collection_name):
+            self._indexes[collection_name] = (version, time.time(), index)
@@ -1,33 +1,220 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+import time
+# Measured from the first import so /api/ready can report how long importing the app took
+IMPORT_STARTED = time.perf_counter()
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Header, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Dict, Any, Optional
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
-import openai
 import json
 import asyncio
+import math
+import threading
+import importlib
 from collections import defaultdict
-import numpy as np
+
+from database import connect, WORKLOAD_ANALYTICS
+from caching import (
+    CollectionRegistry, InsightCache, DataVersions, ResultCache, canonical_key, normalize_filters
+)
+from warmup import AccessLog, WarmupState, run_warmup, run_check, recheck_until_healthy
+from concurrency import run_stages
+from ingest import IngestStats, ingest_records, read_records, detect_format, open_upload
+from states import state_dimension
+from datasets import DatasetRegistry, DatasetDescriptor
+from query_plans import QueryPlanner
+from search import SearchIndex, SearchIndexes, facet_names, facet_pipeline, shape_facets
+from timeseries import TimeSeriesStore, INTERVALS, AGGREGATIONS, downsample_rows
+from downsampling import METHODS, target_points, downsample_records, downsample_points
+from sampling import SampleStore
+from profiling import ProfileStore, DEFAULT_RECOMMENDATION, profile_rows
+from correlation import CorrelationStore, METHODS as CORRELATION_METHODS
+from forecasting import ForecastStore, MODELS as FORECAST_MODELS
+from live import LiveHub, serve_connection
+from ratelimit import (
+    RateLimiter, FairQueue, OverloadDetector, BUDGET_READ, BUDGET_LLM, current_client, route_budget, client_identity
+)
+from deadlines import DeadlinePolicy, DeadlineMiddleware, time_limit, create_background_task
+from diagnostics import ProfileRecorder, ProfilingMiddleware, LoopWatchdog, StackSampler, collapsed_text, summarize
+from structured_output import BasicInsight, EnhancedInsight, OutputStats
+from providers import (
+    InsightRequest, InsightRouter, TemplateProvider, ChatCompletionProvider, TIER_LOCAL, TIER_REMOTE
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB Atlas connection
 mongo_url = os.environ.get('MONGO_URL')
-client = AsyncIOMotorClient(mongo_url)
-db = client["world_data"]  # Using the world_data database as specified
+# Nothing connects here: the client is created and pinged by the app's lifespan
+mongo, db = connect(mongo_url, "world_data")  # Using the world_data database as specified
+# Read-heavy dashboard endpoints may be served by secondaries (see MONGO_ANALYTICS_READ_PREFERENCE)
+analytics_db = db.for_workload(WORKLOAD_ANALYTICS)
+# Internal caches live in their own database so they never show up as datasets
+cache_db = db.sibling(os.environ.get('CACHE_DB_NAME', 'tracity_cache'))
+
+# Caches and warm-up state
+registry = CollectionRegistry(analytics_db, ttl_seconds=float(os.environ.get('METADATA_TTL_SECONDS', 900)))
+insight_cache = InsightCache(cache_db["insights"], ttl_seconds=float(os.environ.get('INSIGHT_CACHE_TTL_SECONDS', 21600)))
+access_log = AccessLog(cache_db["access_log"])
+# Query results are only cached while a change stream (or the ingest hook) tracks data versions
+data_versions = DataVersions(trust_ingest=os.environ.get('RESULT_CACHE_TRUST_INGEST', 'false').lower() == 'true')
+result_cache = ResultCache(data_versions, max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+
+def cache_fill_db():
+    """
+    Database for reads whose results go into the result cache. A lagging secondary can return
+    rows from before the write that moved the data version, which would then be cached as
+    current, so while the cache is on these read from the primary; only misses reach it.
+    """
+    return db if data_versions.reliable else analytics_db
+data_versions.subscribe(result_cache.invalidate)
+data_versions.subscribe(lambda collection_name, version: registry.invalidate(collection_name))
+manifests = cache_db["dataset_manifests"]
+# Per-collection dimensions, time field, special filters, indexes, rollups and prompts (built-in plus stored)
+datasets = DatasetRegistry(cache_db["dataset_descriptors"])
+# Daily collections also kept as per-state monthly buckets, with the fields downsampling reports by default
+TIME_SERIES_FIELDS = datasets.rollups()
+time_series = {name: TimeSeriesStore(db, cache_db, name, data_versions) for name in TIME_SERIES_FIELDS}
+# Per-(state, year) samples answering approx=true queries while exact results aren't needed
+samples = SampleStore(analytics_db, data_versions, per_stratum=int(os.environ.get('APPROX_SAMPLE_PER_STRATUM', 100)),
+                      ttl_seconds=float(os.environ.get('METADATA_TTL_SECONDS', 900)))
+# Column profiles drive chart recommendations and default aggregations; one scan per data version
+profiles = ProfileStore(analytics_db, data_versions, ttl_seconds=float(os.environ.get('METADATA_TTL_SECONDS', 900)))
+# State-year matrix joining every dataset's measures, for cross-dataset correlations without the LLM.
+# Built from the primary: correlate results are cached from it under the input versions
+correlations = CorrelationStore(db, profiles, data_versions,
+                                ttl_seconds=float(os.environ.get('METADATA_TTL_SECONDS', 900)))
+MAX_CORRELATION_LAG = 5
+# Fitted forecast models per dataset version; forecasts for any horizon are computed from them
+forecasts = ForecastStore(data_versions, ttl_seconds=float(os.environ.get('METADATA_TTL_SECONDS', 900)))
+MAX_FORECAST_HORIZON = 60
+# Validated, index-aware plans for filtered row queries, compiled once per query shape
+query_planner = QueryPlanner(datasets, profiles, db)
+data_versions.subscribe(query_planner.invalidate)
+# Token indexes over each dataset's facet values for /search, rebuilt per data version (or TTL)
+search_indexes = SearchIndexes(data_versions, ttl_seconds=float(os.environ.get('METADATA_TTL_SECONDS', 900)))
+MAX_SEARCH_RESULTS = 100
+# Per-client request budgets (requests per minute, burst) and admission control for LLM calls
+rate_limiter = RateLimiter(
+    {
+        BUDGET_READ: (float(os.environ.get('RATE_LIMIT_READ_PER_MINUTE', 600)),
+                      float(os.environ.get('RATE_LIMIT_READ_BURST', 60))),
+        BUDGET_LLM: (float(os.environ.get('RATE_LIMIT_LLM_PER_MINUTE', 60)),
+                     float(os.environ.get('RATE_LIMIT_LLM_BURST', 20))),
+    },
+    enabled=os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true',
+)
+llm_queue = FairQueue(
+    concurrency=int(os.environ.get('LLM_CONCURRENCY', 8)),
+    max_waiting=int(os.environ.get('LLM_MAX_WAITING', 200)),
+    wait_timeout=float(os.environ.get('LLM_QUEUE_TIMEOUT_SECONDS', 30)),
+)
+overload = OverloadDetector(
+    llm_queue,
+    max_inflight=int(os.environ.get('OVERLOAD_MAX_INFLIGHT', 200)),
+    max_llm_waiting=int(os.environ.get('OVERLOAD_MAX_LLM_WAITING', 50)),
+    max_loop_lag_ms=float(os.environ.get('OVERLOAD_MAX_LOOP_LAG_MS', 250)),
+)
+# Request deadlines per route prefix (seconds; None is unbounded); clients may only shorten them
+LLM_REQUEST_TIMEOUT = float(os.environ.get('LLM_REQUEST_TIMEOUT_SECONDS', 45))
+deadline_policy = DeadlinePolicy(
+    [
+        ("/api/chat", LLM_REQUEST_TIMEOUT),
+        ("/api/insights", LLM_REQUEST_TIMEOUT),
+        ("/api/visualize", LLM_REQUEST_TIMEOUT),
+        ("/api/dashboard", LLM_REQUEST_TIMEOUT),
+        ("/api/ingest", None),
+        ("/api/admin", None),
+    ],
+    default_timeout=float(os.environ.get('REQUEST_TIMEOUT_SECONDS', 15)),
+)
+# Upper bound for one LLM completion, and the least time worth starting one with
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', 30))
+LLM_MIN_SECONDS = float(os.environ.get('LLM_MIN_SECONDS', 2))
+# JSON mode makes the model emit a bare object; OpenAI-compatible servers without it can turn it off
+LLM_JSON_MODE = os.environ.get('LLM_JSON_MODE', 'true').lower() == 'true'
+# How completions were parsed: valid, repaired, salvaged field by field, or kept as prose
+llm_output_stats = OutputStats()
+# With insights precomputed by batch_insights.py, interactive requests can be kept off the LLM entirely
+INSIGHTS_CACHED_ONLY = os.environ.get('INSIGHTS_CACHED_ONLY', 'false').lower() == 'true'
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+# The openai package takes about half a second to import, so it is loaded off the event loop after
+# startup (or on the first LLM call); the benchmark assigns a stand-in here
+openai = None
+
+def import_openai():
+    import openai as package
+    package.api_key = OPENAI_API_KEY
+    return package
 
-# OpenAI setup
-openai.api_key = os.environ.get('OPENAI_API_KEY')
+def openai_client():
+    """The openai package as the remote LLM client; None without an API key, without importing it"""
+    global openai
+    if openai is None and OPENAI_API_KEY:
+        openai = import_openai()
+    return openai
 
-# Create the main app
-app = FastAPI(title="TRACITY API", description="AI-Powered Data Visualization Platform")
+# Optional OpenAI-compatible local model server (llama.cpp, vLLM), e.g. http://localhost:8080/v1
+LOCAL_LLM_URL = os.environ.get('LOCAL_LLM_URL')
+local_llm_queue = FairQueue(
+    concurrency=int(os.environ.get('LOCAL_LLM_CONCURRENCY', 2)),
+    max_waiting=int(os.environ.get('LLM_MAX_WAITING', 200)),
+    wait_timeout=float(os.environ.get('LLM_QUEUE_TIMEOUT_SECONDS', 30)),
+)
+_local_llm_client = None
+
+def local_llm_client():
+    global _local_llm_client
+    if _local_llm_client is None and LOCAL_LLM_URL:
+        _local_llm_client = import_openai().OpenAI(base_url=LOCAL_LLM_URL, api_key=os.environ.get('LOCAL_LLM_API_KEY', 'local'))
+    return _local_llm_client
+
+# Simple questions are answered from the data by templates, medium ones by the local model, hard ones by OpenAI
+insight_router = InsightRouter(
+    [
+        TemplateProvider(),
+        ChatCompletionProvider("local", TIER_LOCAL, local_llm_client, os.environ.get('LOCAL_LLM_MODEL', 'local-model'),
+                               local_llm_queue, llm_output_stats,
+                               json_mode=os.environ.get('LOCAL_LLM_JSON_MODE', 'true').lower() == 'true',
+                               expected_seconds=float(os.environ.get('LOCAL_LLM_EXPECTED_SECONDS', 1))),
+        ChatCompletionProvider("openai", TIER_REMOTE, openai_client, os.environ.get('OPENAI_MODEL', 'gpt-3.5-turbo'),
+                               llm_queue, llm_output_stats, json_mode=LLM_JSON_MODE,
+                               expected_seconds=float(os.environ.get('OPENAI_EXPECTED_SECONDS', 3))),
+    ],
+    simple_max=float(os.environ.get('INSIGHT_SIMPLE_MAX_COMPLEXITY', 0.25)),
+    remote_min=float(os.environ.get('INSIGHT_REMOTE_MIN_COMPLEXITY', 0.6)),
+)
+# Only these peers may tell us the real client address through X-Forwarded-For
+TRUSTED_PROXIES = [p.strip() for p in os.environ.get('TRUSTED_PROXIES', '127.0.0.1,::1').split(',') if p.strip()]
+# Upper bound on rows read to build a downsampled chart series
+MAX_SERIES_ROWS = int(os.environ.get('MAX_SERIES_ROWS', 200000))
+# Uploads through /api/ingest are disabled unless an API key is configured
+INGEST_API_KEY = os.environ.get('INGEST_API_KEY')
+# Request profiling and the /api/admin endpoints are disabled unless an admin key is configured
+ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY')
+# Keys that identify a client for rate limiting (besides the ingest and admin keys); any other key is ignored
+RATE_LIMIT_API_KEYS = [k.strip() for k in os.environ.get('RATE_LIMIT_API_KEYS', '').split(',') if k.strip()]
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5))
+MAX_FLAMEGRAPH_SECONDS = float(os.environ.get('MAX_FLAMEGRAPH_SECONDS', 60))
+profile_recorder = ProfileRecorder()
+loop_watchdog = LoopWatchdog(threshold_ms=float(os.environ.get('LOOP_STALL_THRESHOLD_MS', 100)),
+                             beat_interval=overload.lag_interval)
+overload.lag_listeners.append(loop_watchdog.beat)
+warmup_state = WarmupState()
+WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', 'true').lower() == 'true'
+WARMUP_TOP_N = int(os.environ.get('WARMUP_TOP_N', 20))
+WARMUP_TIMEOUT_SECONDS = float(os.environ.get('WARMUP_TIMEOUT_SECONDS', 300))
+
+# Bound on startup health checks; a failed check is retried in the background
+STARTUP_CHECK_TIMEOUT_SECONDS = float(os.environ.get('STARTUP_CHECK_TIMEOUT_SECONDS', 10))
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -61,9 +248,34 @@ class FilterRequest(BaseModel):
     states: Optional[List[str]] = None
     years: Optional[List[int]] = None
     crime_types: Optional[List[str]] = None
+    # Any special filter the dataset descriptor declares, e.g. {"crime_types": ["Theft"]}
+    filters: Optional[Dict[str, List[str]]] = None
     sort_by: Optional[str] = None
     sort_order: Optional[str] = "asc"  # asc or desc
+    fields: Optional[List[str]] = None  # only these fields in each row; default all
     limit: Optional[int] = 100
+    approx: Optional[bool] = False  # answer from a stratified sample with confidence intervals
+
+class AggregateRequest(BaseModel):
+    collection: str
+    states: Optional[List[str]] = None
+    years: Optional[List[int]] = None
+    crime_types: Optional[List[str]] = None
+    filters: Optional[Dict[str, List[str]]] = None
+    group_by: Optional[str] = "state"  # state, year or a categorical field such as crime_type
+    field: Optional[str] = None  # numeric field for sum/avg
+    agg: str = "count"  # count, sum or avg
+    approx: Optional[bool] = False
+    confidence: float = 0.95
+
+class FacetRequest(BaseModel):
+    collection: str
+    states: Optional[List[str]] = None
+    years: Optional[List[int]] = None
+    crime_types: Optional[List[str]] = None
+    filters: Optional[Dict[str, List[str]]] = None
+    facets: Optional[List[str]] = None  # default: every facet the dataset offers
+    limit: Optional[int] = 50  # values per facet
 
 class CollectionMetadata(BaseModel):
     collection: str
@@ -75,42 +287,51 @@ class CollectionMetadata(BaseModel):
 # Helper functions for data processing
 async def get_collection_metadata(collection_name: str) -> CollectionMetadata:
     """Get metadata about a collection including available filters"""
+    cached = registry.get_metadata(collection_name)
+    if cached is not None:
+        return cached
+    collection = analytics_db[collection_name]
+
+    descriptor = datasets.get(collection_name)
+
+    async def load_years() -> List[int]:
+        store = time_series.get(collection_name)
+        if store and store.usable:
+            return await store.years()
+        return await descriptor.years(collection)
+
+    async def load_special_filters() -> Dict[str, List[str]]:
+        values = await asyncio.gather(*(collection.distinct(field) for field in descriptor.special_filters.values()))
+        return {name: sorted(v for v in found if v is not None)
+                for name, found in zip(descriptor.special_filters, values)}
+
     try:
-        # Get available states
-        states = await db[collection_name].distinct("state")
-        states.sort()
-        
-        # Get available years
-        years = []
-        if collection_name == "covid_stats":
-            # For COVID data, extract years from date field
-            dates = await db[collection_name].distinct("date")
-            years = list(set([int(date[:4]) for date in dates if date and len(date) >= 4]))
-        else:
-            years = await db[collection_name].distinct("year")
-        years.sort()
+        # The distinct scans and the sample lookup are independent, so run them together
+        results = await run_stages({
+            "states": (lambda: collection.distinct("state"), ()),
+            "years": (load_years, ()),
+            "sample_doc": (lambda: collection.find_one(), ()),
+            "special_filters": (load_special_filters, ()),
+        })
+        # Variant spellings in legacy documents collapse to one canonical name per state
+        states = sorted(set(state_dimension.canonical_name(s) or s for s in results["states"]))
+        years = sorted(results["years"])
         
         # Get all field names
-        sample_doc = await db[collection_name].find_one()
+        sample_doc = results["sample_doc"]
         fields = list(sample_doc.keys()) if sample_doc else []
         fields = [f for f in fields if f != '_id']
+        special_filters = results["special_filters"]
         
-        # Get special filters based on collection
-        special_filters = {}
-        if collection_name == "crimes":
-            crime_types = await db[collection_name].distinct("crime_type")
-            special_filters["crime_types"] = sorted(crime_types)
-        elif collection_name == "covid_stats":
-            # Could add more COVID-specific filters if needed
-            pass
-        
-        return CollectionMetadata(
+        metadata = CollectionMetadata(
             collection=collection_name,
             available_states=states,
             available_years=years,
             available_fields=fields,
             special_filters=special_filters
         )
+        registry.set_metadata(collection_name, metadata)
+        return metadata
     except Exception as e:
         logging.error(f"Error getting metadata for {collection_name}: {e}")
         return CollectionMetadata(
@@ -121,127 +342,142 @@ async def get_collection_metadata(collection_name: str) -> CollectionMetadata:
             special_filters={}
         )
 
+def special_filters(request) -> Dict[str, List[Any]]:
+    """Requested special filters: crime_types plus any others passed in `filters`"""
+    special = {name: values for name, values in (request.filters or {}).items() if values}
+    if request.crime_types:
+        special["crime_types"] = request.crime_types
+    return special
+
+def special_filter_key(request) -> Optional[Dict[str, List[Any]]]:
+    """Special filters beyond crime_types, order-independent, for cache keys"""
+    extra = {name: sorted(set(values), key=str) for name, values in (request.filters or {}).items() if values}
+    return extra or None
+
 async def build_filter_query(filter_request: FilterRequest) -> Dict[str, Any]:
-    """Build MongoDB query from filter request"""
-    query = {}
-    
-    if filter_request.states:
-        query["state"] = {"$in": filter_request.states}
-    
-    if filter_request.years:
-        if filter_request.collection == "covid_stats":
-            # For COVID data, filter by year from date field
-            year_filters = []
-            for year in filter_request.years:
-                year_filters.append({
-                    "date": {"$regex": f"^{year}-"}
-                })
-            query["$or"] = year_filters
-        else:
-            query["year"] = {"$in": filter_request.years}
-    
-    if filter_request.crime_types and filter_request.collection == "crimes":
-        query["crime_type"] = {"$in": filter_request.crime_types}
-    
-    return query
+    """Build MongoDB query from filter request, shaped by the collection's dataset descriptor"""
+    return datasets.get(filter_request.collection).filter_query(
+        filter_request.states, filter_request.years, special_filters(filter_request)
+    )
 
-async def get_enhanced_web_insights(data_sample: List[Dict], collection_name: str, query: str) -> Dict[str, Any]:
-    """Generate enhanced insights using web research and AI"""
+def filters_from_params(states: Optional[str], years: Optional[str], **extra) -> Dict[str, Any]:
+    """Normalized filters from comma-separated state/year query parameters"""
+    state_list = [s.strip() for s in states.split(',') if s.strip()] if states else None
     try:
-        # Prepare context about the data
-        context_info = {
-            "collection": collection_name,
-            "sample_size": len(data_sample),
-            "data_structure": list(data_sample[0].keys()) if data_sample else []
-        }
-        
-        # Generate research-based insights
-        if collection_name == "crimes":
-            insight_context = f"""
-            Analyzing crime data from Indian states. The dataset contains information about {len(data_sample)} crime records.
-            Key fields: {', '.join(context_info['data_structure'])}
-            
-            Provide insights about:
-            1. Crime patterns across states
-            2. Trends over time
-            3. Most affected regions
-            4. Crime type distribution
-            5. Policy implications
-            """
-        elif collection_name == "covid_stats":
-            insight_context = f"""
-            Analyzing COVID-19 statistics from Indian states. The dataset contains {len(data_sample)} records.
-            Key fields: {', '.join(context_info['data_structure'])}
-            
-            Provide insights about:
-            1. Mortality patterns across states
-            2. Timeline of impacts
-            3. Regional variations
-            4. Public health implications
-            5. Recovery patterns
-            """
-        elif collection_name == "aqi":
-            insight_context = f"""
-            Analyzing Air Quality Index data from Indian states. The dataset contains {len(data_sample)} records.
-            Key fields: {', '.join(context_info['data_structure'])}
-            
-            Provide insights about:
-            1. Air pollution levels across states
-            2. Trends over time
-            3. Most polluted regions
-            4. Environmental concerns
-            5. Health implications
-            """
-        elif collection_name == "literacy":
-            insight_context = f"""
-            Analyzing literacy rate data from Indian states. The dataset contains {len(data_sample)} records.
-            Key fields: {', '.join(context_info['data_structure'])}
-            
-            Provide insights about:
-            1. Education levels across states
-            2. Progress over time
-            3. Regional disparities
-            4. Socioeconomic factors
-            5. Policy effectiveness
-            """
-        else:
-            insight_context = f"Analyzing data from {collection_name} with {len(data_sample)} records."
-        
-        # Use OpenAI for enhanced analysis
-        prompt = f"""
-        {insight_context}
-        
-        User query: "{query}"
-        Sample data: {json.dumps(data_sample[:3], default=str)}
-        
-        Provide a comprehensive analysis in JSON format:
-        {{
-            "insight": "Detailed analytical insight (150-200 words)",
-            "chart_type": "Recommended chart type (bar/line/pie/scatter)",
-            "key_findings": ["Finding 1", "Finding 2", "Finding 3"],
-            "anomalies": ["Any unusual patterns detected"],
-            "trend": "Overall trend (increasing/decreasing/stable/volatile)",
-            "recommendations": ["Policy or action recommendation 1", "Recommendation 2"],
-            "comparison_insights": "How different states/regions compare",
-            "temporal_analysis": "Analysis of trends over time"
-        }}
-        """
-        
-        response = await asyncio.to_thread(
-            openai.chat.completions.create,
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an expert data analyst specializing in Indian socioeconomic data. Provide detailed, research-backed insights."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=800
-        )
-        
-        result = json.loads(response.choices[0].message.content)
+        year_list = [int(y.strip()) for y in years.split(',') if y.strip()] if years else None
+    except ValueError:
+        year_list = None
+    return normalize_filters(state_list, year_list, **extra)
+
+def insight_key(kind: str, collection_name: str, filters: Dict[str, Any]) -> str:
+    """Insight cache key; includes the manifest version so an ingest invalidates persisted insights"""
+    return canonical_key(kind, collection_name, filters, data_versions.manifest_version(collection_name))
+
+# Question asked of the LLM per insight kind; batch precomputation must ask the same to fill the same keys
+INSIGHT_PROMPTS = {
+    "insights": "Provide comprehensive analysis of the {collection} dataset including trends, patterns, and key findings",
+    "enhanced": "Analyze patterns in {collection} data",
+}
+
+def plain_documents(data: List[Dict]) -> List[Dict]:
+    """Documents without _id and with ISO dates, as responses and the enhanced insights see them"""
+    processed_data = []
+    for doc in data:
+        clean_doc = {k: v for k, v in doc.items() if k != '_id'}
+        for key, value in clean_doc.items():
+            if isinstance(value, datetime):
+                clean_doc[key] = value.isoformat()
+        processed_data.append(clean_doc)
+    return processed_data
+
+async def route_insight(request: InsightRequest, low_priority: bool = False, allow_llm: Optional[bool] = None,
+                        budget: Optional[float] = None, fall_through: bool = True):
+    """
+    Answer an insight request through the provider router; returns (result, degraded).
+
+    LLM providers are left out in cache-only mode, while shedding low-priority work, and when
+    too little of the request deadline is left; degraded answers came from a cheaper provider
+    than the question called for.
+    """
+    if allow_llm is None:
+        allow_llm = not INSIGHTS_CACHED_ONLY and not (low_priority and overload.should_shed())
+    budget = time_limit(LLM_TIMEOUT_SECONDS) if budget is None else budget
+    if budget < LLM_MIN_SECONDS:
+        allow_llm = False
+    result, provider, degraded = await insight_router.generate(request, budget, allow_llm, fall_through)
+    return result, degraded
+
+def reject_if_shedding():
+    """Insight-only endpoints are the first to go under overload"""
+    if overload.should_shed():
+        raise HTTPException(status_code=503, detail="Insights are temporarily unavailable under high load",
+                            headers={"Retry-After": "5"})
+
+async def get_enhanced_web_insights(data_sample: List[Dict], collection_name: str, query: str,
+                                    cache_key: Optional[str] = None) -> Dict[str, Any]:
+    """Generate enhanced insights using web research and AI, reusing cached results for cache_key"""
+    if cache_key:
+        cached = await insight_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    try:
+        result, degraded = await route_insight(enhanced_insight_request(data_sample, collection_name, query),
+                                               low_priority=True)
+        # A stand-in from a cheaper provider (under load, near the deadline) shouldn't outlive the moment
+        if cache_key and not degraded:
+            await insight_cache.set(cache_key, result, collection=collection_name)
         return result
     except Exception as e:
         logging.error(f"Enhanced insights error: {e}")
-        return {
+        return default_enhanced_insights(collection_name)
+
+def enhanced_insight_request(data_sample: List[Dict], collection_name: str, query: str) -> InsightRequest:
+    """Detailed analysis of a data sample, with the research-style prompt LLM providers get"""
+    # Prepare context about the data
+    context_info = {
+        "collection": collection_name,
+        "sample_size": len(data_sample),
+        "data_structure": list(data_sample[0].keys()) if data_sample else []
+    }
+    
+    # What the data is and what to look for comes from the dataset descriptor
+    insight_context = datasets.get(collection_name).insight_context(len(data_sample), context_info['data_structure'])
+    
+    # Prompt for the LLM providers; the template provider works from the sample directly
+    prompt = f"""
+    {insight_context}
+    
+    User query: "{query}"
+    Sample data: {json.dumps(data_sample[:3], default=str)}
+    
+    Provide a comprehensive analysis in JSON format:
+    {{
+        "insight": "Detailed analytical insight (150-200 words)",
+        "chart_type": "Recommended chart type (bar/line/pie/scatter)",
+        "key_findings": ["Finding 1", "Finding 2", "Finding 3"],
+        "anomalies": ["Any unusual patterns detected"],
+        "trend": "Overall trend (increasing/decreasing/stable/volatile)",
+        "recommendations": ["Policy or action recommendation 1", "Recommendation 2"],
+        "comparison_insights": "How different states/regions compare",
+        "temporal_analysis": "Analysis of trends over time"
+    }}
+    """
+    
+    return InsightRequest(
+        EnhancedInsight,
+        data_sample,
+        query,
+        messages=[
+            {"role": "system", "content": "You are an expert data analyst specializing in Indian socioeconomic data. Provide detailed, research-backed insights."},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=800,
+        collection=collection_name
+    )
+
+def default_enhanced_insights(collection_name: str) -> Dict[str, Any]:
+    """Generic insight served when the LLM is unavailable, skipped or returns garbage"""
+    return {
             "insight": f"Analysis of {collection_name} data shows various patterns across Indian states. The data provides valuable insights into regional variations and trends over time.",
             "chart_type": "bar",
             "key_findings": ["Regional variations observed", "Temporal trends identified", "Data quality is good"],
@@ -253,10 +489,10 @@ async def get_enhanced_web_insights(data_sample: List[Dict], collection_name: st
         }
 
 # Helper functions for AI integration
-async def get_openai_insight(data_sample: List[Dict], query: str) -> Dict[str, Any]:
-    """Generate AI insights using OpenAI"""
+async def get_openai_insight(data_sample: List[Dict], query: str, collection_name: Optional[str] = None) -> Dict[str, Any]:
+    """Short insight answering a chat query about a data sample"""
     try:
-        # Prepare data context for OpenAI
+        # Prepare data context for the LLM providers
         data_context = json.dumps(data_sample[:5], default=str)  # Send first 5 records as context
         
         prompt = f"""
@@ -272,21 +508,25 @@ async def get_openai_insight(data_sample: List[Dict], query: str) -> Dict[str, A
         - trend: Overall trend direction (increasing, decreasing, stable, volatile)
         """
         
-        response = await asyncio.to_thread(
-            openai.chat.completions.create,
-            model="gpt-3.5-turbo",
+        request = InsightRequest(
+            BasicInsight,
+            data_sample,
+            query,
             messages=[
                 {"role": "system", "content": "You are an expert data analyst. Always respond with valid JSON."},
                 {"role": "user", "content": prompt}
             ],
-            max_tokens=500
+            max_tokens=500,
+            collection=collection_name
         )
-        
-        result = json.loads(response.choices[0].message.content)
+        result, degraded = await route_insight(request)
         return result
     except Exception as e:
-        logging.error(f"OpenAI error: {e}")
-        return {
+        logging.error(f"Insight error: {e}")
+        return default_openai_insight()
+
+def default_openai_insight() -> Dict[str, Any]:
+    return {
             "insight": "Data analysis completed. Multiple trends detected in the dataset.",
             "chart_type": "bar",
             "key_metrics": ["count", "average"],
@@ -294,53 +534,261 @@ async def get_openai_insight(data_sample: List[Dict], query: str) -> Dict[str, A
             "trend": "stable"
         }
 
-async def get_chart_recommendations(data: List[Dict]) -> Dict[str, Any]:
-    """Analyze data structure and recommend best chart types"""
+async def get_chart_recommendations(data: List[Dict], collection_name: Optional[str] = None) -> Dict[str, Any]:
+    """Recommend a chart, axes and default grouping from the dataset's column profile"""
+    profile = profiles.get(collection_name) if collection_name else None
+    if profile is not None:
+        return profile["recommendation"]
     if not data:
-        return {"recommended": "bar", "alternatives": ["line", "pie"]}
+        return dict(DEFAULT_RECOMMENDATION)
+    # Until the dataset profile is built, profile the rows at hand (every row, not just the first)
+    return profile_rows(data)["recommendation"]
+
+async def query_time_series_rows(store: TimeSeriesStore, filter_request: FilterRequest) -> Dict[str, Any]:
+    """Filtered page and count for a bucketed collection: year filters become month-range bucket scans"""
+    state_ids = state_dimension.resolve_many(filter_request.states)[0] if filter_request.states else None
+    if filter_request.states and not state_ids:
+        data, total_count = [], 0
+    else:
+        limit = filter_request.limit or 100
+        results = await run_stages({
+            "data": (lambda: store.find_rows(state_ids, filter_request.years, limit), ()),
+            "total_count": (lambda: store.count(state_ids, filter_request.years), ()),
+        })
+        data, total_count = results["data"], results["total_count"]
+    chart_rec = await get_chart_recommendations(data, filter_request.collection)
+    return {"data": data, "total_count": total_count, "chart_recommendations": chart_rec}
+
+def sample_filters(states: Optional[List[str]], years: Optional[List[int]]) -> Optional[Dict[str, Any]]:
+    """State ids and years for masking a sample; None if a state name can't be resolved"""
+    state_ids, unresolved = state_dimension.resolve_many(states or [])
+    if unresolved:
+        return None
+    return {"state_ids": state_ids or None, "years": years or None}
+
+async def query_filtered_sample(filter_request: FilterRequest) -> Optional[Dict[str, Any]]:
+    """Filtered page and estimated total from the collection's stratified sample, if one is ready"""
+    import numpy as np
+    sample = samples.get(filter_request.collection)
+    conditions = sample_filters(filter_request.states, filter_request.years)
+    if sample is None or conditions is None:
+        return None
+    categories = datasets.get(filter_request.collection).special_fields(special_filters(filter_request))
+    selected = sample.mask(conditions["state_ids"], conditions["years"], categories)
+    positions = np.flatnonzero(selected)
+    if filter_request.sort_by in sample.numeric:
+        order = np.argsort(sample.numeric[filter_request.sort_by][positions], kind="stable")
+        positions = positions[order[::-1] if filter_request.sort_order == "desc" else order]
+    limit = filter_request.limit or 100
+    data = [sample.rows[i] for i in positions[:limit]]
+    estimate = sample.estimate(selected, "count")
+    return {
+        "data": data,
+        "total_count": int(round(estimate["value"])),
+        "chart_recommendations": await get_chart_recommendations(data, filter_request.collection),
+        "approximate": {
+            "total_count": {
+                "value": round(estimate["value"], 1),
+                "ci_low": max(0.0, round(estimate["ci_low"], 1)),
+                "ci_high": round(estimate["ci_high"], 1),
+                "confidence": 0.95,
+            },
+            "sample_rows": estimate["sample_rows"],
+        },
+    }
+
+async def query_filtered_data(filter_request: FilterRequest) -> Dict[str, Any]:
+    """Run a filtered find + count on its compiled plan, served from the result cache while the data version is unchanged"""
+    limit = filter_request.limit or 100
+    filters = normalize_filters(
+        filter_request.states,
+        filter_request.years,
+        filter_request.crime_types,
+        filters=special_filter_key(filter_request),
+        sort_by=filter_request.sort_by,
+        sort_order=filter_request.sort_order if filter_request.sort_by else None,
+        fields=filter_request.fields,
+        limit=limit
+    )
+    cache_key = canonical_key("filtered", filter_request.collection, filters)
+    data_version = data_versions.get(filter_request.collection)
+    cached = result_cache.get(cache_key, filter_request.collection)
+    if cached is not None:
+        return cached
+
+    query = await build_filter_query(filter_request)
+    store = time_series.get(filter_request.collection)
+    # Rejects sort and projection fields outside the dataset's schema, and unindexed sorts of large pages
+    plan = await query_planner.plan(filter_request.collection, query, filter_request.sort_by,
+                                    filter_request.sort_order, filter_request.fields, limit,
+                                    rollup=bool(store and store.usable))
+
+    if filter_request.approx:
+        approximate = await query_filtered_sample(filter_request)
+        if approximate is not None:
+            approximate["data"] = plan.project(approximate["data"])
+            return approximate
+
+    if plan.source == "buckets":
+        result = await query_time_series_rows(store, filter_request)
+        result["data"] = plan.project(result["data"])
+        result_cache.set(cache_key, filter_request.collection, result, data_version)
+        return result
+
+    # Execute the page query and the total count concurrently
+    collection = cache_fill_db()[filter_request.collection]
+    cursor = collection.find(query, plan.projection)
+    if plan.sort:
+        cursor = cursor.sort(plan.sort)
+    if plan.hint:
+        cursor = cursor.hint(plan.hint)
     
-    # Simple heuristics for chart recommendation
-    sample = data[0] if data else {}
-    numeric_fields = []
-    categorical_fields = []
-    date_fields = []
+    results = await run_stages({
+        "data": (lambda: cursor.limit(limit).to_list(limit), ()),
+        "total_count": (lambda: collection.count_documents(query), ()),
+    })
+    data = results["data"]
     
-    for key, value in sample.items():
-        if isinstance(value, (int, float)):
-            numeric_fields.append(key)
-        elif isinstance(value, str):
-            categorical_fields.append(key)
-        elif isinstance(value, datetime):
-            date_fields.append(key)
+    # Process data for frontend
+    processed_data = plain_documents(data)
     
-    # Chart recommendation logic
-    if date_fields and numeric_fields:
-        return {"recommended": "line", "alternatives": ["area", "bar"]}
-    elif len(categorical_fields) == 1 and len(numeric_fields) == 1:
-        return {"recommended": "bar", "alternatives": ["pie", "doughnut"]}
-    elif len(numeric_fields) >= 2:
-        return {"recommended": "scatter", "alternatives": ["bubble", "line"]}
-    else:
-        return {"recommended": "bar", "alternatives": ["pie", "line"]}
+    total_count = results["total_count"]
+    
+    # Get chart recommendations
+    chart_rec = await get_chart_recommendations(processed_data, filter_request.collection)
+    
+    result = {"data": processed_data, "total_count": total_count, "chart_recommendations": chart_rec}
+    result_cache.set(cache_key, filter_request.collection, result, data_version)
+    return result
+
+async def query_visualization_data(collection_name: str, limit: int, states: Optional[str], years: Optional[str]) -> Dict[str, Any]:
+    """Fetch the visualization sample, served from the result cache while the data version is unchanged"""
+    filters = filters_from_params(states, years, limit=limit)
+    cache_key = canonical_key("visualize_data", collection_name, filters)
+    data_version = data_versions.get(collection_name)
+    cached = result_cache.get(cache_key, collection_name)
+    if cached is not None:
+        return cached
+
+    query = datasets.get(collection_name).filter_query(filters["states"], filters["years"])
+    collection = cache_fill_db()[collection_name]
+    
+    # If no filters provided, show the dataset's default years (the latest year unless configured)
+    if not query:
+        query = await datasets.get(collection_name).default_query(collection)
+    
+    # Get data
+    data = await collection.find(query).limit(limit).to_list(limit)
+    
+    # If still no data and filters were applied, try without filters
+    if not data and (states or years):
+        data = await collection.find().limit(limit).to_list(limit)
+    
+    processed_data = plain_documents(data)
+    
+    result = {"data": processed_data, "query_used": query}
+    result_cache.set(cache_key, collection_name, result, data_version)
+    return result
 
 # API Routes
+async def query_visualization_series(collection_name: str, states: Optional[str], years: Optional[str],
+                                     width: int, method: str) -> Dict[str, Any]:
+    """Full per-state series for a line chart, downsampled to the points a `width`-pixel chart can show"""
+    filters = filters_from_params(states, years)
+    cache_key = canonical_key("visualize_series", collection_name, filters, width, method)
+    data_version = data_versions.get(collection_name)
+    cached = result_cache.get(cache_key, collection_name)
+    if cached is not None:
+        return cached
+
+    store = time_series.get(collection_name)
+    descriptor = datasets.get(collection_name)
+    x_field = descriptor.time_field
+    query = descriptor.filter_query(filters["states"], filters["years"])
+
+    if store and store.usable:
+        state_ids = state_dimension.resolve_many(filters["states"])[0] if filters["states"] else None
+        rows = [] if filters["states"] and not state_ids else await store.find_rows(state_ids, filters["years"], MAX_SERIES_ROWS)
+    else:
+        cursor = cache_fill_db()[collection_name].find(query).sort([("state_id", 1), (x_field, 1)])
+        rows = await cursor.limit(MAX_SERIES_ROWS).to_list(MAX_SERIES_ROWS)
+
+    # The first declared measure present, else the first numeric field of the data
+    sample = rows[0] if rows else {}
+    y_field = next((m for m in TIME_SERIES_FIELDS.get(collection_name, descriptor.measures) if m in sample), None)
+    if y_field is None:
+        y_field = next((k for k, v in sample.items()
+                        if isinstance(v, (int, float)) and k not in (x_field, "year", "state_id")), None)
+
+    points = target_points(width)
+    data = downsample_records(rows, x_field, y_field, points, method) if y_field else rows
+    result = {
+        "data": data,
+        "query_used": query,
+        "downsampling": {"method": method, "x": x_field, "y": y_field, "points_per_series": points,
+                         "rows_read": len(rows), "rows_returned": len(data)},
+    }
+    result_cache.set(cache_key, collection_name, result, data_version)
+    return result
+
+async def query_facets(collection_name: str, active: Dict[str, List[Any]], facets: Optional[List[str]] = None,
+                       limit: Optional[int] = None) -> Dict[str, Any]:
+    """Value counts per facet, each under the other active filters; cached per data version"""
+    descriptor = datasets.get(collection_name)
+    available = facet_names(descriptor)
+    facets = facets or available
+    if limit is not None and limit < 1:
+        raise ValueError("limit must be positive")
+    unknown = [facet for facet in facets if facet not in available]
+    if unknown:
+        raise ValueError(f"Unknown facets for {collection_name}: {', '.join(unknown)}; "
+                         f"available: {', '.join(available)}")
+    active = {name: values for name, values in active.items() if values and name in available}
+    cache_key = canonical_key("facets", collection_name,
+                              {name: sorted(set(values), key=str) for name, values in active.items()},
+                              sorted(facets), limit)
+    data_version = data_versions.get(collection_name)
+    cached = result_cache.get(cache_key, collection_name)
+    if cached is not None:
+        return cached
+
+    raw = await cache_fill_db()[collection_name].aggregate(facet_pipeline(descriptor, active, facets)).to_list(1)
+    result = {"collection": collection_name, **shape_facets(raw[0] if raw else {}, active, facets, limit)}
+    result_cache.set(cache_key, collection_name, result, data_version)
+    return result
+
+async def search_index(collection_name: str) -> SearchIndex:
+    index = search_indexes.get(collection_name)
+    if index is None:
+        version = data_versions.get(collection_name)
+        index = SearchIndex.build(datasets.get(collection_name), await query_facets(collection_name, {}))
+        search_indexes.set(collection_name, version, index)
+    return index
+
 @api_router.get("/")
 async def root():
     return {"message": "TRACITY API - Your AI Data Companion"}
 
+@api_router.get("/ready")
+async def readiness():
+    """Readiness probe: 200 once Mongo has answered and the warm-up has finished, 503 before that"""
+    if not (warmup_state.ready and warmup_state.healthy):
+        return JSONResponse(status_code=503, content=warmup_state.snapshot())
+    return warmup_state.snapshot()
+
 @api_router.get("/stats", response_model=StatsResponse)
 async def get_platform_stats():
     """Get platform statistics for dashboard"""
     try:
         # Get collection stats
-        collections = await db.list_collection_names()
+        collections = await registry.collection_names()
         total_datasets = len(collections)
         
-        # Count documents across collections
-        total_records = 0
-        for collection_name in collections:
-            count = await db[collection_name].count_documents({})
-            total_records += count
+        # Count documents across collections concurrently
+        counts = await asyncio.gather(
+            *(analytics_db[collection_name].count_documents({}) for collection_name in collections)
+        )
+        total_records = sum(counts)
         
         # Simulate user and visualization stats (in real app, these would be tracked)
         return StatsResponse(
@@ -362,34 +810,23 @@ async def get_platform_stats():
 async def get_available_datasets():
     """Get list of available datasets"""
     try:
-        collections = await db.list_collection_names()
-        datasets = []
+        collections = await registry.collection_names()
+        dataset_list = []
+        counts = await asyncio.gather(
+            *(analytics_db[collection_name].count_documents({}) for collection_name in collections)
+        )
         
-        for collection_name in collections:
+        for collection_name, count in zip(collections, counts):
             if not collection_name.startswith('system.'):
-                count = await db[collection_name].count_documents({})
-                # Get a sample document to understand structure
-                sample = await db[collection_name].find_one()
-                
-                description = "Dataset containing various data points"
-                if "covid" in collection_name.lower():
-                    description = "COVID-19 statistics and trends data"
-                elif "crime" in collection_name.lower():
-                    description = "Crime statistics and safety data"
-                elif "education" in collection_name.lower() or "literacy" in collection_name.lower():
-                    description = "Education and literacy statistics"
-                elif "aqi" in collection_name.lower():
-                    description = "Air Quality Index measurements"
-                
-                datasets.append(DatasetInfo(
+                dataset_list.append(DatasetInfo(
                     name=collection_name.replace('_', ' ').title(),
                     collection=collection_name,
-                    description=description,
+                    description=datasets.get(collection_name).description,
                     record_count=count,
                     last_updated=datetime.utcnow()
                 ))
         
-        return datasets
+        return dataset_list
     except Exception as e:
         logging.error(f"Error getting datasets: {e}")
         return []
@@ -404,97 +841,209 @@ async def get_dataset_metadata(collection_name: str):
         logging.error(f"Error getting metadata for {collection_name}: {e}")
         raise HTTPException(status_code=500, detail="Error retrieving dataset metadata")
 
+@api_router.post("/facets")
+async def get_facets(request: FacetRequest):
+    """Filter picker values with the number of matching documents, honouring the other active filters"""
+    try:
+        collections = await registry.collection_names()
+        if request.collection not in collections:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        active = {"states": request.states, "years": request.years, **special_filters(request)}
+        return await query_facets(request.collection, active, request.facets, request.limit)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Facet error for {request.collection}: {e}")
+        raise HTTPException(status_code=500, detail="Error computing facets")
+
+@api_router.get("/search")
+async def search_datasets(q: str, collections: str = None, limit: int = 20):
+    """Datasets, fields and filter values matching a query, with document counts, best matches first"""
+    if not 1 <= limit <= MAX_SEARCH_RESULTS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_SEARCH_RESULTS}")
+    try:
+        available = [name for name in await registry.collection_names() if not name.startswith('system.')]
+        names = [c.strip() for c in collections.split(',') if c.strip()] if collections else available
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"Unknown collections: {', '.join(unknown)}")
+        indexes = await asyncio.gather(*(search_index(name) for name in names))
+        matches = [match for index in indexes for match in index.search(q)]
+        matches.sort(key=lambda match: (-match[0], -match[1].get("count", 0), str(match[1]["value"])))
+        return {
+            "query": q,
+            "results": [{**entry, "score": score} for score, entry in matches[:limit]],
+            "total_matches": len(matches),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Search error for {q!r}: {e}")
+        raise HTTPException(status_code=500, detail="Error searching datasets")
+
+@api_router.get("/profile/{collection_name}")
+async def get_dataset_profile(collection_name: str):
+    """Per-column type, role, cardinality, null rate and distribution, plus the derived chart defaults"""
+    try:
+        collections = await registry.collection_names()
+        if collection_name not in collections:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        return await profiles.load(collection_name)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error profiling {collection_name}: {e}")
+        raise HTTPException(status_code=500, detail="Error profiling dataset")
+
 @api_router.post("/data/filtered")
 async def get_filtered_data(filter_request: FilterRequest):
     """Get filtered data from a collection with advanced filtering options"""
     try:
         # Verify collection exists
-        collections = await db.list_collection_names()
+        collections = await registry.collection_names()
         if filter_request.collection not in collections:
             raise HTTPException(status_code=404, detail="Collection not found")
         
-        # Build query
-        query = await build_filter_query(filter_request)
-        
-        # Build sort criteria
-        sort_criteria = []
-        if filter_request.sort_by:
-            sort_direction = 1 if filter_request.sort_order == "asc" else -1
-            sort_criteria.append((filter_request.sort_by, sort_direction))
-        
-        # Execute query
-        cursor = db[filter_request.collection].find(query)
-        if sort_criteria:
-            cursor = cursor.sort(sort_criteria)
-        
-        data = await cursor.limit(filter_request.limit or 100).to_list(filter_request.limit or 100)
-        
-        # Process data for frontend
-        processed_data = []
-        for doc in data:
-            clean_doc = {k: v for k, v in doc.items() if k != '_id'}
-            # Convert datetime objects to strings
-            for key, value in clean_doc.items():
-                if isinstance(value, datetime):
-                    clean_doc[key] = value.isoformat()
-            processed_data.append(clean_doc)
-        
-        # Get total count for the query
-        total_count = await db[filter_request.collection].count_documents(query)
-        
-        # Get chart recommendations
-        chart_rec = await get_chart_recommendations(processed_data)
+        result = await query_filtered_data(filter_request)
         
         return {
             "collection": filter_request.collection,
-            "data": processed_data,
-            "total_count": total_count,
-            "returned_count": len(processed_data),
-            "chart_recommendations": chart_rec,
+            "data": result["data"],
+            "total_count": result["total_count"],
+            "returned_count": len(result["data"]),
+            "chart_recommendations": result["chart_recommendations"],
             "applied_filters": {
                 "states": filter_request.states,
                 "years": filter_request.years,
                 "crime_types": filter_request.crime_types,
+                "filters": filter_request.filters,
                 "sort_by": filter_request.sort_by,
-                "sort_order": filter_request.sort_order
-            }
+                "sort_order": filter_request.sort_order,
+                "fields": filter_request.fields
+            },
+            # Present only when the answer came from a sample (approx=true and a sample was ready)
+            "approximate": result.get("approximate")
         }
         
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Filtered data error: {e}")
         raise HTTPException(status_code=500, detail="Error processing filtered data request")
 
+@api_router.post("/aggregate")
+async def aggregate_data(request: AggregateRequest):
+    """Grouped count/sum/avg; approx=true estimates it from a stratified sample with confidence intervals"""
+    import numpy as np
+    if request.agg not in ("count", "sum", "avg"):
+        raise HTTPException(status_code=400, detail="agg must be count, sum or avg")
+    try:
+        collections = await registry.collection_names()
+        if request.collection not in collections:
+            raise HTTPException(status_code=404, detail="Collection not found")
+
+        if request.agg != "count" and not request.field:
+            # Default to the dataset's primary measure
+            profile = await profiles.load(request.collection)
+            request.field = profile["recommendation"]["field"]
+            if not request.field:
+                raise HTTPException(status_code=400, detail="sum/avg need a numeric field and the dataset has none")
+
+        if request.approx:
+            sample = samples.get(request.collection)
+            conditions = sample_filters(request.states, request.years)
+            if sample is not None and conditions is not None:
+                categories = datasets.get(request.collection).special_fields(special_filters(request))
+                selected = sample.mask(conditions["state_ids"], conditions["years"], categories)
+                keys = sample.group_values(request.group_by) if request.group_by else None
+                groups = []
+                for key in (np.unique(keys[selected]) if keys is not None else [None]):
+                    in_group = selected & (keys == key) if keys is not None else selected
+                    estimate = sample.estimate(in_group, request.agg, request.field, request.confidence)
+                    label = state_dimension.name(int(key)) if request.group_by == "state" else key
+                    groups.append({"key": label.item() if isinstance(label, np.generic) else label, **estimate})
+                return {"collection": request.collection, "group_by": request.group_by, "agg": request.agg,
+                        "field": request.field, "approximate": True, "confidence": request.confidence,
+                        "groups": groups}
+
+        filter_request = FilterRequest(collection=request.collection, states=request.states,
+                                       years=request.years, crime_types=request.crime_types, filters=request.filters)
+        cache_key = canonical_key("aggregate", request.collection, normalize_filters(
+            request.states, request.years, request.crime_types, filters=special_filter_key(request),
+            group_by=request.group_by, field=request.field, agg=request.agg
+        ))
+        data_version = data_versions.get(request.collection)
+        cached = result_cache.get(cache_key, request.collection)
+        if cached is not None:
+            return cached
+
+        group_key = None
+        if request.group_by == "state":
+            group_key = "$state"
+        elif request.group_by == "year":
+            group_key = datasets.get(request.collection).year_expression()
+        elif request.group_by:
+            group_key = f"${request.group_by}"
+        accumulator = {"$sum": 1} if request.agg == "count" else {f"${request.agg}": f"${request.field}"}
+        pipeline = [
+            {"$match": await build_filter_query(filter_request)},
+            {"$group": {"_id": group_key, "value": accumulator}},
+            {"$sort": {"_id": 1}},
+        ]
+        rows = await cache_fill_db()[request.collection].aggregate(pipeline).to_list(None)
+        groups = [
+            {"key": int(row["_id"]) if request.group_by == "year" and row["_id"] is not None else row["_id"],
+             "value": row["value"]}
+            for row in rows
+        ]
+        result = {"collection": request.collection, "group_by": request.group_by, "agg": request.agg,
+                  "field": request.field, "approximate": False, "groups": groups}
+        result_cache.set(cache_key, request.collection, result, data_version)
+        return result
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Aggregate error for {request.collection}: {e}")
+        raise HTTPException(status_code=500, detail="Error aggregating data")
+
 @api_router.post("/insights/enhanced")
 async def get_enhanced_insights(filter_request: FilterRequest):
     """Get enhanced AI insights for filtered data"""
+    reject_if_shedding()
     try:
-        # Get filtered data first
         query = await build_filter_query(filter_request)
-        data = await db[filter_request.collection].find(query).limit(50).to_list(50)
-        
-        if not data:
-            raise HTTPException(status_code=404, detail="No data found for the specified filters")
-        
-        # Process data
-        processed_data = []
-        for doc in data:
-            clean_doc = {k: v for k, v in doc.items() if k != '_id'}
-            for key, value in clean_doc.items():
-                if isinstance(value, datetime):
-                    clean_doc[key] = value.isoformat()
-            processed_data.append(clean_doc)
-        
-        # Generate enhanced insights
-        insights = await get_enhanced_web_insights(
-            processed_data, 
-            filter_request.collection, 
-            f"Analyze patterns in {filter_request.collection} data"
-        )
+        collection = analytics_db[filter_request.collection]
+        filters = normalize_filters(filter_request.states, filter_request.years, filter_request.crime_types,
+                                    filters=special_filter_key(filter_request))
+        access_log.record("enhanced", filter_request.collection, filters)
+        
+        async def load_sample() -> List[Dict]:
+            # Get filtered data first
+            data = await collection.find(query).limit(50).to_list(50)
+            if not data:
+                raise HTTPException(status_code=404, detail="No data found for the specified filters")
+            return plain_documents(data)
         
-        # Get total count for context
-        total_count = await db[filter_request.collection].count_documents(query)
+        # The total count is independent of the sample, so it overlaps with the find and the LLM call
+        results = await run_stages({
+            "sample": (load_sample, ()),
+            "insights": (lambda sample: get_enhanced_web_insights(
+                sample,
+                filter_request.collection,
+                INSIGHT_PROMPTS["enhanced"].format(collection=filter_request.collection),
+                cache_key=insight_key("enhanced", filter_request.collection, filters)
+            ), ("sample",)),
+            "total_count": (lambda: collection.count_documents(query), ()),
+        })
+        processed_data = results["sample"]
+        insights = results["insights"]
+        total_count = results["total_count"]
         
         return {
             "collection": filter_request.collection,
@@ -504,7 +1053,8 @@ async def get_enhanced_insights(filter_request: FilterRequest):
             "applied_filters": {
                 "states": filter_request.states,
                 "years": filter_request.years,
-                "crime_types": filter_request.crime_types
+                "crime_types": filter_request.crime_types,
+                "filters": filter_request.filters
             },
             "generated_at": datetime.utcnow().isoformat()
         }
@@ -520,49 +1070,45 @@ async def chat_with_ai(query: ChatQuery):
     """AI chatbot endpoint for natural language queries"""
     try:
         # If no specific dataset mentioned, search across available collections
-        collections = await db.list_collection_names()
-        
-        # Filter out system collections
-        data_collections = [c for c in collections if not c.startswith('system.')]
+        data_collections = await registry.collection_names()
         
         if query.dataset and query.dataset in data_collections:
             target_collections = [query.dataset]
         else:
             target_collections = data_collections[:3]  # Limit to first 3 collections
         
-        results = []
-        for collection_name in target_collections:
+        async def analyze_collection(collection_name: str) -> Optional[Dict[str, Any]]:
             # Get sample data from collection
-            sample_data = await db[collection_name].find().limit(10).to_list(10)
+            sample_data = await analytics_db[collection_name].find().limit(10).to_list(10)
             
-            if sample_data:
-                # Get AI insights
-                ai_result = await get_openai_insight(sample_data, query.query)
-                
-                # Get chart recommendations
-                chart_rec = await get_chart_recommendations(sample_data)
-                
-                # Process data for visualization
-                processed_data = []
-                for doc in sample_data[:5]:  # Limit to 5 for response
-                    # Remove MongoDB _id and convert to serializable format
-                    clean_doc = {k: v for k, v in doc.items() if k != '_id'}
-                    # Convert any datetime objects to strings
-                    for key, value in clean_doc.items():
-                        if isinstance(value, datetime):
-                            clean_doc[key] = value.isoformat()
-                    processed_data.append(clean_doc)
-                
-                results.append({
-                    "collection": collection_name,
-                    "insight": ai_result.get("insight", "Analysis completed"),
-                    "chart_type": ai_result.get("chart_type", chart_rec["recommended"]),
-                    "data": processed_data,
-                    "anomalies": ai_result.get("anomalies", []),
-                    "trend": ai_result.get("trend", "stable"),
-                    "key_metrics": ai_result.get("key_metrics", []),
-                    "record_count": len(sample_data)
-                })
+            if not sample_data:
+                return None
+            
+            # Get AI insights
+            ai_result = await get_openai_insight(sample_data, query.query, collection_name)
+            
+            # Get chart recommendations
+            chart_rec = await get_chart_recommendations(sample_data, collection_name)
+            
+            # Process data for visualization, limited to 5 for the response
+            processed_data = plain_documents(sample_data[:5])
+            
+            return {
+                "collection": collection_name,
+                "insight": ai_result.get("insight", "Analysis completed"),
+                "chart_type": ai_result.get("chart_type", chart_rec["recommended"]),
+                "data": processed_data,
+                "anomalies": ai_result.get("anomalies", []),
+                "trend": ai_result.get("trend", "stable"),
+                "key_metrics": ai_result.get("key_metrics", []),
+                "record_count": len(sample_data)
+            }
+        
+        # Each collection's sample + LLM call is independent of the others
+        analyzed = await run_stages({
+            name: (lambda name=name: analyze_collection(name), ()) for name in target_collections
+        })
+        results = [analyzed[name] for name in target_collections if analyzed[name]]
         
         return {
             "query": query.query,
@@ -587,84 +1133,45 @@ async def chat_with_ai(query: ChatQuery):
             "total_collections_searched": 0
         }
 
+def visualization_sample(collection_name: str, limit: int, states: Optional[str], years: Optional[str],
+                         width: Optional[int], method: str):
+    """Sample stage for chart endpoints: a downsampled full series when the chart width is given"""
+    if width:
+        if method not in METHODS:
+            raise HTTPException(status_code=400, detail=f"method must be one of {METHODS}")
+        return lambda: query_visualization_series(collection_name, states, years, width, method)
+    return lambda: query_visualization_data(collection_name, limit, states, years)
+
 @api_router.get("/visualize/{collection_name}")
-async def get_visualization_data(collection_name: str, limit: int = 50, states: str = None, years: str = None):
+async def get_visualization_data(collection_name: str, limit: int = 50, states: str = None, years: str = None,
+                                 width: Optional[int] = None, method: str = "lttb"):
     """Get data for visualization from specific collection with optional filtering"""
     try:
         # Verify collection exists
-        collections = await db.list_collection_names()
+        collections = await registry.collection_names()
         if collection_name not in collections:
             raise HTTPException(status_code=404, detail="Collection not found")
         
-        # Build query based on optional filters
-        query = {}
-        if states:
-            state_list = [s.strip() for s in states.split(',') if s.strip()]
-            if state_list:
-                query["state"] = {"$in": state_list}
-        
-        if years:
-            year_list = []
-            try:
-                year_list = [int(y.strip()) for y in years.split(',') if y.strip()]
-            except ValueError:
-                pass  # Ignore invalid years
-            
-            if year_list:
-                if collection_name == "covid_stats":
-                    # For COVID data, filter by year from date field
-                    year_filters = []
-                    for year in year_list:
-                        year_filters.append({"date": {"$regex": f"^{year}-"}})
-                    if year_filters:
-                        query["$or"] = year_filters
-                else:
-                    query["year"] = {"$in": year_list}
-        
-        # If no filters provided, try to get a representative sample from all states
-        if not query:
-            # Get all states first
-            all_states = await db[collection_name].distinct("state")
-            # For better visualization, limit to top 10-15 states and get recent data
-            if collection_name != "covid_stats":
-                # Get latest year available
-                latest_years = await db[collection_name].distinct("year")
-                if latest_years:
-                    latest_year = max(latest_years)
-                    query = {"year": latest_year}
-            else:
-                # For COVID data, get recent data
-                query = {"date": {"$regex": "^202[0-3]"}}
-        
-        # Get data
-        data = await db[collection_name].find(query).limit(limit).to_list(limit)
-        
-        # If still no data and filters were applied, try without filters
-        if not data and (states or years):
-            data = await db[collection_name].find().limit(limit).to_list(limit)
-        
-        # Process data for frontend
-        processed_data = []
-        for doc in data:
-            clean_doc = {k: v for k, v in doc.items() if k != '_id'}
-            # Convert datetime objects to strings
-            for key, value in clean_doc.items():
-                if isinstance(value, datetime):
-                    clean_doc[key] = value.isoformat()
-            processed_data.append(clean_doc)
-        
-        # Get chart recommendations
-        chart_rec = await get_chart_recommendations(processed_data)
-        
-        # Generate AI insights using enhanced method
-        ai_insights = await get_enhanced_web_insights(
-            processed_data, 
-            collection_name, 
-            f"Analyze the {collection_name} dataset patterns and trends"
-        )
+        filters = filters_from_params(states, years, limit=limit, **({"width": width, "method": method} if width else {}))
+        access_log.record("visualize", collection_name, filters)
         
-        # Get metadata for context
-        metadata = await get_collection_metadata(collection_name)
+        # Metadata doesn't depend on the sample; chart recommendations and insights do
+        results = await run_stages({
+            "sample": (visualization_sample(collection_name, limit, states, years, width, method), ()),
+            "chart_rec": (lambda sample: get_chart_recommendations(sample["data"], collection_name), ("sample",)),
+            "ai_insights": (lambda sample: get_enhanced_web_insights(
+                sample["data"],
+                collection_name,
+                f"Analyze the {collection_name} dataset patterns and trends",
+                cache_key=insight_key("visualize", collection_name, filters)
+            ), ("sample",)),
+            "metadata": (lambda: get_collection_metadata(collection_name), ()),
+        })
+        processed_data = results["sample"]["data"]
+        query = results["sample"]["query_used"]
+        chart_rec = results["chart_rec"]
+        ai_insights = results["ai_insights"]
+        metadata = results["metadata"]
         
         return {
             "collection": collection_name,
@@ -682,52 +1189,102 @@ async def get_visualization_data(collection_name: str, limit: int = 50, states:
         logging.error(f"Visualization error: {e}")
         raise HTTPException(status_code=500, detail="Error processing visualization data")
 
+@api_router.get("/dashboard/{collection_name}")
+async def get_dashboard(collection_name: str, limit: int = 50, states: str = None, years: str = None,
+                        width: Optional[int] = None, method: str = "lttb"):
+    """Visualization data, insights and metadata for one dashboard view from a single shared plan"""
+    try:
+        # Verify collection exists
+        collections = await registry.collection_names()
+        if collection_name not in collections:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        
+        filters = filters_from_params(states, years, limit=limit, **({"width": width, "method": method} if width else {}))
+        access_log.record("dashboard", collection_name, filters)
+        
+        async def count_matching(sample: Dict[str, Any]) -> int:
+            return await analytics_db[collection_name].count_documents(sample["query_used"])
+        
+        # One filtered scan feeds the chart, the insight and the count; metadata runs alongside.
+        # The insight shares its cache entry with /api/visualize for the same filters.
+        results = await run_stages({
+            "sample": (visualization_sample(collection_name, limit, states, years, width, method), ()),
+            "chart_rec": (lambda sample: get_chart_recommendations(sample["data"], collection_name), ("sample",)),
+            "insights": (lambda sample: get_enhanced_web_insights(
+                sample["data"],
+                collection_name,
+                f"Analyze the {collection_name} dataset patterns and trends",
+                cache_key=insight_key("visualize", collection_name, filters)
+            ), ("sample",)),
+            "total_records": (count_matching, ("sample",)),
+            "metadata": (lambda: get_collection_metadata(collection_name), ()),
+        })
+        processed_data = results["sample"]["data"]
+        metadata = results["metadata"].dict()
+        
+        return {
+            "collection": collection_name,
+            "visualization": {
+                "collection": collection_name,
+                "data": processed_data,
+                "chart_recommendations": results["chart_rec"],
+                "ai_insights": results["insights"],
+                "total_records": len(processed_data),
+                "metadata": metadata,
+                "query_used": results["sample"]["query_used"]
+            },
+            "insights": {
+                "collection": collection_name,
+                "total_records": results["total_records"],
+                "insights": results["insights"],
+                "sample_size": len(processed_data),
+                "metadata": metadata,
+                "applied_filters": {
+                    "states": states.split(',') if states else None,
+                    "years": years.split(',') if years else None
+                },
+                "generated_at": datetime.utcnow().isoformat()
+            },
+            "metadata": metadata
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Dashboard error: {e}")
+        raise HTTPException(status_code=500, detail="Error building dashboard data")
+
 @api_router.get("/insights/{collection_name}")
 async def get_dataset_insights(collection_name: str, states: str = None, years: str = None):
     """Get AI-generated insights for a specific dataset with optional filtering"""
+    reject_if_shedding()
     try:
-        # Build query based on optional filters
-        query = {}
-        if states:
-            state_list = [s.strip() for s in states.split(',') if s.strip()]
-            if state_list:
-                query["state"] = {"$in": state_list}
-        
-        if years:
-            year_list = []
-            try:
-                year_list = [int(y.strip()) for y in years.split(',') if y.strip()]
-            except ValueError:
-                pass
-            
-            if year_list:
-                if collection_name == "covid_stats":
-                    year_filters = []
-                    for year in year_list:
-                        year_filters.append({"date": {"$regex": f"^{year}-"}})
-                    if year_filters:
-                        query["$or"] = year_filters
-                else:
-                    query["year"] = {"$in": year_list}
-        
-        # Get sample data
-        sample_data = await db[collection_name].find(query).limit(50).to_list(50)
-        
-        if not sample_data:
-            raise HTTPException(status_code=404, detail="No data found for the specified criteria")
-        
-        # Generate comprehensive insights using enhanced method
-        insights = await get_enhanced_web_insights(
-            sample_data, 
-            collection_name, 
-            f"Provide comprehensive analysis of the {collection_name} dataset including trends, patterns, and key findings"
-        )
+        filters = filters_from_params(states, years)
+        query = datasets.get(collection_name).filter_query(filters["states"], filters["years"])
+        access_log.record("insights", collection_name, filters)
         
-        # Calculate basic statistics
-        total_records = await db[collection_name].count_documents(query if query else {})
+        async def load_sample() -> List[Dict]:
+            sample_data = await analytics_db[collection_name].find(query).limit(50).to_list(50)
+            if not sample_data:
+                raise HTTPException(status_code=404, detail="No data found for the specified criteria")
+            return sample_data
         
-        # Get metadata
-        metadata = await get_collection_metadata(collection_name)
+        # Only the insights wait for the sample; the count and metadata run alongside
+        results = await run_stages({
+            "sample": (load_sample, ()),
+            "insights": (lambda sample_data: get_enhanced_web_insights(
+                sample_data,
+                collection_name,
+                INSIGHT_PROMPTS["insights"].format(collection=collection_name),
+                cache_key=insight_key("insights", collection_name, filters)
+            ), ("sample",)),
+            "total_records": (lambda: analytics_db[collection_name].count_documents(query if query else {}), ()),
+            "metadata": (lambda: get_collection_metadata(collection_name), ()),
+        })
+        sample_data = results["sample"]
+        insights = results["insights"]
+        total_records = results["total_records"]
+        metadata = results["metadata"]
         
         return {
             "collection": collection_name,
@@ -748,17 +1305,391 @@ async def get_dataset_insights(collection_name: str, states: str = None, years:
         logging.error(f"Insights error: {e}")
         raise HTTPException(status_code=500, detail="Error generating insights")
 
-# Include the router in the main app
-app.include_router(api_router)
+@api_router.get("/correlate")
+async def correlate(features: str = None, method: str = "pearson", max_lag: int = 0,
+                    states: str = None, years: str = None, top: int = 10):
+    """Pearson/Spearman correlations between dataset measures over state-years, optionally lagged by years"""
+    if method not in CORRELATION_METHODS or not 0 <= max_lag <= MAX_CORRELATION_LAG:
+        raise HTTPException(status_code=400, detail=f"method must be one of {CORRELATION_METHODS} "
+                                                    f"and max_lag between 0 and {MAX_CORRELATION_LAG}")
+    try:
+        matrix = await correlations.load()
+        feature_list = [f.strip() for f in features.split(',') if f.strip()] if features else matrix.names
+        filters = filters_from_params(states, years)
+        # The key carries every input collection's version, so any dataset change misses it
+        cache_key = canonical_key("correlate", matrix.versions, filters, feature_list, method, max_lag, top)
+        data_version = data_versions.get("correlate")
+        cached = result_cache.get(cache_key, "correlate")
+        if cached is not None:
+            return cached
 
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+        state_ids, unresolved = state_dimension.resolve_many(filters["states"] or [])
+        if unresolved:
+            raise HTTPException(status_code=400, detail=f"Unknown states: {', '.join(unresolved)}")
+        selected = matrix.mask(state_ids or None, filters["years"])
+        result = matrix.correlate(feature_list, method, max_lag, selected, top)
+        result["available_features"] = matrix.names
+        result_cache.set(cache_key, "correlate", result, data_version)
+        return result
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Correlation error: {e}")
+        raise HTTPException(status_code=500, detail="Error computing correlations")
+
+@api_router.get("/forecast/{collection_name}")
+async def forecast(collection_name: str, field: str = None, horizon: int = 5, model: str = "auto",
+                   interval: str = None, states: str = None, confidence: float = 0.9):
+    """Per-state forecasts with prediction intervals and a trend summary, from models cached per data version"""
+    if model not in FORECAST_MODELS or not 1 <= horizon <= MAX_FORECAST_HORIZON or not 0.5 <= confidence < 1:
+        raise HTTPException(status_code=400, detail=f"model must be one of {FORECAST_MODELS}, horizon between 1 and "
+                                                    f"{MAX_FORECAST_HORIZON} and confidence in [0.5, 1)")
+    try:
+        collections = await registry.collection_names()
+        if collection_name not in collections:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        field = field or (await profiles.load(collection_name))["recommendation"]["field"]
+        if not field:
+            raise HTTPException(status_code=400, detail=f"{collection_name} has no numeric field to forecast")
+
+        # Daily datasets are forecast per week or month from their buckets, the rest per year
+        if collection_name in time_series:
+            interval = interval or "month"
+            if interval not in ("week", "month"):
+                raise HTTPException(status_code=400, detail="interval must be week or month")
+
+            async def load_series():
+                # Per-day averages, so a partly reported last period isn't mistaken for a drop
+                store = time_series[collection_name]
+                if store.usable:
+                    return await store.downsample(None, None, interval, "avg", [field])
+                return await downsample_rows(cache_fill_db()[collection_name], {}, interval, "avg", [field])
+        else:
+            if interval not in (None, "year") or model == "seasonal_naive":
+                raise HTTPException(status_code=400, detail=f"{collection_name} only has yearly data, "
+                                                            "which has no season to repeat")
+            interval = "year"
+
+            async def load_series():
+                # Same state-year aggregates the correlation matrix is built from
+                features = await correlations.state_year_features(collection_name)
+                cells = features.get(f"{collection_name}.{field}")
+                if cells is None:
+                    raise ValueError(f"'{field}' is not a numeric field of {collection_name}")
+                series: Dict[int, Dict[str, Any]] = {}
+                for (state_id, year), value in sorted(cells.items()):
+                    entry = series.setdefault(state_id, {"state_id": state_id, "state": state_dimension.name(state_id),
+                                                         "points": []})
+                    entry["points"].append({"period": year, field: value})
+                return list(series.values())
+
+        filters = filters_from_params(states, None)
+        cache_key = canonical_key("forecast", collection_name, filters, field, horizon, model, interval, confidence)
+        data_version = data_versions.get(collection_name)
+        cached = result_cache.get(cache_key, collection_name)
+        if cached is not None:
+            return cached
+
+        state_ids, unresolved = state_dimension.resolve_many(filters["states"] or [])
+        if unresolved:
+            raise HTTPException(status_code=400, detail=f"Unknown states: {', '.join(unresolved)}")
+        fit = await forecasts.fit(collection_name, field, interval, model, load_series)
+        result = {
+            "collection": collection_name,
+            "field": field,
+            "interval": interval,
+            "model": fit.model,
+            "horizon": horizon,
+            "confidence": confidence,
+            "history": {"first": fit.periods[0], "last": fit.periods[-1], "periods": len(fit.periods)},
+            "series": fit.forecast(horizon, confidence, state_ids or None),
+        }
+        result_cache.set(cache_key, collection_name, result, data_version)
+        return result
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Forecast error for {collection_name}: {e}")
+        raise HTTPException(status_code=500, detail="Error computing forecast")
+
+@api_router.get("/timeseries/{collection_name}")
+async def get_time_series(collection_name: str, interval: str = "month", agg: str = "sum",
+                          states: str = None, years: str = None, fields: str = None,
+                          width: Optional[int] = None, method: str = "lttb"):
+    """Per-state series downsampled from daily data to weekly or monthly sums or averages"""
+    if collection_name not in time_series:
+        raise HTTPException(status_code=404, detail=f"{collection_name} has no time-series storage")
+    if interval not in INTERVALS or agg not in AGGREGATIONS or method not in METHODS:
+        raise HTTPException(status_code=400, detail=f"interval must be one of {INTERVALS}, agg one of {AGGREGATIONS}, "
+                                                    f"method one of {METHODS}")
+    try:
+        filters = filters_from_params(states, years)
+        field_list = [f.strip() for f in fields.split(',') if f.strip()] if fields else TIME_SERIES_FIELDS[collection_name]
+        cache_key = canonical_key("timeseries", collection_name, filters, interval, agg, field_list, width, method)
+        data_version = data_versions.get(collection_name)
+        cached = result_cache.get(cache_key, collection_name)
+        if cached is not None:
+            return cached
+
+        store = time_series[collection_name]
+        state_ids = state_dimension.resolve_many(filters["states"])[0] if filters["states"] else None
+        if filters["states"] and not state_ids:
+            series = []
+        elif store.usable:
+            series = await store.downsample(state_ids, filters["years"], interval, agg, field_list)
+        else:
+            query = datasets.get(collection_name).filter_query(filters["states"], filters["years"])
+            series = await downsample_rows(cache_fill_db()[collection_name], query, interval, agg, field_list)
+        if width:
+            # Thin each state's line to what a `width`-pixel chart can draw
+            for state_series in series:
+                state_series["points"] = downsample_points(state_series["points"], field_list, target_points(width), method)
+
+        result = {
+            "collection": collection_name,
+            "interval": interval,
+            "agg": agg,
+            "fields": field_list,
+            "series": series,
+            "source": "buckets" if store.usable else "rows",
+        }
+        result_cache.set(cache_key, collection_name, result, data_version)
+        return result
+    except Exception as e:
+        logging.error(f"Time series error for {collection_name}: {e}")
+        raise HTTPException(status_code=500, detail="Error building time series")
+
+@api_router.post("/ingest/{collection_name}", response_model=IngestStats)
+async def ingest_dataset(collection_name: str, file: UploadFile = File(...), batch_size: int = 10000,
+                         x_api_key: Optional[str] = Header(None)):
+    """Upsert rows from an uploaded CSV/JSON/JSON Lines file and bump the collection's data version"""
+    if not INGEST_API_KEY or x_api_key != INGEST_API_KEY:
+        raise HTTPException(status_code=403, detail="Ingestion is disabled or the API key is invalid")
+    try:
+        rows = read_records(open_upload(file.file), detect_format(file.filename or ""))
+        stats = await ingest_records(db, manifests, collection_name, rows, batch_size=batch_size,
+                                     natural_key=datasets.get(collection_name).natural_key)
+        data_versions.record_ingest(collection_name, stats.version)
+        registry.invalidate()
+        return stats
+    except Exception as e:
+        logging.error(f"Ingest error for {collection_name}: {e}")
+        raise HTTPException(status_code=400, detail=f"Error ingesting {collection_name}: {e}")
+
+@api_router.get("/states")
+async def get_states():
+    """State dimension: integer codes, canonical names and accepted aliases"""
+    return {"states": state_dimension.to_list()}
+
+@api_router.get("/states/resolve")
+async def resolve_states(names: str):
+    """Resolve comma-separated state names, aliases or misspellings to dimension codes"""
+    results = []
+    for name in [n.strip() for n in names.split(',') if n.strip()]:
+        code = state_dimension.resolve(name)
+        results.append({"input": name, "id": code, "name": state_dimension.name(code) if code is not None else None})
+    return {"results": results}
+
+async def live_groups(spec: Dict[str, Any]) -> Dict[Any, Any]:
+    """Current aggregate of a live topic, by group key; shares the result cache with /api/aggregate"""
+    result = await aggregate_data(AggregateRequest(**spec))
+    return {group["key"]: group["value"] for group in result["groups"]}
+
+async def live_topic(request: Dict[str, Any]):
+    """Validate a subscribe message into a topic id and its normalized aggregate spec"""
+    try:
+        aggregate = AggregateRequest(**{k: v for k, v in request.items() if k != "action"})
+    except ValidationError as e:
+        raise ValueError(f"Invalid subscription: {e.errors()[0]['msg']}")
+    if aggregate.collection not in await registry.collection_names():
+        raise ValueError(f"Unknown collection {aggregate.collection}")
+    if aggregate.agg not in ("count", "sum", "avg") or (aggregate.agg != "count" and not aggregate.field):
+        raise ValueError("agg must be count, or sum/avg with a field")
+    filters = normalize_filters(aggregate.states, aggregate.years, aggregate.crime_types,
+                                filters=special_filter_key(aggregate))
+    spec = {"collection": aggregate.collection, **filters, "group_by": aggregate.group_by,
+            "agg": aggregate.agg, "field": aggregate.field}
+    return canonical_key("live", spec)[:16], spec
+
+# One refresh per data change per topic, however many dashboards are subscribed to it
+live_hub = LiveHub(data_versions, live_groups, debounce_seconds=float(os.environ.get('LIVE_DEBOUNCE_SECONDS', 1)))
+data_versions.subscribe(live_hub.on_version)
+
+def connection_client(connection) -> str:
+    """Rate-limit identity of an HTTP request or WebSocket"""
+    return client_identity(connection.headers, connection.client.host if connection.client else None,
+                           TRUSTED_PROXIES, [INGEST_API_KEY, ADMIN_API_KEY, *RATE_LIMIT_API_KEYS])
+
+@api_router.websocket("/ws")
+async def live_updates(websocket: WebSocket):
+    """Subscribe to (collection, filters, grouping) topics and receive a snapshot, then deltas on data changes"""
+    # The rate-limit middleware only sees HTTP, so connects and subscribes draw from the read budget here
+    client_id = connection_client(websocket)
+    if rate_limiter.check(client_id, BUDGET_READ):
+        # Closing before accepting rejects the handshake
+        await websocket.close(code=1013, reason="Rate limit exceeded")
+        return
+    await websocket.accept()
+    await serve_connection(websocket, live_hub, live_topic,
+                           throttle=lambda: rate_limiter.check(client_id, BUDGET_READ))
+
+@api_router.get("/metrics/db")
+async def get_database_metrics():
+    """Connection pool wait times and database access settings"""
+    return db.metrics()
+
+@api_router.get("/metrics/cache")
+async def get_cache_metrics():
+    """Hit rates and sizes of the result and insight caches"""
+    return {
+        "result_cache": result_cache.stats(),
+        "insight_cache": insight_cache.stats(),
+        "data_versions": data_versions.snapshot(),
+        "time_series": {name: store.snapshot() for name, store in time_series.items()},
+        "approx_samples": samples.snapshot(),
+        "column_profiles": profiles.snapshot(),
+        "correlations": correlations.snapshot(),
+        "forecasts": forecasts.stats()
+    }
+
+@api_router.get("/metrics/limits")
+async def get_limit_metrics():
+    """Rate limiter budgets and LLM admission queue state"""
+    return {
+        "rate_limits": rate_limiter.stats(),
+        "llm_queue": llm_queue.stats(),
+        "overload": overload.stats(),
+        "deadlines": deadline_policy.stats()
+    }
+
+@api_router.get("/metrics/llm")
+async def get_llm_metrics():
+    """Insight provider routing, and how LLM completions were turned into insights per schema"""
+    return {
+        **llm_output_stats.snapshot(),
+        "routing": insight_router.stats(),
+        "local_llm_queue": local_llm_queue.stats(),
+    }
+
+@api_router.get("/metrics/live")
+async def get_live_metrics():
+    """Open live-update connections, topics and fan-out counters"""
+    return live_hub.stats()
+
+def require_admin(x_api_key: Optional[str]):
+    if not ADMIN_API_KEY or x_api_key != ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled or the API key is invalid")
+
+@api_router.get("/admin/profiles")
+async def list_request_profiles(x_api_key: Optional[str] = Header(None)):
+    """Recent profiles of requests sent with X-Profile (or ?profile=), newest first"""
+    require_admin(x_api_key)
+    return {"profiles": profile_recorder.list(), "skipped_busy": profile_recorder.busy}
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_request_profile(profile_id: str, x_api_key: Optional[str] = Header(None)):
+    """A request profile: collapsed stacks for flame graphs, or cProfile statistics as text"""
+    require_admin(x_api_key)
+    profile = profile_recorder.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    if profile["mode"] == "cprofile":
+        return PlainTextResponse(profile["pstats"])
+    return PlainTextResponse(
+        collapsed_text(profile["stacks"]),
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.collapsed"'},
+    )
+
+@api_router.get("/admin/flamegraph")
+async def capture_flamegraph(seconds: float = 10, interval_ms: Optional[float] = None, all_threads: bool = False,
+                             x_api_key: Optional[str] = Header(None)):
+    """
+    Sample the event loop (or every thread) for a few seconds of live traffic and return the
+    stacks in collapsed format, ready for flamegraph.pl or speedscope
+    """
+    require_admin(x_api_key)
+    if not 0 < seconds <= MAX_FLAMEGRAPH_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {MAX_FLAMEGRAPH_SECONDS:g}")
+    interval = (interval_ms or PROFILE_SAMPLE_INTERVAL_MS) / 1000
+    if not 0.001 <= interval <= 1:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    sampler = StackSampler(None if all_threads else threading.get_ident(), interval).start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stacks = sampler.stop()
+    summary = summarize(stacks)
+    logging.info(f"Flame graph captured: {summary['samples']} samples, idle share {summary['idle_share']}")
+    return PlainTextResponse(
+        collapsed_text(stacks),
+        headers={"Content-Disposition": f'attachment; filename="flamegraph-{datetime.utcnow():%Y%m%dT%H%M%S}.collapsed"',
+                 "X-Samples": str(summary["samples"]), "X-Idle-Share": str(summary["idle_share"])},
+    )
+
+@api_router.get("/datasets/{collection_name}/descriptor")
+async def get_dataset_descriptor(collection_name: str):
+    """How a dataset is queried: dimensions, measures, time field, special filters, indexes and rollups"""
+    descriptor = datasets.get(collection_name)
+    return {**descriptor.dict(), "index_specs": descriptor.index_specs()}
+
+@api_router.put("/admin/datasets/{collection_name}")
+async def register_dataset(collection_name: str, descriptor: DatasetDescriptor, x_api_key: Optional[str] = Header(None)):
+    """Register or replace a dataset descriptor; its filters, indexes and rollups apply without a deploy"""
+    require_admin(x_api_key)
+    if descriptor.collection != collection_name:
+        raise HTTPException(status_code=400, detail="Descriptor collection doesn't match the path")
+    try:
+        await datasets.save(descriptor)
+        for name in sync_time_series():
+            background_tasks.append(create_background_task(time_series[name].follow()))
+        # Index builds can take longer than any request; query plans start hinting them once they exist
+        datasets.build_indexes(db, collection_name)
+        # Cached results and metadata were computed under the old descriptor
+        data_versions.bump(collection_name)
+        return {"descriptor": descriptor.dict(), "index_specs": descriptor.index_specs()}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error registering dataset {collection_name}: {e}")
+        raise HTTPException(status_code=500, detail="Error registering dataset")
+
+@api_router.get("/admin/query-plans")
+async def get_query_plans(x_api_key: Optional[str] = Header(None)):
+    """Compiled filtered-query plans per shape: index, sort, projection and how often each was used"""
+    require_admin(x_api_key)
+    return query_planner.snapshot()
+
+@api_router.get("/admin/loop-stalls")
+async def get_loop_stalls(x_api_key: Optional[str] = Header(None)):
+    """Recent event-loop stalls over the threshold, with the stack the loop was blocked in"""
+    require_admin(x_api_key)
+    return {**loop_watchdog.snapshot(), "loop_lag_ms": round(overload.loop_lag_ms, 2)}
+
+async def rate_limit(request: Request, call_next):
+    """Per-client token buckets; LLM-backed routes draw from a smaller budget than plain reads"""
+    client_id = connection_client(request)
+    budget = route_budget(request.url.path)
+    if budget and request.method != "OPTIONS":
+        retry_after = rate_limiter.check(client_id, budget)
+        if retry_after:
+            return JSONResponse(
+                status_code=429,
+                content={"detail": f"Rate limit exceeded for {budget} requests"},
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+    # LLM admission control queues fairly by this identity
+    token = current_client.set(client_id)
+    try:
+        async with overload.track():
+            return await call_next(request)
+    finally:
+        current_client.reset(token)
 
 # Configure logging
 logging.basicConfig(
@@ -767,9 +1698,227 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+async def replay_access(entry: Dict[str, Any]):
+    """Re-run a logged request so its insights land in the cache"""
+    filters = entry.get("filters") or {}
+    states = ",".join(filters["states"]) if filters.get("states") else None
+    years = ",".join(str(y) for y in filters["years"]) if filters.get("years") else None
+    if entry["kind"] == "insights":
+        await get_dataset_insights(entry["collection"], states=states, years=years)
+    elif entry["kind"] == "visualize":
+        await get_visualization_data(entry["collection"], limit=filters.get("limit", 50), states=states, years=years,
+                                     width=filters.get("width"), method=filters.get("method") or "lttb")
+    elif entry["kind"] == "dashboard":
+        await get_dashboard(entry["collection"], limit=filters.get("limit", 50), states=states, years=years,
+                            width=filters.get("width"), method=filters.get("method") or "lttb")
+    elif entry["kind"] == "enhanced":
+        await get_enhanced_insights(FilterRequest(
+            collection=entry["collection"],
+            states=filters.get("states"),
+            years=filters.get("years"),
+            crime_types=filters.get("crime_types")
+        ))
+
+def batch_insight_key(combination: Dict[str, Any]) -> str:
+    """Insight cache key of a batch combination: the key its interactive endpoint looks up"""
+    return insight_key(combination["kind"], combination["collection"],
+                       normalize_filters(combination.get("states"), combination.get("years"),
+                                         combination.get("crime_types")))
+
+async def precompute_insight(combination: Dict[str, Any], pace, refresh: bool = False,
+                             ttl_seconds: Optional[float] = None) -> str:
+    """
+    Generate one batch combination's insight into the insight cache, with the sample and prompt
+    its endpoint would use. Returns "cached", "empty" or "generated"; LLM errors propagate so the
+    batch can retry them, and fallbacks are never cached.
+    """
+    collection_name = combination["collection"]
+    cache_key = batch_insight_key(combination)
+    if not refresh and await insight_cache.get(cache_key) is not None:
+        return "cached"
+    query = await build_filter_query(FilterRequest(
+        collection=collection_name,
+        states=combination.get("states"),
+        years=combination.get("years"),
+        crime_types=combination.get("crime_types")
+    ))
+    data = await analytics_db[collection_name].find(query).limit(50).to_list(50)
+    if not data:
+        return "empty"
+    if combination["kind"] == "enhanced":
+        data = plain_documents(data)
+    request = enhanced_insight_request(data, collection_name,
+                                       INSIGHT_PROMPTS[combination["kind"]].format(collection=collection_name))
+    # Only calls to an LLM count against the provider's rate limit
+    chain, _ = insight_router.plan(request, LLM_TIMEOUT_SECONDS)
+    if chain and chain[0].uses_llm:
+        await pace()
+    result, degraded = await route_insight(request, allow_llm=True, budget=LLM_TIMEOUT_SECONDS, fall_through=False)
+    await insight_cache.set(cache_key, result, ttl_seconds=ttl_seconds, collection=collection_name,
+                            source="batch")
+    return "generated"
+
+def sync_time_series() -> List[str]:
+    """Create stores for collections whose descriptors gained a rollup; returns the new ones"""
+    added = []
+    for name, fields in datasets.rollups().items():
+        TIME_SERIES_FIELDS[name] = fields
+        if name not in time_series:
+            time_series[name] = TimeSeriesStore(db, cache_db, name, data_versions)
+            added.append(name)
+    return added
+
+async def load_dataset_descriptors() -> Dict[str, Any]:
+    """Stored descriptors on top of the built-in ones; they can add datasets, filters and rollups"""
+    loaded = await datasets.load()
+    return {"loaded": loaded, "time_series": sync_time_series()}
+
+async def ensure_dataset_indexes() -> int:
+    collections = await registry.collection_names()
+    created = await asyncio.gather(*(datasets.ensure_indexes(db, name) for name in collections))
+    return sum(len(specs) for specs in created)
+
+async def rebuild_time_series() -> Dict[str, int]:
+    return {name: await store.rebuild() for name, store in time_series.items()}
+
+async def warm_up():
+    """Load metadata, run default visualizations and cache the most requested insights"""
+    async def load_registry():
+        registry.invalidate()
+        await insight_cache.ensure_indexes()
+        # Insight cache keys include manifest versions, so load them before generating any
+        await data_versions.load_manifests(manifests)
+        return await registry.collection_names()
+
+    async def load_metadata():
+        collections = await registry.collection_names()
+        await asyncio.gather(*(get_collection_metadata(name) for name in collections))
+        return len(collections)
+
+    async def load_profiles():
+        collections = await registry.collection_names()
+        await asyncio.gather(*(profiles.load(name) for name in collections))
+        return len(collections)
+
+    async def default_visualizations():
+        # Same requests the dashboard makes on first load: latest year per collection
+        collections = await registry.collection_names()
+        results = await asyncio.gather(
+            *(get_dashboard(name) for name in collections), return_exceptions=True
+        )
+        return sum(1 for r in results if not isinstance(r, Exception))
+
+    async def top_insights():
+        entries = await access_log.top(WARMUP_TOP_N)
+        semaphore = asyncio.Semaphore(4)
+
+        async def replay(entry):
+            async with semaphore:
+                await replay_access(entry)
+
+        results = await asyncio.gather(*(replay(e) for e in entries), return_exceptions=True)
+        return sum(1 for r in results if not isinstance(r, Exception))
+
+    # Warm-up calls the request handlers, which would otherwise log these as client accesses
+    with access_log.replaying():
+        await run_warmup(warmup_state, [
+            ("collection_registry", load_registry),
+            ("dataset_indexes", ensure_dataset_indexes),
+            ("time_series", rebuild_time_series),
+            ("metadata", load_metadata),
+            ("column_profiles", load_profiles),
+            ("correlations", correlations.load),
+            ("default_visualizations", default_visualizations),
+            ("top_insights", top_insights),
+        ], timeout=WARMUP_TIMEOUT_SECONDS)
+
+background_tasks: List[asyncio.Task] = []
+
+async def preload_llm_client():
+    """Import the openai package off the event loop before the first insight needs it"""
+    if not (OPENAI_API_KEY or LOCAL_LLM_URL):
+        return
+    started = time.perf_counter()
+    await asyncio.to_thread(lambda: (openai_client(), local_llm_client()))
+    warmup_state.timings["llm_client_import"] = round((time.perf_counter() - started) * 1000, 1)
+
+async def preload_numpy():
+    """Import numpy off the event loop before the first sample, correlation, forecast or downsampled series"""
+    started = time.perf_counter()
+    await asyncio.to_thread(importlib.import_module, "numpy")
+    warmup_state.timings["numpy_import"] = round((time.perf_counter() - started) * 1000, 1)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    # Creates the Mongo client (resolving mongodb+srv hosts off the loop) and confirms the cluster answers
+    if not await run_check(warmup_state, "mongo", mongo.ping, timeout=STARTUP_CHECK_TIMEOUT_SECONDS):
+        background_tasks.append(asyncio.create_task(
+            recheck_until_healthy(warmup_state, "mongo", mongo.ping, timeout=STARTUP_CHECK_TIMEOUT_SECONDS)
+        ))
+    if warmup_state.checks["mongo"]["ok"]:
+        # Read before the time-series followers start, since stored descriptors can add rollups
+        try:
+            logging.info(f"Dataset descriptors: {await asyncio.wait_for(load_dataset_descriptors(), STARTUP_CHECK_TIMEOUT_SECONDS)}")
+        except Exception as e:
+            logging.error(f"Error loading dataset descriptors: {e!r}")
+    background_tasks.append(asyncio.create_task(access_log.run_flusher()))
+    background_tasks.append(asyncio.create_task(overload.monitor_loop_lag()))
+    loop_watchdog.start(threading.get_ident())
+    background_tasks.append(asyncio.create_task(data_versions.watch(db.raw)))
+    background_tasks.append(asyncio.create_task(data_versions.follow_manifests(manifests)))
+    for store in time_series.values():
+        background_tasks.append(asyncio.create_task(store.follow()))
+    background_tasks.append(asyncio.create_task(preload_llm_client()))
+    background_tasks.append(asyncio.create_task(preload_numpy()))
+    if WARMUP_ENABLED:
+        background_tasks.append(asyncio.create_task(warm_up()))
+    else:
+        warmup_state.ready = True
+    warmup_state.timings["lifespan_startup"] = round((time.perf_counter() - started) * 1000, 1)
+    logging.info(f"Started in {warmup_state.timings['import'] + warmup_state.timings['lifespan_startup']:.0f}ms "
+                 f"(import {warmup_state.timings['import']:.0f}ms)")
+    try:
+        yield
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        loop_watchdog.stop()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        background_tasks.clear()
+        mongo.close()
+
+def create_app() -> FastAPI:
+    """The ASGI app: routes, middleware and the lifespan that connects and starts background work"""
+    application = FastAPI(title="TRACITY API", description="AI-Powered Data Visualization Platform",
+                          lifespan=lifespan)
+    application.include_router(api_router)
+    application.middleware("http")(rate_limit)
+
+    # Every request gets a deadline; Mongo maxTimeMS and LLM timeouts are cut to what's left of it
+    application.add_middleware(DeadlineMiddleware, policy=deadline_policy)
+
+    # Opt-in sampling/cProfile of single requests; outside the deadline so the profile covers its timeout path
+    application.add_middleware(
+        ProfilingMiddleware,
+        recorder=profile_recorder,
+        authorize=lambda headers: bool(ADMIN_API_KEY) and headers.get(b"x-api-key", b"").decode("latin-1") == ADMIN_API_KEY,
+        inflight=lambda: overload.inflight,
+        interval=PROFILE_SAMPLE_INTERVAL_MS / 1000,
+    )
+
+    # Add CORS middleware (added last so it also wraps 429 responses)
+    application.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=[o.strip() for o in os.environ.get('CORS_ORIGINS', '*').split(',') if o.strip()],
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return application
+
+app = create_app()
+warmup_state.timings["import"] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 1)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,255 @@
+"""State dimension table: integer codes, alias resolution and fuzzy lookup of Indian state names"""
+import difflib
+import logging
+import re
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+
+# (code, canonical name, aliases); codes follow the Census 2011 state codes, 37 is Ladakh and
+# 0 is reserved for national totals that some sources include as a pseudo-state row
+STATES: List[Tuple[int, str, List[str]]] = [
+    (0, "All India", ["india", "total", "total all india", "all india total"]),
+    (1, "Jammu and Kashmir", ["j and k", "jk", "jammu kashmir", "jammu and kashmir ut"]),
+    (2, "Himachal Pradesh", ["hp"]),
+    (3, "Punjab", ["pb"]),
+    (4, "Chandigarh", ["ch"]),
+    (5, "Uttarakhand", ["uttaranchal", "uk"]),
+    (6, "Haryana", ["hr"]),
+    (7, "Delhi", ["nct of delhi", "nct delhi", "new delhi", "delhi nct", "dl"]),
+    (8, "Rajasthan", ["rj"]),
+    (9, "Uttar Pradesh", ["up"]),
+    (10, "Bihar", ["br"]),
+    (11, "Sikkim", ["sk"]),
+    (12, "Arunachal Pradesh", ["ar"]),
+    (13, "Nagaland", ["nl"]),
+    (14, "Manipur", ["mn"]),
+    (15, "Mizoram", ["mz"]),
+    (16, "Tripura", ["tr"]),
+    (17, "Meghalaya", ["ml"]),
+    (18, "Assam", ["as"]),
+    (19, "West Bengal", ["wb", "bengal"]),
+    (20, "Jharkhand", ["jh"]),
+    (21, "Odisha", ["orissa", "od"]),
+    (22, "Chhattisgarh", ["chattisgarh", "chhatisgarh", "cg"]),
+    (23, "Madhya Pradesh", ["mp"]),
+    (24, "Gujarat", ["gj"]),
+    (25, "Dadra and Nagar Haveli and Daman and Diu", ["daman and diu", "dadra and nagar haveli", "dnhdd"]),
+    (27, "Maharashtra", ["mh"]),
+    (28, "Andhra Pradesh", ["ap"]),
+    (29, "Karnataka", ["ka", "mysore"]),
+    (30, "Goa", ["ga"]),
+    (31, "Lakshadweep", ["ld"]),
+    (32, "Kerala", ["kl"]),
+    (33, "Tamil Nadu", ["tn", "tamilnadu"]),
+    (34, "Puducherry", ["pondicherry", "py"]),
+    (35, "Andaman and Nicobar Islands", ["andaman and nicobar", "a and n islands", "an"]),
+    (36, "Telangana", ["telengana", "ts", "tg"]),
+    (37, "Ladakh", ["la"]),
+]
+
+# Close enough for typos ("Gujrat", "Karnatka") but not for different states sharing a word
+FUZZY_CUTOFF = 0.85
+# "State of Kerala", "Govt. of NCT of Delhi" and similar prefixes
+NAME_PREFIX = re.compile(r"^(the |state of |govt of |government of |ut of )+")
+# Aliases this short are abbreviations and are matched exactly, never fuzzily
+MIN_FUZZY_LENGTH = 4
+
+
+def normalize_state_key(value: Any) -> str:
+    """Lower-case lookup key with '&' spelled out and punctuation and extra whitespace removed"""
+    text = str(value).lower().replace("&", " and ")
+    text = re.sub(r"[^a-z0-9 ]+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class StateDimension:
+    """Maps state names, aliases and misspellings to stable integer codes and back"""
+
+    def __init__(self, states: Iterable[Tuple[int, str, List[str]]]):
+        self._names: Dict[int, str] = {}
+        self._keys: Dict[str, int] = {}
+        for code, name, aliases in states:
+            self._names[code] = name
+            for key in [name, *aliases]:
+                self._keys[normalize_state_key(key)] = code
+        self._fuzzy_keys = [key for key in self._keys if len(key) >= MIN_FUZZY_LENGTH]
+        self.lookup = lru_cache(maxsize=4096)(self._lookup)
+        self.resolve = lru_cache(maxsize=4096)(self._resolve)
+
+    def _lookup(self, value: Any) -> Optional[int]:
+        """Code for a name or alias, ignoring case, punctuation and "State of"-style prefixes; no fuzzy matching"""
+        if value is None:
+            return None
+        if isinstance(value, int) and value in self._names:
+            return value
+        key = normalize_state_key(value)
+        if not key:
+            return None
+        if key in self._keys:
+            return self._keys[key]
+        return self._keys.get(NAME_PREFIX.sub("", key))
+
+    def _resolve(self, value: Any) -> Optional[int]:
+        """Code for a name, alias or close misspelling; None if nothing matches"""
+        code = self._lookup(value)
+        if code is not None or value is None or isinstance(value, int):
+            return code
+        stripped = NAME_PREFIX.sub("", normalize_state_key(value))
+        if len(stripped) < MIN_FUZZY_LENGTH:
+            return None
+        matches = difflib.get_close_matches(stripped, self._fuzzy_keys, n=1, cutoff=FUZZY_CUTOFF)
+        return self._keys[matches[0]] if matches else None
+
+    def name(self, code: int) -> Optional[str]:
+        return self._names.get(code)
+
+    def canonical_name(self, value: Any) -> Optional[str]:
+        code = self.resolve(value)
+        return self._names[code] if code is not None else None
+
+    def resolve_many(self, values: Iterable[Any]) -> Tuple[List[int], List[Any]]:
+        """(sorted distinct codes, values that could not be resolved)"""
+        codes, unresolved = set(), []
+        for value in values:
+            code = self.resolve(value)
+            if code is None:
+                unresolved.append(value)
+            else:
+                codes.add(code)
+        return sorted(codes), unresolved
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        aliases: Dict[int, List[str]] = {code: [] for code in self._names}
+        for key, code in self._keys.items():
+            if key != normalize_state_key(self._names[code]):
+                aliases[code].append(key)
+        return [{"id": code, "name": name, "aliases": aliases[code]} for code, name in sorted(self._names.items())]
+
+
+state_dimension = StateDimension(STATES)
+
+
+def canonical_state_names(values: Iterable[Any]) -> List[str]:
+    """Canonical spellings of the given names, keeping unknown names as given"""
+    return [state_dimension.canonical_name(value) or str(value).strip() for value in values]
+
+
+def document_state_id(doc: Dict[str, Any]) -> Optional[int]:
+    """
+    A stored document's state code: its `state_id`, or for documents written before the dimension
+    existed, an exact name or alias lookup of `state`. Never fuzzy, so data isn't misattributed.
+    """
+    code = doc.get("state_id")
+    if isinstance(code, int):
+        return code
+    return state_dimension.lookup(doc.get("state"))
+
+
+def state_query(values: Iterable[Any]) -> Dict[str, Any]:
+    """
+    Mongo condition for a list of user- or LLM-provided state names.
+
+    Names that resolve match on the integer `state_id`, and also by name, canonical or as given,
+    so documents without a `state_id` (not migrated, or a name the migration couldn't place) and
+    names that don't resolve still match. If none resolve, this is plain `state` matching.
+    """
+    values = list(values)
+    codes, unresolved = state_dimension.resolve_many(values)
+    if unresolved:
+        logging.info(f"Unresolved state names in filter: {unresolved}")
+    if not codes:
+        return {"state": {"$in": values}}
+    names = list(dict.fromkeys([*(state_dimension.name(code) for code in codes), *values]))
+    return {"$or": [{"state_id": {"$in": codes}}, {"state": {"$in": names}}]}
+
+
+def merge_conditions(query: Dict[str, Any], condition: Dict[str, Any]) -> Dict[str, Any]:
+    """Add `condition` to `query` in place; a second $or goes under $and instead of replacing the first"""
+    if "$or" in query and "$or" in condition:
+        condition = dict(condition)
+        query.setdefault("$and", []).append({"$or": condition.pop("$or")})
+    query.update(condition)
+    return query
+
+
+async def backfill_state_ids(database, collection_names: Iterable[str], fuzzy: bool = False,
+                             dry_run: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    Add `state_id` to documents written before the dimension existed and index it.
+
+    Only `state_id` is written; the stored `state` name is left as it was. Names are matched
+    exactly or by alias unless `fuzzy` also allows close misspellings. Runs one update_many per
+    distinct state name still lacking an id, so a repeat run is a handful of no-op queries.
+    """
+    report: Dict[str, Dict[str, Any]] = {}
+    for collection_name in collection_names:
+        collection = database[collection_name]
+        names = await collection.distinct("state", {"state_id": {"$exists": False}})
+        if not names:
+            continue
+        entry = report[collection_name] = {"updated": 0, "mapped": {}, "unresolved": []}
+        for name in names:
+            code = (state_dimension.resolve if fuzzy else state_dimension.lookup)(name)
+            if code is None:
+                entry["unresolved"].append(name)
+                logging.warning(f"No state code for '{name}' in {collection_name}")
+                continue
+            entry["mapped"][str(name)] = state_dimension.name(code)
+            if dry_run:
+                continue
+            result = await collection.update_many(
+                {"state": name, "state_id": {"$exists": False}}, {"$set": {"state_id": code}}
+            )
+            entry["updated"] += result.modified_count
+        if not dry_run:
+            await collection.create_index("state_id")
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Opt-in migration: `python states.py [--collections crimes,aqi] [--fuzzy] [--dry-run]`"""
+    import argparse
+    import asyncio
+    import json
+    import os
+    from datetime import datetime
+    from pathlib import Path
+
+    from dotenv import load_dotenv
+    from database import connect
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Add state_id to documents that lack it (the state name is kept)")
+    parser.add_argument("--collections", help="Comma-separated collections (default: all)")
+    parser.add_argument("--fuzzy", action="store_true", help="Also match close misspellings; review a --dry-run first")
+    parser.add_argument("--dry-run", action="store_true", help="Only report how names would be mapped")
+    parser.add_argument("--mongo-url", default=os.environ.get('MONGO_URL'))
+    parser.add_argument("--db-name", default="world_data")
+    parser.add_argument("--cache-db-name", default=os.environ.get('CACHE_DB_NAME', 'tracity_cache'))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    async def run():
+        connection, database = connect(args.mongo_url, args.db_name)
+        try:
+            names = ([c.strip() for c in args.collections.split(",") if c.strip()] if args.collections
+                     else [n for n in await database.list_collection_names() if not n.startswith("system.")])
+            report = await backfill_state_ids(database, names, fuzzy=args.fuzzy, dry_run=args.dry_run)
+            manifests = database.sibling(args.cache_db_name)["dataset_manifests"]
+            for collection_name, entry in report.items():
+                if entry["updated"]:
+                    # Tells running servers without change streams that cached results are stale
+                    await manifests.update_one({"_id": collection_name},
+                                               {"$inc": {"version": 1}, "$set": {"updated_at": datetime.utcnow()}},
+                                               upsert=True)
+            return report
+        finally:
+            connection.close()
+
+    print(json.dumps(asyncio.run(run()), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,283 @@
+"""Schemas for LLM insight responses and a tolerant parser that keeps whatever a completion got right"""
+import ast
+import json
+import re
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError, field_validator
+
+CHART_TYPES = ("bar", "line", "pie", "scatter", "area", "doughnut")
+TRENDS = ("increasing", "decreasing", "stable", "volatile")
+# Prose answers are kept as the insight text, cut to roughly the length the prompts ask for
+MAX_PROSE_CHARS = 1500
+
+FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.S)
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+
+class UnusableOutput(ValueError):
+    """A completion with nothing that can be turned into an insight"""
+
+
+def _as_text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return " ".join(_as_text(v) for v in value)
+    if isinstance(value, dict):
+        return json.dumps(value, default=str)
+    return str(value).strip()
+
+
+def _as_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        value = [value]
+    return [text for text in (_as_text(v) for v in value) if text]
+
+
+def _choice(value: Any, choices: Tuple[str, ...], default: str) -> str:
+    """First allowed word in e.g. "Bar chart" or "Increasing overall"; the default otherwise"""
+    for word in re.findall(r"[a-z]+", _as_text(value).lower()):
+        if word in choices:
+            return word
+    return default
+
+
+class BasicInsight(BaseModel):
+    """Short insight answering a chat query"""
+    insight: str
+    chart_type: str = "bar"
+    key_metrics: List[str] = []
+    anomalies: List[str] = []
+    trend: str = "stable"
+
+    @field_validator("insight", mode="before")
+    @classmethod
+    def _text(cls, value):
+        return _as_text(value)
+
+    @field_validator("key_metrics", "anomalies", mode="before")
+    @classmethod
+    def _lists(cls, value):
+        return _as_list(value)
+
+    @field_validator("chart_type", mode="before")
+    @classmethod
+    def _chart_type(cls, value):
+        return _choice(value, CHART_TYPES, "bar")
+
+    @field_validator("trend", mode="before")
+    @classmethod
+    def _trend(cls, value):
+        return _choice(value, TRENDS, "stable")
+
+
+class EnhancedInsight(BaseModel):
+    """Detailed dataset analysis shown on the insight panels"""
+    insight: str
+    chart_type: str = "bar"
+    key_findings: List[str] = []
+    anomalies: List[str] = []
+    trend: str = "stable"
+    recommendations: List[str] = []
+    comparison_insights: str = ""
+    temporal_analysis: str = ""
+
+    @field_validator("insight", "comparison_insights", "temporal_analysis", mode="before")
+    @classmethod
+    def _text(cls, value):
+        return _as_text(value)
+
+    @field_validator("key_findings", "anomalies", "recommendations", mode="before")
+    @classmethod
+    def _lists(cls, value):
+        return _as_list(value)
+
+    @field_validator("chart_type", mode="before")
+    @classmethod
+    def _chart_type(cls, value):
+        return _choice(value, CHART_TYPES, "bar")
+
+    @field_validator("trend", mode="before")
+    @classmethod
+    def _trend(cls, value):
+        return _choice(value, TRENDS, "stable")
+
+
+def _object_end(text: str, start: int) -> Optional[int]:
+    """Index just past the object opening at `start`, or None if it never closes (truncated output)"""
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+
+def _close(fragment: str) -> List[str]:
+    """Terminate an open string and close open brackets, e.g. after max_tokens cut the output off"""
+    stack, in_string, escaped = [], False, False
+    for char in fragment:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    if in_string:
+        fragment += '"'
+    closers = "".join(reversed(stack))
+    # A dangling separator or a key without its value can't be closed into valid JSON; a bare
+    # trailing string is a list item in arrays but an unfinished key in objects, so try both
+    without_key = re.sub(r'(,|\{)\s*"[^"]*"\s*:\s*$', r"\1", fragment.rstrip())
+    without_string = re.sub(r'(,|\{)\s*"[^"]*"\s*$', r"\1", without_key)
+    return [re.sub(r",\s*$", "", variant) + closers for variant in (without_key, without_string)]
+
+
+def _loads(fragment: str) -> Optional[Dict[str, Any]]:
+    for attempt in (fragment, TRAILING_COMMA.sub(r"\1", fragment)):
+        try:
+            value = json.loads(attempt)
+        except ValueError:
+            continue
+        return value if isinstance(value, dict) else None
+    try:
+        # Python-style dicts: single quotes, True/False/None
+        value = ast.literal_eval(TRAILING_COMMA.sub(r"\1", fragment))
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def extract_json(text: str) -> Optional[Dict[str, Any]]:
+    """
+    The JSON object in a completion that wraps it in prose or code fences, has trailing commas,
+    smart quotes or Python literals, or was truncated mid-object. None if there is no object.
+    """
+    text = text.translate(SMART_QUOTES)
+    candidates = [match.group(1) for match in FENCE.finditer(text)] + [text]
+    for candidate in candidates:
+        start = candidate.find("{")
+        while start != -1:
+            end = _object_end(candidate, start)
+            fragments = [candidate[start:end]] if end is not None else _close(candidate[start:])
+            for fragment in fragments:
+                value = _loads(fragment)
+                if value is not None:
+                    return value
+            if end is None:
+                break
+            start = candidate.find("{", end)
+    return None
+
+
+def salvage_fields(text: str, schema: Type[BaseModel]) -> Dict[str, Any]:
+    """Fields recoverable one by one with regexes when the object as a whole won't parse"""
+    salvaged: Dict[str, Any] = {}
+    for name, field in schema.model_fields.items():
+        key = rf'["\']?{name}["\']?\s*:\s*'
+        if getattr(field.annotation, "__origin__", None) is list:
+            match = re.search(key + r"\[(.*?)(?:\]|$)", text, re.S)
+            if match:
+                items = re.findall(r'"((?:[^"\\]|\\.)*)"', match.group(1))
+                salvaged[name] = [_unescape(item) for item in items]
+        else:
+            match = re.search(key + r'"((?:[^"\\]|\\.)*)', text, re.S)
+            if match:
+                salvaged[name] = _unescape(match.group(1))
+    return salvaged
+
+
+def _unescape(value: str) -> str:
+    try:
+        return json.loads(f'"{value}"')
+    except ValueError:
+        return value
+
+
+class OutputStats:
+    """How completions were turned into results, per schema"""
+
+    def __init__(self):
+        self.outcomes: Counter = Counter()
+        self.defaulted_fields: Counter = Counter()
+        self.unusable = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "outcomes": {f"{schema}.{outcome}": count for (schema, outcome), count in sorted(self.outcomes.items())},
+            "defaulted_fields": dict(self.defaulted_fields),
+            "unusable": self.unusable,
+        }
+
+
+def parse_insight(content: Optional[str], schema: Type[BaseModel],
+                  stats: Optional[OutputStats] = None) -> Tuple[Dict[str, Any], str]:
+    """
+    Validated insight from a completion, as (result, outcome).
+
+    Outcomes, cheapest first: "valid" JSON, "repaired" JSON (fences, prose, truncation),
+    fields "salvaged" individually, or "prose" used as the insight text. Fields the completion
+    lacks or gets wrong take the schema's empty defaults rather than generic filler text.
+    Raises UnusableOutput only when there is no insight text at all.
+    """
+    text = (content or "").strip()
+    data, outcome = None, "valid"
+    try:
+        data = json.loads(text)
+    except ValueError:
+        pass
+    if not isinstance(data, dict):
+        data, outcome = extract_json(text), "repaired"
+    if not data or not _as_text(data.get("insight")):
+        salvaged = salvage_fields(text, schema)
+        if _as_text(salvaged.get("insight")):
+            data, outcome = {**(data or {}), **salvaged}, "salvaged"
+        else:
+            # No structure at all: the model answered in prose, which is still the insight
+            prose = FENCE.sub(lambda m: m.group(1), text)[:MAX_PROSE_CHARS].strip()
+            data, outcome = {**(data or {}), "insight": prose}, "prose"
+    if not _as_text(data.get("insight")):
+        if stats is not None:
+            stats.unusable += 1
+        raise UnusableOutput("Completion has no insight text")
+
+    fields = schema.model_fields
+    present = {name: value for name, value in data.items() if name in fields and value not in (None, "", [])}
+    try:
+        result = schema(**present)
+    except ValidationError as e:
+        # Drop just the fields that don't validate
+        bad = {error["loc"][0] for error in e.errors() if error["loc"]}
+        present = {name: value for name, value in present.items() if name not in bad}
+        result = schema(**present)
+    if stats is not None:
+        stats.outcomes[(schema.__name__, outcome)] += 1
+        for name in fields:
+            if name not in present:
+                stats.defaulted_fields[f"{schema.__name__}.{name}"] += 1
+    return result.dict(), outcome
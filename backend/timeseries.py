@@ -0,0 +1,251 @@
+"""Bucketed time-series storage for daily per-state data, with year-range scans and downsampling"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+from pymongo import ReplaceOne, ASCENDING
+
+from states import state_dimension, document_state_id
+
+INTERVALS = ("day", "week", "month")
+AGGREGATIONS = ("sum", "avg")
+
+# Source fields that identify a day rather than being measured on it
+KEY_FIELDS = ("_id", "state", "state_id", "date")
+
+
+def year_runs(years: Iterable[int]) -> List[Tuple[int, int]]:
+    """Contiguous (first, last) runs of the given years, e.g. [2020, 2021, 2023] -> [(2020, 2021), (2023, 2023)]"""
+    runs: List[Tuple[int, int]] = []
+    for year in sorted(set(int(y) for y in years)):
+        if runs and year == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], year)
+        else:
+            runs.append((year, year))
+    return runs
+
+
+def date_range_query(years: Iterable[int], field: str = "date") -> Dict[str, Any]:
+    """Index-friendly ISO date range condition for a set of years, replacing per-year regex scans"""
+    ranges = [{field: {"$gte": f"{first}-01-01", "$lt": f"{last + 1}-01-01"}} for first, last in year_runs(years)]
+    if not ranges:
+        return {}
+    return ranges[0] if len(ranges) == 1 else {"$or": ranges}
+
+
+def period_of(day: str, interval: str) -> str:
+    """Period label a YYYY-MM-DD day falls in: the day itself, its ISO week's Monday, or YYYY-MM"""
+    if interval == "month":
+        return day[:7]
+    if interval == "week":
+        parsed = date.fromisoformat(day)
+        return (parsed - timedelta(days=parsed.weekday())).isoformat()
+    return day
+
+
+class Downsampler:
+    """Accumulates per-state sums and counts per period and renders them as series"""
+
+    def __init__(self, interval: str, agg: str, fields: List[str]):
+        self.interval = interval
+        self.agg = agg
+        self.fields = fields
+        self._sums: Dict[Tuple[int, str], Dict[str, float]] = defaultdict(lambda: defaultdict(int))
+        self._counts: Dict[Tuple[int, str], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._names: Dict[int, str] = {}
+
+    def add(self, state_id: int, state: str, period: str, values: Dict[str, Any], count: int = 1) -> None:
+        """Add one day's values, or a pre-summed period total covering `count` days"""
+        self._names[state_id] = state
+        key = (state_id, period)
+        for field in self.fields:
+            value = values.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self._sums[key][field] += value
+                self._counts[key][field] += count
+
+    def series(self) -> List[Dict[str, Any]]:
+        points: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        for (state_id, period), sums in sorted(self._sums.items()):
+            point: Dict[str, Any] = {"period": period}
+            for field in self.fields:
+                count = self._counts[(state_id, period)].get(field, 0)
+                if count:
+                    total = sums[field]
+                    point[field] = round(total / count, 3) if self.agg == "avg" else total
+            points[state_id].append(point)
+        return [
+            {"state_id": state_id, "state": self._names[state_id], "points": state_points}
+            for state_id, state_points in sorted(points.items())
+        ]
+
+
+class TimeSeriesStore:
+    """
+    Bucket-per-state-per-month copy of a daily collection.
+
+    Each bucket holds one state's days for one month plus per-field totals, so a year filter
+    is a range scan over at most twelve small documents per state and monthly downsampling
+    never reads the daily values. Buckets are rebuilt from the source collection whenever its
+    data version changes; until a rebuild catches up, reads fall back to the source rows.
+    """
+
+    def __init__(self, database, bucket_database, source: str, versions, rebuild_batch_size: int = 500):
+        self.database = database
+        # Buckets live outside the data database so they are never listed as a dataset
+        self.bucket_database = bucket_database
+        self.source = source
+        self.bucket_name = f"{source}_buckets"
+        self.versions = versions
+        self.rebuild_batch_size = rebuild_batch_size
+        self.built_version: Optional[int] = None
+        self.last_rebuild: Dict[str, Any] = {}
+        self._rebuild_lock = asyncio.Lock()
+
+    @property
+    def buckets(self):
+        return self.bucket_database[self.bucket_name]
+
+    @property
+    def usable(self) -> bool:
+        """Buckets reflect the current source data"""
+        return (self.versions.reliable and self.built_version is not None
+                and self.built_version == self.versions.get(self.source))
+
+    async def rebuild(self) -> int:
+        """Regroup every source row into month buckets and drop buckets that no longer have rows"""
+        async with self._rebuild_lock:
+            return await self._rebuild()
+
+    async def _rebuild(self) -> int:
+        version = self.versions.get(self.source)
+        started = time.perf_counter()
+        generation = time.time_ns()
+        await self.buckets.create_index([("state_id", ASCENDING), ("month", ASCENDING)])
+        await self.buckets.create_index([("year", ASCENDING)])
+
+        buckets: Dict[str, Dict[str, Any]] = {}
+        # A full scan: it runs under the background limit, never the deadline of a request that
+        # happened to trigger it
+        cursor = self.database.background()[self.source].find({"date": {"$type": "string"}})
+        async for row in cursor:
+            state_id = document_state_id(row)
+            if state_id is None:
+                continue
+            day = row["date"][:10]
+            bucket_id = f"{state_id}:{day[:7]}"
+            bucket = buckets.get(bucket_id)
+            if bucket is None:
+                bucket = buckets[bucket_id] = {
+                    "_id": bucket_id, "state_id": state_id, "state": state_dimension.name(state_id),
+                    "year": int(day[:4]), "month": day[:7], "days": {}, "totals": {}, "counts": {},
+                    "generation": generation,
+                }
+            values = {k: v for k, v in row.items() if k not in KEY_FIELDS}
+            bucket["days"][day] = values
+        written = 0
+        operations = []
+        for bucket in buckets.values():
+            for values in bucket["days"].values():
+                for field, value in values.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        bucket["totals"][field] = bucket["totals"].get(field, 0) + value
+                        bucket["counts"][field] = bucket["counts"].get(field, 0) + 1
+            bucket["count"] = len(bucket["days"])
+            operations.append(ReplaceOne({"_id": bucket["_id"]}, bucket, upsert=True))
+            if len(operations) >= self.rebuild_batch_size:
+                await self.buckets.bulk_write(operations, ordered=False)
+                written += len(operations)
+                operations = []
+        if operations:
+            await self.buckets.bulk_write(operations, ordered=False)
+            written += len(operations)
+        await self.buckets.delete_many({"generation": {"$ne": generation}})
+
+        self.built_version = version
+        self.last_rebuild = {
+            "buckets": written,
+            "version": version,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        logging.info(f"Rebuilt {self.bucket_name}: {self.last_rebuild}")
+        return written
+
+    async def follow(self, interval: float = 10) -> None:
+        """Rebuild whenever the source data version moves, at most once per interval"""
+        while True:
+            try:
+                if self.versions.reliable and self.built_version != self.versions.get(self.source):
+                    await self.rebuild()
+            except Exception as e:
+                logging.error(f"Error rebuilding {self.bucket_name}: {e}")
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def bucket_query(state_ids: Optional[List[int]], years: Optional[List[int]]) -> Dict[str, Any]:
+        query: Dict[str, Any] = {}
+        if state_ids:
+            query["state_id"] = {"$in": state_ids}
+        ranges = [{"month": {"$gte": f"{first}-01", "$lte": f"{last}-12"}} for first, last in year_runs(years or [])]
+        if len(ranges) == 1:
+            query.update(ranges[0])
+        elif ranges:
+            query["$or"] = ranges
+        return query
+
+    async def count(self, state_ids: Optional[List[int]], years: Optional[List[int]]) -> int:
+        pipeline = [
+            {"$match": self.bucket_query(state_ids, years)},
+            {"$group": {"_id": None, "rows": {"$sum": "$count"}}},
+        ]
+        result = await self.buckets.aggregate(pipeline).to_list(1)
+        return result[0]["rows"] if result else 0
+
+    async def find_rows(self, state_ids: Optional[List[int]], years: Optional[List[int]], limit: int) -> List[Dict[str, Any]]:
+        """Daily rows shaped like source documents, ordered by state then date"""
+        rows: List[Dict[str, Any]] = []
+        cursor = self.buckets.find(self.bucket_query(state_ids, years), {"_id": 0, "state": 1, "state_id": 1, "days": 1})
+        async for bucket in cursor.sort([("state_id", ASCENDING), ("month", ASCENDING)]):
+            for day in sorted(bucket["days"]):
+                rows.append({"state": bucket["state"], "state_id": bucket["state_id"], "date": day, **bucket["days"][day]})
+                if len(rows) >= limit:
+                    return rows
+        return rows
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"usable": self.usable, "built_version": self.built_version, "last_rebuild": self.last_rebuild}
+
+    async def years(self) -> List[int]:
+        return await self.buckets.distinct("year")
+
+    async def downsample(self, state_ids: Optional[List[int]], years: Optional[List[int]],
+                         interval: str, agg: str, fields: List[str]) -> List[Dict[str, Any]]:
+        sampler = Downsampler(interval, agg, fields)
+        # Monthly series come straight from the bucket totals; finer intervals need the days
+        projection = {"_id": 0, "state": 1, "state_id": 1, "month": 1}
+        projection.update({"totals": 1, "counts": 1} if interval == "month" else {"days": 1})
+        async for bucket in self.buckets.find(self.bucket_query(state_ids, years), projection):
+            if interval == "month":
+                for field in fields:
+                    if field in bucket["totals"]:
+                        sampler.add(bucket["state_id"], bucket["state"], bucket["month"],
+                                    {field: bucket["totals"][field]}, bucket["counts"][field])
+            else:
+                for day, values in bucket["days"].items():
+                    sampler.add(bucket["state_id"], bucket["state"], period_of(day, interval), values)
+        return sampler.series()
+
+
+async def downsample_rows(collection, query: Dict[str, Any], interval: str, agg: str,
+                          fields: List[str]) -> List[Dict[str, Any]]:
+    """Downsample straight from daily source rows; used while buckets are being rebuilt"""
+    sampler = Downsampler(interval, agg, fields)
+    projection = {"_id": 0, "state": 1, "state_id": 1, "date": 1, **{field: 1 for field in fields}}
+    async for row in collection.find(query, projection):
+        state_id = document_state_id(row)
+        if state_id is not None and isinstance(row.get("date"), str):
+            sampler.add(state_id, state_dimension.name(state_id), period_of(row["date"][:10], interval), row)
+    return sampler.series()
@@ -0,0 +1,157 @@
+"""Startup warm-up pipeline and the access log that drives it"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple
+
+from pymongo import UpdateOne
+
+from caching import canonical_key
+
+# Set while the server replays requests itself, such as during warm-up; those aren't client demand
+replaying_access: ContextVar[bool] = ContextVar("replaying_access", default=False)
+
+
+class AccessLog:
+    """Counts requested filter combinations and persists them for the next warm-up"""
+
+    def __init__(self, collection, flush_interval: float = 30):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self._pending: Counter = Counter()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, kind: str, collection_name: str, filters: Dict[str, Any]) -> None:
+        """Count one request in memory; persisted by the next flush. Replayed requests aren't counted."""
+        if replaying_access.get():
+            return
+        key = canonical_key(kind, collection_name, filters)
+        self._pending[key] += 1
+        self._entries[key] = {"kind": kind, "collection": collection_name, "filters": filters}
+
+    @contextmanager
+    def replaying(self):
+        """
+        Run requests without counting them, including in tasks started inside the block;
+        otherwise every warm-up would count its own replays and keep them on top for the next one
+        """
+        token = replaying_access.set(True)
+        try:
+            yield
+        finally:
+            replaying_access.reset(token)
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, entries = self._pending, self._entries
+        self._pending, self._entries = Counter(), {}
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {"_id": key},
+                {"$inc": {"count": count}, "$set": {**entries[key], "last_seen": now}},
+                upsert=True,
+            )
+            for key, count in pending.items()
+        ]
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logging.error(f"Access log flush error: {e}")
+
+    async def run_flusher(self) -> None:
+        """Flush periodically until cancelled"""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        except asyncio.CancelledError:
+            await self.flush()
+            raise
+
+    async def top(self, n: int) -> List[Dict[str, Any]]:
+        """Most requested filter combinations, most frequent first"""
+        cursor = self.collection.find({}, {"_id": 0, "kind": 1, "collection": 1, "filters": 1, "count": 1})
+        return await cursor.sort("count", -1).limit(n).to_list(n)
+
+
+class WarmupState:
+    """Progress of the warm-up pipeline, startup health checks and timings, reported by /api/ready"""
+
+    def __init__(self):
+        self.ready = False
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self.checks: Dict[str, Dict[str, Any]] = {}
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def healthy(self) -> bool:
+        return all(check["ok"] for check in self.checks.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready and self.healthy,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "steps": self.steps,
+            "checks": self.checks,
+            "timings_ms": self.timings,
+        }
+
+
+async def run_check(state: WarmupState, name: str, check: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+                    timeout: float = 10) -> bool:
+    """Run one health check, record its outcome on the state and return whether it passed"""
+    started = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(check(), timeout=timeout)
+        state.checks[name] = {"ok": True, **(result or {})}
+    except Exception as e:
+        logging.error(f"Startup check {name} failed: {e!r}")
+        state.checks[name] = {"ok": False, "error": repr(e)}
+    state.checks[name]["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return state.checks[name]["ok"]
+
+
+async def recheck_until_healthy(state: WarmupState, name: str,
+                                check: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+                                timeout: float = 10, interval: float = 5) -> None:
+    """Retry a failed startup check in the background; /api/ready reports 503 until it passes"""
+    while True:
+        await asyncio.sleep(interval)
+        if await run_check(state, name, check, timeout):
+            logging.info(f"Startup check {name} passed")
+            return
+
+
+async def run_warmup(state: WarmupState, steps: List[Tuple[str, Callable[[], Awaitable[Any]]]],
+                     timeout: float = 300) -> None:
+    """Run warm-up steps in order, then mark the service ready even if some steps failed"""
+    state.started_at = datetime.utcnow()
+
+    async def run_steps():
+        for name, step in steps:
+            started = time.perf_counter()
+            state.steps[name] = {"status": "running"}
+            try:
+                result = await step()
+                state.steps[name] = {"status": "done", "result": result}
+            except Exception as e:
+                logging.error(f"Warm-up step {name} failed: {e}")
+                state.steps[name] = {"status": "failed", "error": str(e)}
+            state.steps[name]["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    try:
+        await asyncio.wait_for(run_steps(), timeout=timeout)
+    except asyncio.TimeoutError:
+        logging.error(f"Warm-up did not finish within {timeout}s, reporting ready anyway")
+    state.finished_at = datetime.utcnow()
+    state.ready = True
+    logging.info(f"Warm-up finished: {state.steps}")
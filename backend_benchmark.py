@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+TRACITY API load-test and latency benchmark.
+
+Seeds a local Mongo stand-in (mongomock by default, or a real mongod via
+--mongo-url) with synthetic crimes, covid_stats, aqi and literacy data, stubs
+OpenAI with a latency-injecting fake and drives every /api endpoint in-process
+under concurrency. Reports throughput, p50/p95/p99 latency and Mongo operations
+per request, and optionally compares the run against a JSON baseline.
+
+Usage:
+    python backend_benchmark.py --rows 10000 --concurrency 16 --requests 100
+    python backend_benchmark.py --mongo-url mongodb://localhost:27017 --rows 10000000
+    python backend_benchmark.py --save-baseline benchmark_baseline.json
+    python backend_benchmark.py --baseline benchmark_baseline.json   # exits 1 on regression
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from contextvars import ContextVar
+from datetime import date, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent
+BACKEND_DIR = ROOT_DIR / "backend"
+
+STATES = [
+    "Andhra Pradesh", "Assam", "Bihar", "Chhattisgarh", "Delhi", "Goa", "Gujarat",
+    "Haryana", "Himachal Pradesh", "Jharkhand", "Karnataka", "Kerala",
+    "Madhya Pradesh", "Maharashtra", "Odisha", "Punjab", "Rajasthan", "Tamil Nadu",
+    "Telangana", "Uttar Pradesh", "Uttarakhand", "West Bengal",
+]
+YEARS = list(range(2001, 2024))
+CRIME_TYPES = ["Murder", "Robbery", "Theft", "Assault", "Fraud", "Kidnapping", "Burglary", "Cyber Crime"]
+COLLECTIONS = ["crimes", "covid_stats", "aqi", "literacy"]
+
+# Mongo operations issued by the current request; a fresh counter is bound per request task
+_mongo_ops: ContextVar[Optional[List[int]]] = ContextVar("mongo_ops", default=None)
+
+COUNTED_OPERATIONS = {
+    "find", "find_one", "count_documents", "estimated_document_count", "distinct",
+    "aggregate", "insert_one", "insert_many", "update_one", "update_many",
+    "replace_one", "delete_one", "delete_many", "bulk_write",
+}
+
+
+def _count_op() -> None:
+    counter = _mongo_ops.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class CountingCollection:
+    """Collection proxy that counts Mongo round-trips for the active request"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._collection, name)
+        if name in COUNTED_OPERATIONS and callable(attr):
+            def counted(*args, **kwargs):
+                _count_op()
+                return attr(*args, **kwargs)
+            return counted
+        return attr
+
+    def __getitem__(self, name: str):
+        return CountingCollection(self._collection[name])
+
+
+class CountingDatabase:
+    """Database proxy handing out CountingCollection wrappers"""
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name: str) -> CountingCollection:
+        return CountingCollection(self._database[name])
+
+    async def list_collection_names(self, *args, **kwargs) -> List[str]:
+        _count_op()
+        return await self._database.list_collection_names(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        return getattr(self._database, name)
+
+
+class FakeCompletions:
+    """Stand-in for openai.chat.completions with injected latency"""
+
+    def __init__(self, latency_ms: float, jitter_ms: float):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.calls = 0
+
+    def create(self, model: str = "", messages: Optional[List[Dict]] = None, **kwargs) -> SimpleNamespace:
+        self.calls += 1
+        delay = max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        time.sleep(delay)  # Called through asyncio.to_thread, like the real client
+        content = json.dumps({
+            "insight": "Synthetic benchmark insight.",
+            "chart_type": "bar",
+            "key_findings": ["Finding 1", "Finding 2", "Finding 3"],
+            "key_metrics": ["count", "average"],
+            "anomalies": [],
+            "trend": "stable",
+            "recommendations": ["Recommendation 1"],
+            "comparison_insights": "States differ.",
+            "temporal_analysis": "Stable over time.",
+        })
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class FakeOpenAI:
+    """Minimal module-shaped replacement for the openai package"""
+
+    def __init__(self, latency_ms: float, jitter_ms: float):
+        self.api_key = "benchmark"
+        self.chat = SimpleNamespace(completions=FakeCompletions(latency_ms, jitter_ms))
+
+
+def generate_documents(collection: str, count: int, rng: random.Random):
+    """Yield synthetic documents shaped like the world_data collections"""
+    covid_start = date(2020, 3, 1)
+    for i in range(count):
+        state = STATES[i % len(STATES)]
+        if collection == "crimes":
+            yield {
+                "state": state,
+                "year": rng.choice(YEARS),
+                "crime_type": rng.choice(CRIME_TYPES),
+                "cases_reported": rng.randint(0, 25000),
+            }
+        elif collection == "covid_stats":
+            day = covid_start + timedelta(days=(i // len(STATES)) % 1200)
+            yield {
+                "state": state,
+                "date": day.isoformat(),
+                "confirmed": rng.randint(0, 50000),
+                "cured": rng.randint(0, 45000),
+                "deaths": rng.randint(0, 900),
+            }
+        elif collection == "aqi":
+            yield {
+                "state": state,
+                "year": rng.choice(YEARS),
+                "avg_aqi": round(rng.uniform(20, 450), 1),
+            }
+        elif collection == "literacy":
+            yield {
+                "state": state,
+                "year": rng.choice(YEARS),
+                "literacy_rate": round(rng.uniform(45, 99), 2),
+            }
+
+
+async def seed_database(database, rows: int, batch_size: int, seed: int) -> None:
+    """Populate each benchmark collection with `rows` synthetic documents"""
+    rng = random.Random(seed)
+    for collection in COLLECTIONS:
+        await database[collection].drop()
+        batch = []
+        started = time.perf_counter()
+        for doc in generate_documents(collection, rows, rng):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                await database[collection].insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            await database[collection].insert_many(batch, ordered=False)
+        print(f"  seeded {collection}: {rows} rows in {time.perf_counter() - started:.1f}s")
+
+
+def build_scenarios(rng: random.Random) -> Dict[str, Callable[[], Dict[str, Any]]]:
+    """Request factories for every /api endpoint, randomized over realistic filters"""
+
+    def pick_states() -> List[str]:
+        return rng.sample(STATES, rng.randint(1, 4))
+
+    def pick_years() -> List[int]:
+        return rng.sample(YEARS[-6:], rng.randint(1, 2))
+
+    def covid_years() -> List[int]:
+        return rng.sample([2020, 2021, 2022, 2023], rng.randint(1, 2))
+
+    def filter_body() -> Dict[str, Any]:
+        collection = rng.choice(COLLECTIONS)
+        body = {
+            "collection": collection,
+            "states": pick_states(),
+            "years": covid_years() if collection == "covid_stats" else pick_years(),
+            "limit": 100,
+        }
+        if collection == "crimes":
+            body["crime_types"] = rng.sample(CRIME_TYPES, 2)
+            body["sort_by"] = "cases_reported"
+            body["sort_order"] = "desc"
+        return body
+
+    def query_params() -> Dict[str, str]:
+        return {"states": ",".join(pick_states()), "years": ",".join(str(y) for y in pick_years())}
+
+    return {
+        "GET /api/": lambda: {"method": "GET", "url": "/api/"},
+        "GET /api/stats": lambda: {"method": "GET", "url": "/api/stats"},
+        "GET /api/datasets": lambda: {"method": "GET", "url": "/api/datasets"},
+        "GET /api/metadata/{collection}": lambda: {
+            "method": "GET", "url": f"/api/metadata/{rng.choice(COLLECTIONS)}"},
+        "POST /api/data/filtered": lambda: {
+            "method": "POST", "url": "/api/data/filtered", "json": filter_body()},
+        "POST /api/insights/enhanced": lambda: {
+            "method": "POST", "url": "/api/insights/enhanced", "json": filter_body()},
+        "POST /api/chat": lambda: {
+            "method": "POST", "url": "/api/chat",
+            "json": {"query": "Compare crime and literacy", "dataset": rng.choice(COLLECTIONS + [None])}},
+        "GET /api/visualize/{collection}": lambda: {
+            "method": "GET", "url": f"/api/visualize/{rng.choice(COLLECTIONS)}",
+            "params": rng.choice([{}, query_params()])},
+        "GET /api/insights/{collection}": lambda: {
+            "method": "GET", "url": f"/api/insights/{rng.choice(COLLECTIONS)}",
+            "params": rng.choice([{}, query_params()])},
+        "GET /api/dashboard/{collection}": lambda: {
+            "method": "GET", "url": f"/api/dashboard/{rng.choice(COLLECTIONS)}",
+            "params": rng.choice([{}, query_params()])},
+        "POST /api/aggregate": lambda: {
+            "method": "POST", "url": "/api/aggregate",
+            "json": {"collection": rng.choice(COLLECTIONS), "states": pick_states(), "group_by": "state",
+                     "agg": "count", "approx": rng.random() < 0.5}},
+        "GET /api/timeseries/{collection}": lambda: {
+            "method": "GET", "url": "/api/timeseries/covid_stats",
+            "params": {"states": ",".join(pick_states()), "years": ",".join(str(y) for y in covid_years()),
+                       "interval": rng.choice(["week", "month"]), "agg": rng.choice(["sum", "avg"])}},
+        "GET /api/correlate": lambda: {
+            "method": "GET", "url": "/api/correlate",
+            "params": rng.choice([{}, {"method": "spearman", "max_lag": 2}, {"states": ",".join(pick_states())}])},
+        "GET /api/forecast/{collection}": lambda: {
+            "method": "GET", "url": f"/api/forecast/{rng.choice(COLLECTIONS)}",
+            "params": {"states": ",".join(pick_states()), "horizon": rng.choice([3, 6, 12]),
+                       "model": rng.choice(["auto", "linear", "ets"])}},
+    }
+
+
+def install_database(server, database, cache_database, use_mongomock: bool) -> None:
+    """Point the server's database handles and caches at the benchmark databases"""
+    from database import Database, DatabaseSettings, WORKLOAD_ANALYTICS, WORKLOAD_PRIMARY
+    from caching import CollectionRegistry, InsightCache
+    from warmup import AccessLog
+    from timeseries import TimeSeriesStore
+    from sampling import SampleStore
+    from profiling import ProfileStore
+    from correlation import CorrelationStore
+    from forecasting import ForecastStore
+    from query_plans import QueryPlanner
+
+    if use_mongomock:
+        # mongomock has neither server-side time limits nor secondaries to read from
+        settings = DatabaseSettings(
+            default_max_time_ms=0,
+            propagate_deadlines=False,
+            read_preferences={WORKLOAD_PRIMARY: "primary", WORKLOAD_ANALYTICS: "primary"},
+        )
+    else:
+        settings = DatabaseSettings.from_env()
+    server.db = Database(CountingDatabase(database), settings)
+    server.analytics_db = server.db.for_workload(WORKLOAD_ANALYTICS)
+    server.cache_db = Database(CountingDatabase(cache_database), settings)
+    server.registry = CollectionRegistry(server.analytics_db, ttl_seconds=server.registry.ttl_seconds)
+    server.insight_cache = InsightCache(server.cache_db["insights"], ttl_seconds=server.insight_cache.ttl_seconds)
+    server.access_log = AccessLog(server.cache_db["access_log"])
+    server.manifests = server.cache_db["dataset_manifests"]
+    server.time_series = {
+        name: TimeSeriesStore(server.db, server.cache_db, name, server.data_versions)
+        for name in server.TIME_SERIES_FIELDS
+    }
+    server.samples = SampleStore(server.analytics_db, server.data_versions, per_stratum=server.samples.per_stratum)
+    server.profiles = ProfileStore(server.analytics_db, server.data_versions)
+    server.correlations = CorrelationStore(server.db, server.profiles, server.data_versions)
+    server.forecasts = ForecastStore(server.data_versions)
+    server.query_planner = QueryPlanner(server.datasets, server.profiles, server.db)
+    server.data_versions.subscribe(server.query_planner.invalidate)
+    # One benchmark client would exhaust its own budget; the limiter is measured separately
+    server.rate_limiter.enabled = False
+    # The seeded data doesn't change during a run, so cached results never go stale
+    server.data_versions.trust_ingest = True
+
+
+async def run_scenario(http_client, make_request: Callable[[], Dict[str, Any]],
+                       total: int, concurrency: int) -> Dict[str, Any]:
+    """Fire `total` requests with at most `concurrency` in flight"""
+    latencies: List[float] = []
+    mongo_ops: List[int] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_request():
+        nonlocal errors
+        async with semaphore:
+            counter = [0]
+            _mongo_ops.set(counter)
+            request = make_request()
+            started = time.perf_counter()
+            try:
+                response = await http_client.request(
+                    request["method"], request["url"],
+                    json=request.get("json"), params=request.get("params"),
+                )
+                if response.status_code >= 500:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+            mongo_ops.append(counter[0])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_request() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "mongo_ops_per_request": round(float(np.mean(mongo_ops)), 2),
+    }
+
+
+def compare_with_baseline(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return a list of regressions relative to the baseline report"""
+    regressions = []
+    for name, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("p95_ms", "p99_ms"):
+            if current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {previous[metric]} -> {current[metric]}")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput_rps {previous['throughput_rps']} -> {current['throughput_rps']}")
+        if current["mongo_ops_per_request"] > previous["mongo_ops_per_request"]:
+            regressions.append(
+                f"{name}: mongo_ops_per_request {previous['mongo_ops_per_request']} -> "
+                f"{current['mongo_ops_per_request']}")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print("\n" + "=" * 96)
+    print(f"📊 BENCHMARK: {report['config']['rows']} rows/collection, "
+          f"concurrency {report['config']['concurrency']}, "
+          f"LLM latency {report['config']['llm_latency_ms']}ms")
+    print("=" * 96)
+    print(f"{'endpoint':<34}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mongo/req':>11}{'errors':>8}")
+    for name, stats in report["endpoints"].items():
+        print(f"{name:<34}{stats['throughput_rps']:>9}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+              f"{stats['p99_ms']:>10}{stats['mongo_ops_per_request']:>11}{stats['errors']:>8}")
+    print("=" * 96)
+
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    # The server module builds its Mongo client at import time, so point it at a
+    # non-SRV address before importing it; the database is swapped out below.
+    os.environ["MONGO_URL"] = args.mongo_url or "mongodb://localhost:27017"
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+    import httpx
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        mongo_client = AsyncIOMotorClient(args.mongo_url)
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        mongo_client = AsyncMongoMockClient()
+    database = mongo_client[args.db_name]
+    cache_database = mongo_client[f"{args.db_name}_cache"]
+    await cache_database.client.drop_database(f"{args.db_name}_cache")
+
+    print(f"🌱 Seeding {'mongod' if args.mongo_url else 'mongomock'} ({args.rows} rows per collection)...")
+    await seed_database(database, args.rows, args.batch_size, args.seed)
+
+    install_database(server, database, cache_database, use_mongomock=not args.mongo_url)
+    fake_openai = FakeOpenAI(args.llm_latency_ms, args.llm_jitter_ms)
+    server.openai = fake_openai
+
+    # Seeded documents are legacy-shaped; run the opt-in state_id migration a deployment would run
+    from states import backfill_state_ids
+    await backfill_state_ids(server.db, COLLECTIONS)
+    if args.warmup:
+        started = time.perf_counter()
+        await server.warm_up()
+        print(f"🔥 Warm-up finished in {time.perf_counter() - started:.1f}s")
+    else:
+        await server.rebuild_time_series()
+
+    rng = random.Random(args.seed)
+    scenarios = build_scenarios(rng)
+    if args.endpoints:
+        scenarios = {name: make for name, make in scenarios.items()
+                     if any(pattern in name for pattern in args.endpoints)}
+
+    transport = httpx.ASGITransport(app=server.app)
+    endpoints = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as http_client:
+        for name, make_request in scenarios.items():
+            print(f"🚀 {name}")
+            endpoints[name] = await run_scenario(http_client, make_request, args.requests, args.concurrency)
+
+    return {
+        "config": {
+            "rows": args.rows,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "llm_latency_ms": args.llm_latency_ms,
+            "backend": "mongod" if args.mongo_url else "mongomock",
+            "warmup": args.warmup,
+        },
+        "endpoints": endpoints,
+        "llm_calls": fake_openai.chat.completions.calls,
+        "insight_cache": server.insight_cache.stats(),
+        "result_cache": server.result_cache.stats(),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="TRACITY API load-test and latency benchmark")
+    parser.add_argument("--rows", type=int, default=10_000, help="Synthetic rows per collection (10k to 10M)")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight per endpoint")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Injected fake OpenAI latency")
+    parser.add_argument("--llm-jitter-ms", type=float, default=50.0, help="Uniform jitter around the LLM latency")
+    parser.add_argument("--mongo-url", help="Use a real mongod instead of mongomock")
+    parser.add_argument("--db-name", default="tracity_benchmark", help="Database to seed and query")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Documents per insert_many while seeding")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for data and request mix")
+    parser.add_argument("--warmup", action="store_true", help="Run the startup warm-up before measuring")
+    parser.add_argument("--endpoints", nargs="*", help="Only run endpoints whose name contains one of these")
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    parser.add_argument("--save-baseline", help="Write the JSON report as the new baseline")
+    parser.add_argument("--baseline", help="Compare against this baseline and exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative latency/throughput drift")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run_benchmark(args))
+    print_report(report)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            Path(path).write_text(json.dumps(report, indent=2) + "\n")
+            print(f"💾 Report written to {path}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare_with_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print("\n❌ Performance regressions against baseline:")
+            for regression in regressions:
+                print(f"- {regression}")
+            return 1
+        print("\n✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
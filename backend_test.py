@@ -12,10 +12,10 @@ class TRACITYAPITester:
         self.tests_passed = 0
         self.test_results = []
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, params=None):
+    def run_test(self, name, method, endpoint, expected_status, data=None, params=None, headers=None):
         """Run a single API test"""
         url = f"{self.base_url}/{endpoint}"
-        headers = {'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json', **(headers or {})}
         
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
@@ -339,6 +339,337 @@ class TestTRACITYAPI(unittest.TestCase):
             if not aqi_found:
                 print("Note: No specific AQI collection found in results, but query was processed")
 
+    def test_08_database_metrics_endpoint(self):
+        """Test the database pool metrics endpoint"""
+        success, response = self.tester.run_test(
+            "Database Metrics",
+            "GET",
+            "metrics/db",
+            200
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertIn("pool", data)
+            self.assertIn("settings", data)
+            self.assertIn("avg_wait_ms", data["pool"])
+            self.assertIn("p99_wait_ms", data["pool"])
+            self.assertGreater(data["settings"]["max_pool_size"], 0)
+            print(f"Pool metrics: {data['pool']}")
+
+    def test_09_ready_endpoint(self):
+        """Test the readiness endpoint reports a finished warm-up"""
+        success, response = self.tester.run_test(
+            "Readiness",
+            "GET",
+            "ready",
+            200
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertTrue(data["ready"])
+            self.assertIn("steps", data)
+            print(f"Warm-up steps: {list(data['steps'].keys())}")
+
+    def test_10_filtered_data_cache(self):
+        """Test that a repeated filter is answered identically from the result cache"""
+        body = {"collection": "crimes", "states": ["Gujarat", "Kerala"], "years": [2020], "limit": 20}
+        first_ok, first = self.tester.run_test("Filtered Data (cold)", "POST", "data/filtered", 200, data=body)
+        body["states"] = ["Kerala", "Gujarat"]
+        second_ok, second = self.tester.run_test("Filtered Data (reordered)", "POST", "data/filtered", 200, data=body)
+        self.assertTrue(first_ok and second_ok)
+        self.assertEqual(first.json()["data"], second.json()["data"])
+        self.assertEqual(first.json()["total_count"], second.json()["total_count"])
+
+        success, response = self.tester.run_test("Cache Metrics", "GET", "metrics/cache", 200)
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertIn("result_cache", data)
+            self.assertIn("insight_cache", data)
+            self.assertIn("data_versions", data)
+            print(f"Result cache: {data['result_cache']}")
+
+    def test_11_dashboard_endpoint(self):
+        """Test the composite dashboard endpoint"""
+        success, response = self.tester.run_test(
+            "Crimes Dashboard",
+            "GET",
+            "dashboard/crimes",
+            200
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertIn("visualization", data)
+            self.assertIn("insights", data)
+            self.assertIn("metadata", data)
+            self.assertGreater(len(data["visualization"]["data"]), 0)
+            self.assertIn("recommended", data["visualization"]["chart_recommendations"])
+            self.assertIn("insight", data["insights"]["insights"])
+            self.assertEqual(data["visualization"]["ai_insights"], data["insights"]["insights"])
+            print(f"Dashboard records: {data['insights']['total_records']}")
+
+    def test_12_ingest_requires_api_key(self):
+        """Test that uploads are refused without the ingest API key"""
+        url = f"{self.tester.base_url}/ingest/crimes"
+        files = {"file": ("crimes.csv", "state,year,crime_type,cases_reported\nKerala,2021,Theft,10\n", "text/csv")}
+        response = requests.post(url, files=files, headers={"X-API-Key": "not-the-key"})
+        print(f"Ingest without valid key: {response.status_code}")
+        self.assertEqual(response.status_code, 403)
+
+    def test_13_state_resolution(self):
+        """Test that aliases and misspellings resolve to the same state code"""
+        success, response = self.tester.run_test(
+            "Resolve States",
+            "GET",
+            "states/resolve",
+            200,
+            params={"names": "Delhi,NCT of Delhi,Gujrat,Orissa"}
+        )
+        self.assertTrue(success)
+        if success:
+            results = response.json()["results"]
+            self.assertEqual(results[0]["id"], results[1]["id"])
+            self.assertEqual(results[2]["name"], "Gujarat")
+            self.assertEqual(results[3]["name"], "Odisha")
+
+    def test_14_covid_time_series(self):
+        """Test monthly downsampling of daily COVID data"""
+        success, response = self.tester.run_test(
+            "COVID Monthly Series",
+            "GET",
+            "timeseries/covid_stats",
+            200,
+            params={"interval": "month", "agg": "sum", "years": "2021"}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertEqual(data["interval"], "month")
+            for series in data["series"]:
+                for point in series["points"]:
+                    self.assertTrue(point["period"].startswith("2021-"))
+            print(f"Series: {len(data['series'])} states from {data['source']}")
+
+    def test_15_downsampled_visualization(self):
+        """Test that a chart width caps the points returned per state"""
+        success, response = self.tester.run_test(
+            "Downsampled COVID Series",
+            "GET",
+            "visualize/covid_stats",
+            200,
+            params={"states": "Delhi", "width": 100, "method": "lttb"}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertLessEqual(len(data["data"]), 100)
+            print(f"Downsampled to {len(data['data'])} points")
+
+    def test_16_aggregate_exact_and_approx(self):
+        """Test grouped aggregation in exact and approximate mode"""
+        body = {"collection": "crimes", "group_by": "state", "agg": "count"}
+        success, response = self.tester.run_test("Exact Aggregate", "POST", "aggregate", 200, data=body)
+        self.assertTrue(success)
+        if success:
+            self.assertFalse(response.json()["approximate"])
+            self.assertGreater(len(response.json()["groups"]), 0)
+
+        body["approx"] = True
+        success, response = self.tester.run_test("Approximate Aggregate", "POST", "aggregate", 200, data=body)
+        self.assertTrue(success)
+        if success and response.json()["approximate"]:
+            for group in response.json()["groups"]:
+                self.assertLessEqual(group["ci_low"], group["value"])
+                self.assertGreaterEqual(group["ci_high"], group["value"])
+
+    def test_17_rate_limit_metrics(self):
+        """Test the rate limiter and LLM admission queue report their state"""
+        success, response = self.tester.run_test("Limit Metrics", "GET", "metrics/limits", 200)
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertIn("llm", data["rate_limits"]["budgets"])
+            self.assertIn("read", data["rate_limits"]["budgets"])
+            self.assertGreater(data["llm_queue"]["concurrency"], 0)
+
+    def test_18_request_deadline(self):
+        """Test a client-supplied deadline cuts a slow request short with 504"""
+        success, _ = self.tester.run_test(
+            "Expired Deadline",
+            "GET",
+            "dashboard/crimes",
+            504,
+            params={"years": "2001,2002,2003"},
+            headers={"X-Request-Timeout-Ms": "1"}
+        )
+        self.assertTrue(success)
+        success, response = self.tester.run_test("Deadline Metrics", "GET", "metrics/limits", 200)
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertGreaterEqual(data["deadlines"]["expired"], 1)
+            self.assertIn("pressure", data["overload"])
+
+    def test_19_column_profile(self):
+        """Test column profiles detect ISO date strings and drive the chart recommendation"""
+        success, response = self.tester.run_test("Column Profile", "GET", "profile/covid_stats", 200)
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            columns = {column["name"]: column for column in data["columns"]}
+            self.assertEqual(columns["date"]["type"], "temporal")
+            self.assertEqual(columns["state"]["role"], "dimension")
+            self.assertEqual(data["recommendation"]["recommended"], "line")
+            self.assertEqual(data["recommendation"]["x_field"], "date")
+
+    def test_20_correlate(self):
+        """Test cross-dataset correlations over the state-year feature matrix"""
+        success, response = self.tester.run_test(
+            "Correlate Datasets",
+            "GET",
+            "correlate",
+            200,
+            params={"features": "crimes.cases_reported,literacy.literacy_rate", "method": "spearman", "max_lag": 1}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertIn("literacy.literacy_rate", data["matrix"]["crimes.cases_reported"])
+            for pair in data["pairs"]:
+                self.assertLessEqual(abs(pair["r"]), 1.0)
+
+    def test_21_forecast(self):
+        """Test per-state forecasts come with ordered prediction intervals"""
+        success, response = self.tester.run_test(
+            "Forecast Crimes",
+            "GET",
+            "forecast/crimes",
+            200,
+            params={"horizon": 3, "model": "linear"}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertEqual(data["interval"], "year")
+            for series in data["series"]:
+                self.assertIn(series["trend"]["direction"], ("increasing", "decreasing", "stable", "unknown"))
+                for point in series["forecast"]:
+                    self.assertLessEqual(point["lower"], point["value"])
+                    self.assertLessEqual(point["value"], point["upper"])
+
+    def test_22_live_updates(self):
+        """Test a live topic subscription answers with its snapshot over the WebSocket"""
+        from websockets.sync.client import connect
+
+        ws_url = self.tester.base_url.replace("https://", "wss://").replace("http://", "ws://") + "/ws"
+        self.tester.tests_run += 1
+        with connect(ws_url) as websocket:
+            websocket.send(json.dumps({"action": "subscribe", "collection": "crimes", "group_by": "state"}))
+            subscribed = json.loads(websocket.recv(timeout=30))
+            snapshot = json.loads(websocket.recv(timeout=30))
+        self.assertEqual(subscribed["type"], "subscribed")
+        self.assertEqual(snapshot["type"], "snapshot")
+        self.assertEqual(snapshot["topic"], subscribed["topic"])
+        self.assertTrue(snapshot["groups"])
+        self.tester.tests_passed += 1
+
+    def test_23_insight_output_schema(self):
+        """Test insights always come back in the structured shape, and parse outcomes are counted"""
+        success, response = self.tester.run_test("Insights For Schema", "GET", "insights/aqi", 200)
+        self.assertTrue(success)
+        if success:
+            insights = response.json()["insights"]
+            self.assertTrue(insights["insight"])
+            self.assertIn(insights["chart_type"], ("bar", "line", "pie", "scatter", "area", "doughnut"))
+            self.assertIsInstance(insights["key_findings"], list)
+        success, response = self.tester.run_test("LLM Output Metrics", "GET", "metrics/llm", 200)
+        self.assertTrue(success)
+        if success:
+            self.assertIn("outcomes", response.json())
+
+    def test_24_insight_routing(self):
+        """Test a simple chat question is answered and the provider routing is reported"""
+        success, response = self.tester.run_test(
+            "Simple Chat Query", "POST", "chat", 200, data={"query": "highest aqi", "dataset": "aqi"}
+        )
+        self.assertTrue(success)
+        if success:
+            self.assertTrue(response.json()["results"][0]["insight"])
+        success, response = self.tester.run_test("Insight Routing Metrics", "GET", "metrics/llm", 200)
+        self.assertTrue(success)
+        if success:
+            routing = response.json()["routing"]
+            self.assertIn("template", routing["providers"])
+            self.assertTrue(routing["providers"]["template"]["available"])
+
+    def test_25_profiling_requires_admin_key(self):
+        """Test profiling flags are ignored and diagnostics refused without the admin key"""
+        success, response = self.tester.run_test(
+            "Profile Flag Without Key", "GET", "datasets", 200, headers={"X-Profile": "sample"}
+        )
+        self.assertTrue(success)
+        if success:
+            self.assertNotIn("x-profile-id", response.headers)
+        success, _ = self.tester.run_test("Flame Graph Without Key", "GET", "admin/flamegraph", 403,
+                                          params={"seconds": 1})
+        self.assertTrue(success)
+
+    def test_26_startup_report(self):
+        """Test readiness reports the Mongo health check and import/startup timings"""
+        success, response = self.tester.run_test("Startup Report", "GET", "ready", 200)
+        self.assertTrue(success)
+        if success:
+            report = response.json()
+            self.assertTrue(report["checks"]["mongo"]["ok"])
+            self.assertIn("import", report["timings_ms"])
+            self.assertIn("lifespan_startup", report["timings_ms"])
+
+    def test_27_dataset_descriptors(self):
+        """Test dataset descriptors describe the time field and special filters per collection"""
+        success, response = self.tester.run_test("Crimes Descriptor", "GET", "datasets/crimes/descriptor", 200)
+        self.assertTrue(success)
+        if success:
+            self.assertEqual(response.json()["special_filters"], {"crime_types": "crime_type"})
+        success, response = self.tester.run_test("COVID Descriptor", "GET", "datasets/covid_stats/descriptor", 200)
+        self.assertTrue(success)
+        if success:
+            self.assertEqual(response.json()["time_type"], "date")
+
+    def test_28_facets_and_search(self):
+        """Test facet counts ignore their own filter and search finds filter values"""
+        success, response = self.tester.run_test(
+            "Crime Facets", "POST", "facets", 200,
+            data={"collection": "crimes", "crime_types": ["Theft"], "facets": ["crime_types"]}
+        )
+        self.assertTrue(success)
+        if success:
+            values = response.json()["facets"]["crime_types"]["values"]
+            self.assertTrue(any(v["value"] == "Theft" and v["selected"] for v in values))
+            self.assertGreater(len(values), 1)
+        success, response = self.tester.run_test("Search", "GET", "search", 200, params={"q": "theft"})
+        self.assertTrue(success)
+        if success:
+            self.assertTrue(any(r["value"] == "Theft" for r in response.json()["results"]))
+
+    def test_29_query_plan_validation(self):
+        """Test filtered queries reject sort and projection fields outside the dataset schema"""
+        success, _ = self.tester.run_test(
+            "Unknown Sort Field", "POST", "data/filtered", 400,
+            data={"collection": "crimes", "sort_by": "no_such_field", "limit": 5}
+        )
+        self.assertTrue(success)
+        success, response = self.tester.run_test(
+            "Projected Rows", "POST", "data/filtered", 200,
+            data={"collection": "crimes", "fields": ["state", "year"], "sort_by": "year", "limit": 5}
+        )
+        self.assertTrue(success)
+        if success:
+            for row in response.json()["data"]:
+                self.assertLessEqual(set(row), {"state", "year"})
+
     @classmethod
     def tearDownClass(cls):
         cls.tester.print_summary()
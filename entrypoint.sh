@@ -9,13 +9,21 @@ echo "Starting FastAPI backend"
 uvicorn server:app --host 0.0.0.0 --port 8001 &
 BACKEND_PID=$!
 
-echo "Waiting for backend to start..."
-sleep 30
-
-if ! kill -0 $BACKEND_PID 2>/dev/null; then
-    echo "Backend failed to start at initialization, exiting"
-    exit 1
-fi
+echo "Waiting for backend warm-up to finish..."
+READY_TIMEOUT=${READY_TIMEOUT:-300}
+WAITED=0
+until wget -q -O /dev/null http://127.0.0.1:8001/api/ready 2>/dev/null; do
+    if ! kill -0 $BACKEND_PID 2>/dev/null; then
+        echo "Backend failed to start at initialization, exiting"
+        exit 1
+    fi
+    if [ "$WAITED" -ge "$READY_TIMEOUT" ]; then
+        echo "Backend not ready after ${READY_TIMEOUT}s, starting nginx anyway"
+        break
+    fi
+    sleep 1
+    WAITED=$((WAITED + 1))
+done
 
 # Start Nginx
 nginx -g 'daemon off;' &
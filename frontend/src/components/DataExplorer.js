@@ -26,7 +26,11 @@ const DataExplorer = () => {
 
   useEffect(() => {
     if (selectedDataset) {
-      fetchMetadata(selectedDataset.collection);
+      // Reset filters when changing datasets; metadata arrives with the dashboard response
+      setSelectedStates([]);
+      setSelectedYears([]);
+      setSelectedCrimeTypes([]);
+      setSortBy('');
     }
   }, [selectedDataset]);
 
@@ -68,63 +72,28 @@ const DataExplorer = () => {
     }
   };
 
-  const fetchMetadata = async (collection) => {
-    try {
-      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/metadata/${collection}`);
-      if (response.ok) {
-        const data = await response.json();
-        setMetadata(data);
-        // Reset filters when changing datasets
-        setSelectedStates([]);
-        setSelectedYears([]);
-        setSelectedCrimeTypes([]);
-        setSortBy('');
-      } else {
-        console.error('Error fetching metadata: Server returned', response.status);
-        // Set default metadata if the API fails
-        const defaultMetadata = {
-          available_states: [
-            'Andhra Pradesh', 'Arunachal Pradesh', 'Assam', 'Bihar', 'Chhattisgarh',
-            'Goa', 'Gujarat', 'Haryana', 'Himachal Pradesh', 'Jharkhand',
-            'Karnataka', 'Kerala', 'Madhya Pradesh', 'Maharashtra', 'Manipur',
-            'Meghalaya', 'Mizoram', 'Nagaland', 'Odisha', 'Punjab',
-            'Rajasthan', 'Sikkim', 'Tamil Nadu', 'Telangana', 'Tripura',
-            'Uttar Pradesh', 'Uttarakhand', 'West Bengal', 'Delhi', 'Jammu and Kashmir'
-          ],
-          available_years: ['2018', '2019', '2020', '2021', '2022'],
-          available_fields: ['state', 'year', 'cases_reported'],
-          special_filters: collection === 'crimes' ? {
-            crime_types: ['Murder', 'Robbery', 'Theft', 'Assault', 'Fraud']
-          } : {}
-        };
-        setMetadata(defaultMetadata);
-      }
-    } catch (error) {
-      console.error('Error fetching metadata:', error);
-      // Set default metadata if the API fails
-      const defaultMetadata = {
-        available_states: [
-          'Andhra Pradesh', 'Arunachal Pradesh', 'Assam', 'Bihar', 'Chhattisgarh',
-          'Goa', 'Gujarat', 'Haryana', 'Himachal Pradesh', 'Jharkhand',
-          'Karnataka', 'Kerala', 'Madhya Pradesh', 'Maharashtra', 'Manipur',
-          'Meghalaya', 'Mizoram', 'Nagaland', 'Odisha', 'Punjab',
-          'Rajasthan', 'Sikkim', 'Tamil Nadu', 'Telangana', 'Tripura',
-          'Uttar Pradesh', 'Uttarakhand', 'West Bengal', 'Delhi', 'Jammu and Kashmir'
-        ],
-        available_years: ['2018', '2019', '2020', '2021', '2022'],
-        available_fields: ['state', 'year', 'cases_reported'],
-        special_filters: collection === 'crimes' ? {
-          crime_types: ['Murder', 'Robbery', 'Theft', 'Assault', 'Fraud']
-        } : {}
-      };
-      setMetadata(defaultMetadata);
-    }
-  };
+  // Default metadata used when the API fails
+  const getDefaultMetadata = (collection) => ({
+    available_states: [
+      'Andhra Pradesh', 'Arunachal Pradesh', 'Assam', 'Bihar', 'Chhattisgarh',
+      'Goa', 'Gujarat', 'Haryana', 'Himachal Pradesh', 'Jharkhand',
+      'Karnataka', 'Kerala', 'Madhya Pradesh', 'Maharashtra', 'Manipur',
+      'Meghalaya', 'Mizoram', 'Nagaland', 'Odisha', 'Punjab',
+      'Rajasthan', 'Sikkim', 'Tamil Nadu', 'Telangana', 'Tripura',
+      'Uttar Pradesh', 'Uttarakhand', 'West Bengal', 'Delhi', 'Jammu and Kashmir'
+    ],
+    available_years: ['2018', '2019', '2020', '2021', '2022'],
+    available_fields: ['state', 'year', 'cases_reported'],
+    special_filters: collection === 'crimes' ? {
+      crime_types: ['Murder', 'Robbery', 'Theft', 'Assault', 'Fraud']
+    } : {}
+  });
 
   const fetchVisualizationData = async (collection, useFilters = false) => {
     setIsFiltering(useFilters);
     try {
-      let url = `${process.env.REACT_APP_BACKEND_URL}/api/visualize/${collection}`;
+      // One request returns visualization data, insights and metadata for the view
+      let url = `${process.env.REACT_APP_BACKEND_URL}/api/dashboard/${collection}`;
       
       if (useFilters && (selectedStates.length > 0 || selectedYears.length > 0)) {
         const params = new URLSearchParams();
@@ -140,30 +109,22 @@ const DataExplorer = () => {
         url += '?limit=200';
       }
 
-      const [vizResponse, insightsResponse] = await Promise.all([
-        fetch(url),
-        fetch(`${process.env.REACT_APP_BACKEND_URL}/api/insights/${collection}`)
-      ]);
+      const response = await fetch(url);
 
-      if (vizResponse.ok) {
-        const vizData = await vizResponse.json();
-        setVisualizationData(vizData);
-        setChartType(vizData.chart_recommendations?.recommended || 'bar');
+      if (response.ok) {
+        const dashboard = await response.json();
+        setVisualizationData(dashboard.visualization);
+        setChartType(dashboard.visualization.chart_recommendations?.recommended || 'bar');
+        setInsights(dashboard.insights);
+        setMetadata(dashboard.metadata);
       } else {
-        console.error('Error fetching visualization data: Server returned', vizResponse.status);
-        // Set default visualization data
+        console.error('Error fetching dashboard data: Server returned', response.status);
+        // Set default visualization data, metadata and insights
         setVisualizationData({
           data: generateDefaultData(collection),
           chart_recommendations: { recommended: 'bar' }
         });
-      }
-
-      if (insightsResponse.ok) {
-        const insightsData = await insightsResponse.json();
-        setInsights(insightsData);
-      } else {
-        console.error('Error fetching insights: Server returned', insightsResponse.status);
-        // Set default insights
+        setMetadata(getDefaultMetadata(collection));
         setInsights({
           insights: {
             insight: 'Analysis of data shows various patterns across Indian states. The data provides valuable insights into regional variations and trends over time.',
@@ -186,12 +147,13 @@ const DataExplorer = () => {
         });
       }
     } catch (error) {
-      console.error('Error fetching visualization data:', error);
-      // Set default visualization data and insights
+      console.error('Error fetching dashboard data:', error);
+      // Set default visualization data, metadata and insights
       setVisualizationData({
         data: generateDefaultData(collection),
         chart_recommendations: { recommended: 'bar' }
       });
+      setMetadata(getDefaultMetadata(collection));
       setInsights({
         insights: {
           insight: 'Analysis of data shows various patterns across Indian states. The data provides valuable insights into regional variations and trends over time.',
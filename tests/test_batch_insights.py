@@ -0,0 +1,98 @@
+import asyncio
+import unittest
+
+from mongomock_motor import AsyncMongoMockClient
+
+from batch_insights import BatchCheckpoint, Pacer, run_batch
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def combinations(n):
+    return [{"kind": "insights", "collection": "crimes", "states": [f"S{i}"], "years": None} for i in range(n)]
+
+
+def key_for(combination):
+    return combination["states"][0]
+
+
+class RunBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.database = AsyncMongoMockClient()["tracity_cache"]
+
+    def checkpoint(self, job_id="nightly"):
+        return BatchCheckpoint(self.database["insight_batch_items"], self.database["insight_batch_jobs"], job_id)
+
+    def test_resumed_batch_skips_finished_combinations(self):
+        calls = []
+
+        async def generate(combination, pace):
+            await pace()
+            calls.append(key_for(combination))
+            if key_for(combination) == "S2" and calls.count("S2") == 1:
+                raise RuntimeError("LLM unavailable")
+            return "generated"
+
+        async def run():
+            first = await run_batch(combinations(4), key_for, generate, self.checkpoint(), Pacer(6000, burst=10),
+                                    retries=0, base_delay=0)
+            # Interrupted job is rerun under the same id
+            second = await run_batch(combinations(4), key_for, generate, self.checkpoint(), Pacer(6000, burst=10),
+                                     retries=0, base_delay=0)
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual((first.generated, first.failed, first.skipped), (3, 1, 0))
+        self.assertEqual((second.generated, second.failed, second.skipped), (1, 0, 3))
+        self.assertEqual(sorted(calls), ["S0", "S1", "S2", "S2", "S3"])
+
+    def test_restart_ignores_the_checkpoint(self):
+        async def generate(combination, pace):
+            return "cached"
+
+        async def run():
+            await run_batch(combinations(2), key_for, generate, self.checkpoint(), Pacer(6000))
+            return await run_batch(combinations(2), key_for, generate, self.checkpoint(), Pacer(6000), resume=False)
+
+        stats = asyncio.run(run())
+        self.assertEqual((stats.cached, stats.skipped), (2, 0))
+
+    def test_failure_recorded_once_retries_run_out(self):
+        attempts = []
+        pacer = Pacer(6000, burst=10)
+
+        async def generate(combination, pace):
+            attempts.append(key_for(combination))
+            raise RateLimitError("slow down")
+
+        async def run():
+            stats = await run_batch(combinations(1), key_for, generate, self.checkpoint(), pacer,
+                                    retries=2, base_delay=0)
+            item = await self.database["insight_batch_items"].find_one({"_id": "nightly:S0"})
+            job = await self.database["insight_batch_jobs"].find_one({"_id": "nightly"})
+            return stats, item, job
+
+        stats, item, job = asyncio.run(run())
+        self.assertEqual(attempts, ["S0"] * 3)
+        self.assertEqual((stats.failed, stats.retries, stats.rate_limited), (1, 2, 3))
+        self.assertEqual((item["status"], item["attempts"]), ("failed", 3))
+        self.assertIn("slow down", item["error"])
+        self.assertEqual(job["stats"]["failed"], 1)
+        # Each 429 halved the pace, down to the floor
+        self.assertLess(pacer.requests_per_minute, 6000 / 4)
+
+
+class PacerTest(unittest.TestCase):
+    def test_rate_halves_on_rate_limit_and_recovers_on_success(self):
+        pacer = Pacer(60)
+        pacer.rate_limited(retry_after=0)
+        self.assertEqual(pacer.requests_per_minute, 30)
+        for _ in range(20):
+            pacer.succeeded()
+        self.assertEqual(pacer.requests_per_minute, 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from caching import DataVersions, ResultCache
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.versions = DataVersions(trust_ingest=True)
+        self.cache = ResultCache(self.versions)
+        self.versions.subscribe(self.cache.invalidate)
+
+    def test_result_served_while_version_unchanged(self):
+        version = self.versions.get("crimes")
+        self.cache.set("k", "crimes", {"total": 1}, version)
+        self.assertEqual(self.cache.get("k", "crimes"), {"total": 1})
+
+    def test_result_not_stored_when_version_moved_during_query(self):
+        version = self.versions.get("crimes")
+        # A change stream event lands while the query runs
+        self.versions.bump("crimes")
+        self.cache.set("k", "crimes", {"total": 1}, version)
+        self.assertIsNone(self.cache.get("k", "crimes"))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_bump_invalidates_stored_result(self):
+        self.cache.set("k", "crimes", {"total": 1}, self.versions.get("crimes"))
+        self.versions.bump("crimes")
+        self.assertIsNone(self.cache.get("k", "crimes"))
+
+    def test_cache_reports_itself_disabled_without_a_version_source(self):
+        versions = DataVersions()
+        cache = ResultCache(versions)
+        cache.set("k", "crimes", {"total": 1}, versions.get("crimes"))
+        self.assertIsNone(cache.get("k", "crimes"))
+        self.assertEqual((cache.stats()["enabled"], cache.stats()["version_source"]), (False, None))
+        self.assertEqual(self.cache.stats()["version_source"], "ingest")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import asyncio
+import unittest
+
+from concurrency import run_stages
+
+
+class RunStagesTest(unittest.TestCase):
+    def test_stages_receive_dependency_results_in_order(self):
+        finished = []
+
+        def stage(name, value):
+            async def run(*arguments):
+                finished.append(name)
+                return value(*arguments)
+            return run
+
+        results = asyncio.run(run_stages({
+            "report": (stage("report", lambda rows, total: f"{len(rows)} of {total}"), ["rows", "total"]),
+            "rows": (stage("rows", lambda query: [query] * 3), ["query"]),
+            "total": (stage("total", lambda query: 10), ["query"]),
+            "query": (stage("query", lambda: "q"), []),
+        }))
+        self.assertEqual(results, {"report": "3 of 10", "rows": ["q", "q", "q"], "total": 10, "query": "q"})
+        self.assertEqual(finished[0], "query")
+        self.assertEqual(finished[-1], "report")
+
+    def test_independent_stages_run_concurrently(self):
+        async def run():
+            both_started = asyncio.Event()
+            started = []
+
+            def stage(name):
+                async def wait():
+                    started.append(name)
+                    if len(started) == 2:
+                        both_started.set()
+                    # Deadlocks unless the other stage is running at the same time
+                    await asyncio.wait_for(both_started.wait(), timeout=1)
+                    return name
+                return wait
+
+            return await run_stages({"a": (stage("a"), []), "b": (stage("b"), [])})
+
+        self.assertEqual(asyncio.run(run()), {"a": "a", "b": "b"})
+
+    def test_failure_cancels_running_siblings(self):
+        cancelled = []
+        dependent_ran = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append("slow")
+                raise
+
+        async def failing():
+            await asyncio.sleep(0)
+            raise RuntimeError("query failed")
+
+        async def dependent(value):
+            dependent_ran.append(value)
+
+        with self.assertRaisesRegex(RuntimeError, "query failed"):
+            asyncio.run(run_stages({
+                "slow": (slow, []),
+                "failing": (failing, []),
+                "dependent": (dependent, ["failing"]),
+            }))
+        self.assertEqual(cancelled, ["slow"])
+        self.assertEqual(dependent_ran, [])
+
+    def test_rejects_cycles_and_unknown_dependencies(self):
+        async def noop(*arguments):
+            return None
+
+        with self.assertRaisesRegex(ValueError, "cycle"):
+            asyncio.run(run_stages({"a": (noop, ["b"]), "b": (noop, ["a"])}))
+        with self.assertRaisesRegex(ValueError, "unknown stage 'missing'"):
+            asyncio.run(run_stages({"a": (noop, ["missing"])}))
+
+
+if __name__ == "__main__":
+    unittest.main()
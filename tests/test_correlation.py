@@ -0,0 +1,37 @@
+import asyncio
+import time
+import unittest
+
+from mongomock_motor import AsyncMongoMockClient
+
+from caching import DataVersions
+from correlation import CorrelationStore
+from database import Database, DatabaseSettings
+from deadlines import current_deadline
+from profiling import ProfileStore
+from .test_sampling import RecordingDatabase
+
+
+class CorrelationStoreTest(unittest.TestCase):
+    def test_matrix_build_ignores_the_requesting_deadline(self):
+        raw = AsyncMongoMockClient()["world_data"]
+        database = RecordingDatabase(raw)
+
+        async def run():
+            await raw["literacy"].insert_many([{"state": "Kerala", "year": 2000 + i, "literacy_rate": 90.0 + i / 10}
+                                               for i in range(10)])
+            versions = DataVersions(trust_ingest=True)
+            analytics = Database(database, DatabaseSettings(background_max_time_ms=60000))
+            store = CorrelationStore(analytics, ProfileStore(analytics, versions), versions, collections=["literacy"])
+            current_deadline.set(time.monotonic() - 1)
+            return await store.load()
+
+        matrix = asyncio.run(run())
+        # The profile scan and the state-year aggregate both ran under the background limit
+        self.assertEqual(database.limits, [60000, 60000])
+        self.assertEqual(matrix.names, ["literacy.literacy_rate"])
+        self.assertEqual(len(matrix.keys), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
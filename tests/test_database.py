@@ -0,0 +1,83 @@
+import asyncio
+import time
+import unittest
+
+from database import Database, DatabaseSettings, ManagedCollection
+from deadlines import create_background_task, current_deadline, detached
+
+
+class RecordingCollection:
+    name = "crimes"
+
+    def __init__(self):
+        self.calls = []
+
+    def find(self, filter, projection, **kwargs):
+        self.calls.append(kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        self.calls.append(kwargs)
+
+
+class RecordingDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = RecordingCollection()
+        return collection
+
+
+class TimeLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.raw = RecordingDatabase()
+        self.database = Database(self.raw, DatabaseSettings(default_max_time_ms=5000, background_max_time_ms=60000))
+        self.token = current_deadline.set(time.monotonic() + 0.5)
+
+    def tearDown(self):
+        current_deadline.reset(self.token)
+
+    def test_request_reads_are_bounded_by_the_deadline(self):
+        self.database["crimes"].find({})
+        self.assertLessEqual(self.raw["crimes"].calls[-1]["max_time_ms"], 500)
+
+    def test_explicit_none_runs_unbounded(self):
+        self.database["crimes"].aggregate([], maxTimeMS=None)
+        self.assertNotIn("maxTimeMS", self.raw["crimes"].calls[-1])
+
+    def test_background_reads_ignore_the_request_deadline(self):
+        self.database.background()["crimes"].find({})
+        self.assertEqual(self.raw["crimes"].calls[-1]["max_time_ms"], 60000)
+        self.database.background()["crimes"].aggregate([])
+        self.assertEqual(self.raw["crimes"].calls[-1]["maxTimeMS"], 60000)
+
+    def test_unbounded_background_limit(self):
+        collection = ManagedCollection(RecordingCollection(), None)
+        collection.find({})
+        self.assertEqual(collection._collection.calls[-1], {})
+
+
+class DetachedTest(unittest.TestCase):
+    def test_detached_clears_deadline(self):
+        token = current_deadline.set(time.monotonic() + 1)
+        try:
+            with detached():
+                self.assertIsNone(current_deadline.get())
+            self.assertIsNotNone(current_deadline.get())
+        finally:
+            current_deadline.reset(token)
+
+    def test_background_task_does_not_inherit_deadline(self):
+        async def deadline():
+            return current_deadline.get()
+
+        async def run():
+            current_deadline.set(time.monotonic() + 1)
+            inherited = await asyncio.create_task(deadline())
+            background = await create_background_task(deadline())
+            return inherited, background
+
+        inherited, background = asyncio.run(run())
+        self.assertIsNotNone(inherited)
+        self.assertIsNone(background)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import asyncio
+import unittest
+
+from deadlines import DeadlineMiddleware, DeadlinePolicy
+
+
+def post_scope():
+    return {"type": "http", "method": "POST", "path": "/api/chat",
+            "headers": [(b"content-type", b"application/json"), (b"content-length", b"11")]}
+
+
+class DeadlineMiddlewareTest(unittest.TestCase):
+    def test_disconnect_cancels_a_handler_that_has_read_its_body(self):
+        policy = DeadlinePolicy([], default_timeout=30)
+        state = {"body": b"", "cancelled": False}
+
+        async def app(scope, receive, send):
+            while True:
+                message = await receive()
+                state["body"] += message.get("body", b"")
+                if not message.get("more_body", False):
+                    break
+            try:
+                # Stands in for a Mongo or LLM wait that never asks for another message
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+
+        async def run():
+            incoming = asyncio.Queue()
+            for message in ({"type": "http.request", "body": b"{\"q\":", "more_body": True},
+                            {"type": "http.request", "body": b" \"x\"}"}):
+                incoming.put_nowait(message)
+
+            async def send(message):
+                raise AssertionError("nothing should be sent to a disconnected client")
+
+            call = asyncio.ensure_future(DeadlineMiddleware(app, policy)(post_scope(), incoming.get, send))
+            await asyncio.sleep(0.01)
+            incoming.put_nowait({"type": "http.disconnect"})
+            await asyncio.wait_for(call, 1)
+
+        asyncio.run(run())
+        self.assertEqual(state["body"], b"{\"q\": \"x\"}")
+        self.assertTrue(state["cancelled"])
+        self.assertEqual(policy.disconnected, 1)
+
+    def test_disconnect_before_the_body_is_read_cancels_the_handler(self):
+        policy = DeadlinePolicy([], default_timeout=30)
+        started = []
+
+        async def app(scope, receive, send):
+            started.append(True)
+            await asyncio.sleep(30)
+            await receive()
+
+        async def run():
+            incoming = asyncio.Queue()
+            incoming.put_nowait({"type": "http.disconnect"})
+            await asyncio.wait_for(DeadlineMiddleware(app, policy)(post_scope(), incoming.get, None), 1)
+
+        asyncio.run(run())
+        self.assertEqual(started, [True])
+        self.assertEqual(policy.disconnected, 1)
+
+    def test_completed_response_is_not_counted_as_a_disconnect(self):
+        policy = DeadlinePolicy([], default_timeout=30)
+        sent = []
+
+        async def app(scope, receive, send):
+            await receive()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        async def run():
+            incoming = asyncio.Queue()
+            incoming.put_nowait({"type": "http.request", "body": b"{}"})
+            incoming.put_nowait({"type": "http.disconnect"})
+
+            async def send(message):
+                sent.append(message["type"])
+
+            await asyncio.wait_for(DeadlineMiddleware(app, policy)(post_scope(), incoming.get, send), 1)
+
+        asyncio.run(run())
+        self.assertEqual(sent, ["http.response.start", "http.response.body"])
+        self.assertEqual(policy.disconnected, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
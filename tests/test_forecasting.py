@@ -0,0 +1,51 @@
+import unittest
+
+from forecasting import ForecastFit, align_series
+
+
+def monthly(state_id, values, start_month=1):
+    return {"state_id": state_id, "state": f"State {state_id}",
+            "points": [{"period": f"2023-{start_month + i:02d}", "cases": v} for i, v in enumerate(values)]}
+
+
+class ForecastFitTest(unittest.TestCase):
+    def setUp(self):
+        # State 2 stops reporting three months before state 1
+        self.aligned = align_series([
+            monthly(1, [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]),
+            monthly(2, [5, 6, 7, 8, 9, 10, 11, 12, 13]),
+        ], "cases")
+
+    def forecasts(self, model, horizon=2):
+        fit = ForecastFit(self.aligned, "month", model)
+        return {entry["state_id"]: entry for entry in fit.forecast(horizon)}
+
+    def test_horizon_starts_after_each_states_last_period(self):
+        for model in ("linear", "ets"):
+            series = self.forecasts(model)
+            self.assertEqual(series[1]["last_period"], "2023-12")
+            self.assertEqual([p["period"] for p in series[1]["forecast"]], ["2024-01", "2024-02"])
+            self.assertEqual(series[2]["last_period"], "2023-09")
+            self.assertEqual([p["period"] for p in series[2]["forecast"]], ["2023-10", "2023-11"], model)
+
+    def test_linear_extrapolates_from_the_states_own_end(self):
+        series = self.forecasts("linear")
+        self.assertAlmostEqual(series[2]["forecast"][0]["value"], 14)
+        self.assertAlmostEqual(series[1]["forecast"][0]["value"], 13)
+
+    def test_seasonal_naive_keeps_the_season_phase(self):
+        aligned = align_series([
+            {"state_id": 1, "state": "A", "points": [{"period": f"{2022 + i // 12}-{i % 12 + 1:02d}", "cases": i % 12}
+                                                     for i in range(24)]},
+            {"state_id": 2, "state": "B", "points": [{"period": f"{2022 + i // 12}-{i % 12 + 1:02d}", "cases": i % 12}
+                                                     for i in range(20)]},
+        ], "cases")
+        series = {e["state_id"]: e for e in ForecastFit(aligned, "month", "seasonal_naive").forecast(3)}
+        # State 2's data ends in August 2023, so September follows with September's value
+        self.assertEqual([p["period"] for p in series[2]["forecast"]], ["2023-09", "2023-10", "2023-11"])
+        self.assertEqual([p["value"] for p in series[2]["forecast"]], [8, 9, 10])
+        self.assertEqual([p["value"] for p in series[1]["forecast"]], [0, 1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
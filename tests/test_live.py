@@ -0,0 +1,53 @@
+import asyncio
+import json
+import unittest
+
+from fastapi import WebSocketDisconnect
+
+from caching import DataVersions
+from live import LiveHub, serve_connection
+
+
+class FakeWebSocket:
+    def __init__(self, messages):
+        self.incoming = [json.dumps(message) for message in messages]
+        self.sent = []
+
+    async def receive_text(self):
+        if self.incoming:
+            return self.incoming.pop(0)
+        # Let the writer drain the replies before the client goes away
+        await asyncio.sleep(0.05)
+        raise WebSocketDisconnect()
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+
+class ServeConnectionTest(unittest.TestCase):
+    def test_subscribes_beyond_the_budget_are_refused(self):
+        budget = [0.0, 0.0, 12.5]
+        topics = []
+
+        async def make_topic(request):
+            topics.append(request["collection"])
+            raise ValueError("unknown collection")
+
+        async def run():
+            async def compute(spec):
+                return {}
+
+            hub = LiveHub(DataVersions(trust_ingest=True), compute)
+            websocket = FakeWebSocket([{"action": "subscribe", "collection": name} for name in ("a", "b", "c")])
+            await serve_connection(websocket, hub, make_topic, throttle=lambda: budget.pop(0))
+            return websocket.sent
+
+        sent = asyncio.run(run())
+        self.assertEqual(topics, ["a", "b"])
+        self.assertEqual([message["detail"] for message in sent],
+                         ["unknown collection", "unknown collection",
+                          "Rate limit exceeded for subscriptions; retry in 13s"])
+
+
+if __name__ == "__main__":
+    unittest.main()
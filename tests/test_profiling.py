@@ -0,0 +1,50 @@
+import asyncio
+import time
+import unittest
+
+from mongomock_motor import AsyncMongoMockClient
+
+from caching import DataVersions
+from database import Database, DatabaseSettings
+from deadlines import current_deadline
+from profiling import ProfileStore, profile_rows
+from .test_sampling import RecordingDatabase
+
+
+class ProfileStoreTest(unittest.TestCase):
+    def test_build_outlives_the_request_that_started_it(self):
+        raw = AsyncMongoMockClient()["world_data"]
+        database = RecordingDatabase(raw)
+
+        async def run():
+            await raw["literacy"].insert_many([{"state": "Kerala", "year": 2000 + i, "literacy_rate": 90.0 + i / 10}
+                                               for i in range(20)])
+            store = ProfileStore(Database(database, DatabaseSettings(background_max_time_ms=60000)),
+                                 DataVersions(trust_ingest=True))
+            request = asyncio.create_task(self._request(store))
+            await asyncio.sleep(0)
+            request.cancel()
+            await asyncio.gather(request, return_exceptions=True)
+            # The shielded build carries on without the request's deadline
+            return await store._builds["literacy"]
+
+        profile = asyncio.run(run())
+        self.assertEqual(database.limits, [60000])
+        self.assertEqual(profile["rows"], 20)
+
+    @staticmethod
+    async def _request(store):
+        current_deadline.set(time.monotonic() + 0.001)
+        return await store.load("literacy")
+
+    def test_string_years_are_a_yearly_time_axis(self):
+        profile = profile_rows([{"year": str(2000 + i), "code": f"{i:04d}"} for i in range(10)])
+        columns = {column["name"]: column for column in profile["columns"]}
+        self.assertEqual(columns["year"]["type"], "temporal")
+        self.assertEqual(columns["year"]["granularity"], "year")
+        # Four-digit codes outside the year range stay categorical
+        self.assertEqual(columns["code"]["type"], "categorical")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import asyncio
+import time
+import unittest
+
+from mongomock_motor import AsyncMongoMockClient
+
+from database import Database, DatabaseSettings
+from datasets import DatasetRegistry
+from deadlines import current_deadline
+from query_plans import QueryPlanner
+
+
+class QueryPlannerTest(unittest.TestCase):
+    def test_plans_never_build_indexes_on_the_request_path(self):
+        raw = AsyncMongoMockClient()["world_data"]
+        datasets = DatasetRegistry()
+        planner = QueryPlanner(datasets, profiles=None, database=Database(raw, DatabaseSettings()))
+        query = {"state_id": {"$in": [17]}, "year": {"$in": [2020]}}
+
+        async def run():
+            # A request with almost no time left
+            current_deadline.set(time.monotonic() + 0.01)
+            first = await planner.plan("crimes", query, sort_by="year")
+            self.assertIsNone(datasets.built_indexes("crimes"))
+            await datasets._index_builds["crimes"]
+            second = await planner.plan("crimes", query, sort_by="year")
+            return first, second, await raw["crimes"].index_information()
+
+        first, second, indexes = asyncio.run(run())
+        self.assertFalse(first.index_ready)
+        self.assertIsNone(first.hint)
+        self.assertTrue(second.index_ready)
+        self.assertEqual(second.hint, [(field, 1) for field in second.index])
+        self.assertIn("state_id_1_year_1_crime_type_1_cases_reported_1", indexes)
+        # Only the plan compiled against built indexes is kept
+        self.assertEqual(planner.compiled, 2)
+        self.assertEqual(len(planner.snapshot()["plans"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+import uuid
+
+from ratelimit import RateLimiter, BUDGET_READ, client_identity
+
+
+class ClientIdentityTest(unittest.TestCase):
+    def test_configured_key_identifies_client(self):
+        identity = client_identity({"x-api-key": "partner-key"}, "10.0.0.5", [], ["partner-key"])
+        self.assertTrue(identity.startswith("key:"))
+        self.assertNotIn("partner-key", identity)
+
+    def test_unknown_key_falls_back_to_ip(self):
+        identity = client_identity({"x-api-key": "made-up"}, "10.0.0.5", [], ["partner-key"])
+        self.assertEqual(identity, "ip:10.0.0.5")
+
+    def test_forwarded_ip_only_from_trusted_proxy(self):
+        headers = {"x-api-key": "made-up", "x-forwarded-for": "203.0.113.7, 10.0.0.1"}
+        self.assertEqual(client_identity(headers, "127.0.0.1", ["127.0.0.1"], []), "ip:203.0.113.7")
+        self.assertEqual(client_identity(headers, "10.0.0.9", ["127.0.0.1"], []), "ip:10.0.0.9")
+
+    def test_rotating_random_keys_still_throttled(self):
+        limiter = RateLimiter({BUDGET_READ: (60, 5)})
+        delays = []
+        for _ in range(10):
+            client = client_identity({"x-api-key": uuid.uuid4().hex}, "198.51.100.20", [], ["partner-key"])
+            delays.append(limiter.check(client, BUDGET_READ))
+        self.assertEqual(delays[:5], [0.0] * 5)
+        self.assertTrue(all(delay > 0 for delay in delays[5:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
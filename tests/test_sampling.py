@@ -0,0 +1,97 @@
+import asyncio
+import time
+import unittest
+
+from mongomock_motor import AsyncMongoMockClient
+
+from caching import DataVersions
+from database import Database, DatabaseSettings
+from deadlines import current_deadline
+from sampling import SampleStore
+
+
+class RecordingCollection:
+    """Passes reads through to mongomock, which ignores maxTimeMS, and records the limits sent"""
+
+    def __init__(self, collection, limits):
+        self._collection = collection
+        self._limits = limits
+
+    def find(self, *args, **kwargs):
+        self._limits.append(kwargs.get("max_time_ms"))
+        return self._collection.find(*args, **kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        self._limits.append(kwargs.get("maxTimeMS"))
+        return self._collection.aggregate(pipeline, **kwargs)
+
+
+class RecordingDatabase:
+    def __init__(self, database):
+        self._database = database
+        self.limits = []
+
+    def __getitem__(self, name):
+        return RecordingCollection(self._database[name], self.limits)
+
+
+class SampleStoreTest(unittest.TestCase):
+    def test_build_started_by_an_expired_request_gets_the_background_limit(self):
+        raw = AsyncMongoMockClient()["world_data"]
+        database = RecordingDatabase(raw)
+
+        async def run():
+            await raw["crimes"].insert_many([{"state": "Kerala", "year": 2020 + i % 3, "cases_reported": i}
+                                             for i in range(30)])
+            settings = DatabaseSettings(background_max_time_ms=60000)
+            store = SampleStore(Database(database, settings), DataVersions(trust_ingest=True), per_stratum=5)
+            # The request that asks for the sample has already run out of time
+            current_deadline.set(time.monotonic() - 1)
+            self.assertIsNone(store.get("crimes"))
+            await store._builds["crimes"]
+            return store.get("crimes")
+
+        sample = asyncio.run(run())
+        self.assertEqual(database.limits, [60000])
+        self.assertEqual(len(sample.rows), 15)
+
+    def test_sample_reused_within_ttl_without_reliable_versions(self):
+        raw = AsyncMongoMockClient()["world_data"]
+        database = RecordingDatabase(raw)
+
+        async def run():
+            await raw["crimes"].insert_many([{"state": "Kerala", "year": 2020, "cases_reported": i} for i in range(10)])
+            store = SampleStore(Database(database, DatabaseSettings()), DataVersions(), ttl_seconds=60)
+            self.assertIsNone(store.get("crimes"))
+            await store._builds["crimes"]
+            return [store.get("crimes") for _ in range(3)]
+
+        results = asyncio.run(run())
+        self.assertTrue(all(sample is results[0] for sample in results))
+        self.assertEqual(len(database.limits), 1)
+
+    def test_failed_build_is_not_retried_on_every_call(self):
+        class FailingCollection:
+            scans = 0
+
+            def find(self, *args, **kwargs):
+                FailingCollection.scans += 1
+                raise RuntimeError("connection refused")
+
+        async def run():
+            store = SampleStore(Database({"crimes": FailingCollection()}, DatabaseSettings()),
+                                DataVersions(trust_ingest=True), retry_seconds=60)
+            store.get("crimes")
+            await asyncio.gather(store._builds["crimes"], return_exceptions=True)
+            for _ in range(5):
+                self.assertIsNone(store.get("crimes"))
+            store.retry_seconds = 0
+            store.get("crimes")
+            await asyncio.gather(store._builds["crimes"], return_exceptions=True)
+
+        asyncio.run(run())
+        self.assertEqual(FailingCollection.scans, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from caching import DataVersions
+from search import SearchIndex, SearchIndexes
+
+
+class SearchIndexesTest(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex([{"kind": "dataset", "value": "Crimes"}], [["crimes"]])
+
+    def test_index_kept_for_ttl_without_reliable_versions(self):
+        versions = DataVersions()
+        indexes = SearchIndexes(versions, ttl_seconds=60)
+        indexes.set("crimes", versions.get("crimes"), self.index)
+        self.assertIs(indexes.get("crimes"), self.index)
+        indexes.ttl_seconds = 0
+        self.assertIsNone(indexes.get("crimes"))
+
+    def test_index_dropped_when_version_moves(self):
+        versions = DataVersions(trust_ingest=True)
+        indexes = SearchIndexes(versions)
+        indexes.set("crimes", versions.get("crimes"), self.index)
+        versions.bump("crimes")
+        self.assertIsNone(indexes.get("crimes"))
+
+    def test_index_built_against_an_old_version_is_not_kept(self):
+        versions = DataVersions(trust_ingest=True)
+        indexes = SearchIndexes(versions)
+        version = versions.get("crimes")
+        versions.bump("crimes")
+        indexes.set("crimes", version, self.index)
+        self.assertIsNone(indexes.get("crimes"))
+
+    def test_search_matches_prefixes(self):
+        self.assertEqual([entry["value"] for _, entry in self.index.search("cri")], ["Crimes"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import asyncio
+import unittest
+
+import mongomock
+from mongomock_motor import AsyncMongoMockClient
+
+from states import backfill_state_ids, document_state_id, merge_conditions, state_query
+
+
+class StateQueryTest(unittest.TestCase):
+    def test_matches_codes_and_names(self):
+        query = state_query(["kerala", "Atlantis"])
+        self.assertEqual(query, {"$or": [{"state_id": {"$in": [32]}},
+                                         {"state": {"$in": ["Kerala", "kerala", "Atlantis"]}}]})
+
+    def test_unmigrated_and_unresolved_documents_match(self):
+        collection = mongomock.MongoClient().db.crimes
+        collection.insert_many([
+            {"state": "Kerala", "state_id": 32},
+            {"state": "Kerala"},
+            {"state": "Atlantis"},
+            {"state": "Goa", "state_id": 30},
+        ])
+        self.assertEqual(collection.count_documents(state_query(["Kerala", "Atlantis"])), 3)
+
+    def test_second_or_goes_under_and(self):
+        query = merge_conditions(state_query(["Goa"]), {"$or": [{"date": {"$gte": "2020-01-01"}}]})
+        self.assertEqual(query["$and"], [{"$or": [{"date": {"$gte": "2020-01-01"}}]}])
+        self.assertIn("state_id", query["$or"][0])
+
+    def test_documents_are_never_matched_fuzzily(self):
+        self.assertEqual(document_state_id({"state": "Tamil Nadu"}), 33)
+        self.assertEqual(document_state_id({"state": "orissa"}), 21)
+        self.assertIsNone(document_state_id({"state": "Karnatka"}))
+
+
+class BackfillTest(unittest.TestCase):
+    def test_adds_ids_without_rewriting_names(self):
+        async def run():
+            collection = AsyncMongoMockClient()["world_data"]["crimes"]
+            await collection.insert_many([{"state": "orissa"}, {"state": "Karnatka"}])
+            report = await backfill_state_ids(collection.database, ["crimes"])
+            docs = await collection.find({}, {"_id": 0}).sort("state", 1).to_list(None)
+            return report, docs
+
+        report, docs = asyncio.run(run())
+        self.assertEqual(report["crimes"]["updated"], 1)
+        self.assertEqual(report["crimes"]["unresolved"], ["Karnatka"])
+        self.assertEqual(docs, [{"state": "Karnatka"}, {"state": "orissa", "state_id": 21}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import asyncio
+import unittest
+
+from warmup import AccessLog, WarmupState, run_warmup
+
+
+class AccessLogTest(unittest.TestCase):
+    def setUp(self):
+        self.log = AccessLog(collection=None)
+
+    def test_client_requests_are_counted(self):
+        self.log.record("insights", "crimes", {"states": ["Kerala"]})
+        self.log.record("insights", "crimes", {"states": ["Kerala"]})
+        self.assertEqual(list(self.log._pending.values()), [2])
+
+    def test_warm_up_replays_are_not_counted(self):
+        async def replay():
+            self.log.record("insights", "crimes", {"states": ["Kerala"]})
+            return 1
+
+        async def run():
+            with self.log.replaying():
+                await run_warmup(WarmupState(), [("top_insights", replay)], timeout=5)
+            # Requests served after the warm-up count again
+            self.log.record("visualize", "crimes", {})
+
+        asyncio.run(run())
+        self.assertEqual([entry["kind"] for entry in self.log._entries.values()], ["visualize"])
+
+
+if __name__ == "__main__":
+    unittest.main()